@@ -0,0 +1,24 @@
+#!/usr/bin/python3
+"""Исполнение одного образа на многих входных файлах (`runner.run_batch`).
+
+`batch.py <code_file> <input_file>...` печатает по строке JSON на каждый вход
+в порядке аргументов: `{"input": ..., "output": ..., "instr_counter": ...,
+"ticks": ...}`.
+"""
+
+import json
+import sys
+
+import runner
+
+
+def main(code_file, input_files, engine="step", workers=None):
+    results = runner.run_batch(code_file, input_files, engine=engine, workers=workers)
+    for input_file, (output, instr_counter, ticks) in zip(input_files, results):
+        record = {"input": input_file, "output": output, "instr_counter": instr_counter, "ticks": ticks}
+        print(json.dumps(record, ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    assert len(sys.argv) >= 3, "Wrong arguments: batch.py <code_file> <input_file>..."
+    main(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+"""Бенчмарк пропускной способности модели процессора.
+
+Golden-программы и синтетические нагрузки (длинный цикл, рекурсия, массивы,
+выделение памяти, ввод-вывод) исполняются через `runner.simulation` каждым
+из движков. Для каждой пары (нагрузка, движок) измеряются время трансляции
+и загрузки образа, время исполнения (лучшее из повторов), инструкции и такты
+в секунду и пиковый RSS процесса. Каждое измерение идёт в отдельном
+процессе, чтобы пиковый RSS относился к одной нагрузке.
+
+`benchmark.py <results_file> [scale]` записывает результаты в JSON и печатает
+таблицу; `scale` увеличивает синтетические нагрузки.
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import compiler
+import runner
+from ruamel.yaml import YAML
+
+ROOT = pathlib.Path(__file__).resolve().parent
+RESULTS_VERSION = 1
+ENGINES = ("step", "blocks", "translated")
+LIMIT = 10**9
+
+# source -- текст программы, stdin -- ввод, limit -- лимит инструкций
+Workload = collections.namedtuple("Workload", "name source stdin limit")
+
+PRINT_INT = """
+int32 divide_by_10(int32 number) {
+    int32 result = 0;
+    while (number > 9) {
+        number = number - 10;
+        result = result + 1;
+    }
+    number = result;
+}
+
+void print_int(int32 j) {
+    int8 buffer[10]
+    int32 i=0;
+    do {
+        buffer[i] = j%10+48
+        i = i + 1
+        j = divide_by_10(j)
+    } while (j!=0)
+    while (i>0) {
+        i = i - 1
+        OUT(buffer[i])
+    }
+}
+"""
+
+
+def golden_workloads(pattern="golden/*.yml", limit=1500):
+    """Программы из YAML-файлов golden-тестов с их вводом (`pattern` -- шаблон
+    пути от корня проекта); лимит по умолчанию -- как у `runner.main`."""
+    yaml = YAML(typ="safe")
+    for path in sorted(ROOT.glob(pattern)):
+        with open(path, encoding="utf-8") as file:
+            golden = yaml.load(file)
+        yield Workload(path.parent.name + "/" + path.stem, golden["in_source"], golden["in_stdin"], limit)
+
+
+def synthetic_workloads(scale=1):
+    """Синтетические нагрузки; размер растёт линейно с `scale` (может быть дробным)."""
+    loop = """
+int32 i = 0
+int32 s = 0
+while (i < {n}) {{
+    s = s + i % 7
+    i = i + 1
+}}
+print_int(s)
+"""
+    recursion = """
+int32 fib(int32 n) {{
+    if (n > 1) {{
+        n = fib(n - 1) + fib(n - 2)
+    }}
+}}
+int32 k = 0
+int32 s = 0
+while (k < {n}) {{
+    s = s + fib(12)
+    k = k + 1
+}}
+print_int(s)
+"""
+    arrays = """
+int32 n = {n}
+int8 composite[n]
+int32 count = 0
+int32 i = 2
+while (i < n) {{
+    if (composite[i] == 0) {{
+        count = count + 1
+        int32 j = i * i
+        while (j < n) {{
+            composite[j] = 1
+            j = j + i
+        }}
+    }}
+    i = i + 1
+}}
+print_int(count)
+"""
+    alloc = """
+int32 k = 0
+while (k < {n}) {{
+    print_int(k)
+    k = k + 1
+}}
+"""
+    io_loop = """
+int32 c = IN()
+while (c) {
+    OUT(c)
+    c = IN()
+}
+"""
+    yield Workload("loop", PRINT_INT + loop.format(n=int(20000 * scale)), "", LIMIT)
+    yield Workload("recursion", PRINT_INT + recursion.format(n=max(1, int(5 * scale))), "", LIMIT)
+    yield Workload("arrays", PRINT_INT + arrays.format(n=int(4000 * scale)), "", LIMIT)
+    yield Workload("alloc", PRINT_INT + alloc.format(n=int(300 * scale)), "", LIMIT)
+    yield Workload("io", io_loop, "0123456789abcdef\n" * int(500 * scale), LIMIT)
+
+
+def peak_rss_kib():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss  # на macOS -- в байтах
+
+
+def measure(workload, engine, min_time=0.2):
+    """Транслирует и исполняет нагрузку, повторяя исполнение, пока суммарное
+    время не достигнет `min_time`."""
+    logging.disable(logging.WARNING)  # журнал по инструкциям и предупреждения о лимите
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        source_name = os.path.join(tmpdirname, "source.lsp")
+        target_name = os.path.join(tmpdirname, "target.bin")
+        with open(source_name, "w", encoding="utf-8") as file:
+            file.write(workload.source)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            compiler.main(source_name, target_name)
+        compile_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        mm = runner.MemoryManager()
+        runner.load_program(mm, target_name)
+        load_seconds = time.perf_counter() - start
+
+    tokens = [ord(char) for char in workload.stdin] + [0]
+    runs, total, best = 0, 0.0, None
+    while runs == 0 or total < min_time:
+        machine = mm.copy()
+        start = time.perf_counter()
+        output, instr_counter, ticks = runner.simulation(machine, list(tokens), workload.limit, engine=engine)
+        seconds = time.perf_counter() - start
+        runs, total = runs + 1, total + seconds
+        best = seconds if best is None else min(best, seconds)
+    return {
+        "workload": workload.name,
+        "engine": engine,
+        "image_words": len(mm.memory),
+        "compile_seconds": compile_seconds,
+        "load_seconds": load_seconds,
+        "runs": runs,
+        "seconds": best,
+        "instr_counter": instr_counter,
+        "ticks": ticks,
+        "instr_per_second": instr_counter / best if best else None,
+        "ticks_per_second": ticks / best if best else None,
+        "output_length": len(output),
+        "peak_rss_kib": peak_rss_kib(),
+    }
+
+
+def run(workloads, engines=ENGINES, min_time=0.2, isolate=True):
+    """Измеряет каждую нагрузку каждым движком; при `isolate` -- каждое
+    измерение в новом процессе."""
+    results = []
+    for workload in workloads:
+        for engine in engines:
+            if not isolate:
+                results.append(measure(workload, engine, min_time))
+                continue
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            with concurrent.futures.ProcessPoolExecutor(1, context) as executor:
+                results.append(executor.submit(measure, workload, engine, min_time).result())
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def write_results(file_name, results, scale):
+    with open(file_name, "w", encoding="utf-8") as file:
+        json.dump(
+            {"version": RESULTS_VERSION, "environment": environment(), "scale": scale, "results": results},
+            file,
+            indent=2,
+        )
+        file.write("\n")
+
+
+def render(results):
+    yield "{:24} {:10} {:>12} {:>12} {:>14} {:>14} {:>10} {:>10}".format(
+        "workload", "engine", "instr", "seconds", "instr/s", "ticks/s", "load, ms", "rss, KiB"
+    )
+    for result in results:
+        yield "{:24} {:10} {:>12} {:>12.4f} {:>14.0f} {:>14.0f} {:>10.2f} {:>10}".format(
+            result["workload"],
+            result["engine"],
+            result["instr_counter"],
+            result["seconds"],
+            result["instr_per_second"] or 0,
+            result["ticks_per_second"] or 0,
+            result["load_seconds"] * 1000,
+            result["peak_rss_kib"],
+        )
+
+
+def main(results_file, scale=1):
+    workloads = list(golden_workloads()) + list(synthetic_workloads(scale))
+    results = run(workloads)
+    write_results(results_file, results, scale)
+    for line in render(results):
+        print(line)
+
+
+if __name__ == "__main__":
+    assert len(sys.argv) in (2, 3), "Wrong arguments: benchmark.py <results_file> [scale]"
+    main(sys.argv[1], float(sys.argv[2]) if len(sys.argv) == 3 else 1)
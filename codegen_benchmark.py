@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""Бенчмарк качества генерируемого кода.
+
+Эталонные программы (`codegen/*.yml` и `golden/prob2.yml`, формат golden-тестов)
+транслируются `compiler.main` и исполняются `runner.simulation`. Для каждой
+программы записываются число инструкций и тактов модели и размер кода и
+образа в словах -- от скорости хост-машины они не зависят. Результаты
+сравниваются с базовыми значениями из `codegen/baseline.json`: рост любой
+метрики -- регрессия, уменьшение без роста остальных -- улучшение.
+
+`codegen_benchmark.py report` печатает отчёт (код возврата 1 при регрессиях),
+`codegen_benchmark.py update` перезаписывает базовые значения.
+"""
+
+import contextlib
+import io
+import json
+import logging
+import os
+import pathlib
+import sys
+import tempfile
+
+import benchmark
+import compiler
+import runner
+
+CORPUS = ("golden/prob2.yml", "codegen/*.yml")  # шаблоны путей от корня проекта
+BASELINE = benchmark.ROOT / "codegen" / "baseline.json"
+METRICS = ("instr_counter", "ticks", "code_words", "image_words")
+LIMIT = 10**7
+
+
+def corpus(patterns=CORPUS):
+    for pattern in patterns:
+        yield from benchmark.golden_workloads(pattern, LIMIT)
+
+
+def measure(workload):
+    """Метрики программы: инструкции и такты исполнения, слова кода функций
+    (`MemoryManager.symbols`) и всего образа."""
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        source_name = os.path.join(tmpdirname, "source.lsp")
+        target_name = os.path.join(tmpdirname, "target.bin")
+        with open(source_name, "w", encoding="utf-8") as file:
+            file.write(workload.source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            compiler.main(source_name, target_name)
+        mm = runner.MemoryManager()
+        runner.load_program(mm, target_name)
+    code_words = sum(end - start for start, end, _ in mm.symbols)
+    image_words = len(mm.memory)
+    tokens = [ord(char) for char in workload.stdin] + [0]
+    _, instr_counter, ticks = runner.simulation(mm, tokens, workload.limit, engine="blocks")
+    return {"instr_counter": instr_counter, "ticks": ticks, "code_words": code_words, "image_words": image_words}
+
+
+def measure_all(workloads=None):
+    return {workload.name: measure(workload) for workload in (corpus() if workloads is None else workloads)}
+
+
+def load_baseline(file_name=BASELINE):
+    if not pathlib.Path(file_name).exists():
+        return {}
+    with open(file_name, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_baseline(results, file_name=BASELINE):
+    with open(file_name, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+def compare(results, baseline):
+    """Сравнивает метрики с базовыми: [(программа, статус, {метрика: (было,
+    стало)})], статус -- "regression", "improvement", "same", "new" (нет
+    базовых значений) или "missing" (программы больше нет в корпусе)."""
+    report = []
+    for name in sorted(set(results) | set(baseline)):
+        if name not in results:
+            report.append((name, "missing", {}))
+            continue
+        if name not in baseline:
+            report.append((name, "new", {metric: (None, results[name][metric]) for metric in METRICS}))
+            continue
+        changes = {metric: (baseline[name].get(metric), results[name][metric]) for metric in METRICS}
+        if any(old is not None and new > old for old, new in changes.values()):
+            status = "regression"
+        elif any(old is not None and new < old for old, new in changes.values()):
+            status = "improvement"
+        else:
+            status = "same"
+        report.append((name, status, changes))
+    return report
+
+
+def render(report):
+    for name, status, changes in report:
+        yield "{:24} {}".format(name, status)
+        for metric, (old, new) in changes.items():
+            if old is None or old == new:
+                yield "    {:14} {:>10}".format(metric, new)
+            else:
+                yield "    {:14} {:>10} -> {:<10} {:+.1%}".format(metric, old, new, (new - old) / old if old else 1)
+
+
+def main(command):
+    results = measure_all()
+    if command == "update":
+        write_baseline(results)
+        return 0
+    report = compare(results, load_baseline())
+    for line in render(report):
+        print(line)
+    return 1 if any(status == "regression" for _, status, _ in report) else 0
+
+
+if __name__ == "__main__":
+    assert len(sys.argv) == 2, "Wrong arguments: codegen_benchmark.py report|update"
+    assert sys.argv[1] in ("report", "update"), "Wrong arguments: codegen_benchmark.py report|update"
+    sys.exit(main(sys.argv[1]))
@@ -1,153 +1,107 @@
+import bisect
+import hashlib
+import json
+import re
 import sys
 
+import image
+
 COMPILE_SETUP = {
     "MIN_ABS_VALUE_FOR_STORE_NUMBER_IN_CONSTANTS": 127,
     "STACK_SIZE": 512,  # *4 bytes
 }
 
 
-def tokenize(programm):
-    in_string = False
-    _string = ""
-    _string_q = ""
-    in_varible = False
-    _varible = ""
-    types = ["int32", "int16", "int8", "str", "void"]
-    moves = ["do", "while", "for", "if"]
-    math = ["&&", "||", ",", ">>", "<<", "+", "-", "%", "*", "!=", "==", "<", ">", "=", "[", "]", "(", ")", "{", "}"]
-    sep = [" ", "\t", "\r"]
-    instruction_sep = [";", "\n"]
-    string_q = ["'", '"', "`"]
-    i = 0
-    tokens = []
-    while i < len(programm):
-        end = False
-        if in_string:  # END OF STRING
-            if programm.startswith(_string_q, i):
-                tokens.append({"v": _string, "t": "STRING", "pos": i - len(_string) - len(_string_q)})  # TODO TEST -1
-                in_string = False
-                i += len(_string_q)
-                continue
-            _string += programm[i]
-            i += 1
-            continue
-
-        if programm.startswith("/*", i):
-            pos = programm.find("*/", i)
-            if pos == -1:
-                print("comment at " + str(i) + " not closed")
-                exit(1)
-            i = pos + 2
-            continue
-
-        if programm.startswith("//", i):
-            pos = programm.find("\n", i)
-            if pos == -1:
-                break
-            i = pos
-            continue
-
-        for s in string_q:  # START OF STRING
-            if programm.startswith(s, i):
-                end = True
-                if in_varible:
-                    tokens.append({"v": _varible, "t": "VARIBLE", "pos": i - len(_varible)})  # TODO TEST -1
-                    in_varible = False
-                in_string = True
-                _string = ""
-                _string_q = s
-                i += len(s)
-                break
-        if end:
-            continue
-
-        for s in sep:  # NO VARIBLE: , \t
-            if programm.startswith(s, i):
-                end = True
-                if in_varible:
-                    tokens.append({"v": _varible, "t": "VARIBLE", "pos": i - len(_varible)})  # TODO TEST -1
-                    in_varible = False
-                i += len(s)
-                break
-        if end:
-            continue
-
-        for s in instruction_sep:  # ;, \n
-            if programm.startswith(s, i):
-                end = True
-                if in_varible:
-                    tokens.append({"v": _varible, "t": "VARIBLE", "pos": i - len(_varible)})
-                    in_varible = False
-                tokens.append({"t": "SEPARATOR", "pos": i})
-                i += len(s)
-                break
-        if end:
-            continue
+# Лексемы: один регулярный шаблон, группа совпадения определяет вид лексемы.
+# Идентификатор -- любые символы, кроме разделителей, кавычек и операторов;
+# одиночные "&", "|", "!", "/" операторами не являются.
+TOKEN_RE = re.compile(
+    r"""
+      (?P<comment>/\*.*?\*/|//[^\n]*)
+    | (?P<open_comment>/\*)
+    | (?P<string>(?P<quote>['"`])(?P<text>.*?)(?P=quote))
+    | (?P<open_string>['"`])
+    | (?P<space>[ \t\r]+)
+    | (?P<separator>[;\n])
+    | (?P<math>&&|\|\||>>|<<|!=|==|[,+\-%*<>=\[\](){}])
+    | (?P<word>(?:[^ \t\r\n;,+\-%*<>=\[\](){}'"`&|!/]|&(?!&)|\|(?!\|)|!(?!=)|/(?![*/]))+)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+# ссылка в строке ассемблера до компоновки: %вид:имя:позиция%, вид -- v (адрес
+# переменной), Rv/ARv (регистр по размеру переменной/элемента массива), f (адрес
+# функции), g (адрес строковой константы; имя -- её номер)
+RELOCATION_RE = re.compile(r"%([^%:]*):([^%]*):([^%:]*)%")
+KEYWORDS = {
+    **dict.fromkeys(["do", "while", "for", "if"], "BRANCHING"),
+    **dict.fromkeys(["int32", "int16", "int8", "str", "void"], "TYPE"),
+}
 
-        for s in math:  # OPERATORS
-            if programm.startswith(s, i):
-                end = True
-                if in_varible:
-                    tokens.append({"v": _varible, "t": "VARIBLE", "pos": i - len(_varible)})
-                    in_varible = False
-                tokens.append({"v": s, "t": "MATH", "pos": i})
-                i += len(s)
-                break
-        if end:
-            continue
 
-        if in_varible:
-            _varible += programm[i]
-            i += 1
-            continue
+class Token:
+    """Лексема: вид `t`, значение `v` (None у разделителя) и позиция `pos`."""
 
-        for s in moves:
-            if programm.startswith(s, i):
-                end = True
-                tokens.append({"v": s, "t": "BRANCHING", "pos": i})
-                i += len(s)
-                break
-        if end:
-            continue
+    __slots__ = ("pos", "t", "v")
 
-        for s in types:
-            if programm.startswith(s, i):
-                end = True
-                tokens.append({"v": s, "t": "TYPE", "pos": i})
-                i += len(s)
-                break
-        if end:
-            continue
-
-        in_varible = True
-        _varible = programm[i]
-        i += 1
-    if in_string:
-        print("string at " + str(i - len(_string)) + " not closed")
-        exit(1)
-    if in_varible:
-        tokens.append({"v": _varible, "t": "VARIBLE", "pos": i - len(_varible)})
-
-    def check_and_transforn_number(x):
-        if x["t"] != "VARIBLE":
-            return x
-        import re
-
-        if re.match(r"(0|[1-9]\d*)", x["v"]):
-            x["v"] = int(x["v"])
-            x["t"] = "NUMBER"
-            return x
-        else:
-            return x
+    def __init__(self, t, v, pos):
+        self.t = t
+        self.v = v
+        self.pos = pos
 
-    tokens = list(map(check_and_transforn_number, tokens))
-    return tokens
+    def __repr__(self):
+        return "Token({!r}, {!r}, {!r})".format(self.t, self.v, self.pos)
+
+
+def tokenize(programm, cache=None):
+    """Лениво выдаёт лексемы программы за один проход `TOKEN_RE`. Функция, текст
+    которой есть в кэше (`FunctionCache`), выдаётся одной лексемой FUNCTION со
+    значением -- ключом записи, её текст не разбирается."""
+    heads = {} if cache is None else cache.heads()
+    longest = max(map(len, heads), default=0)
+    end = 0
+    while end is not None:
+        start, end = end, None
+        for match in TOKEN_RE.finditer(programm, start):
+            kind = match.lastgroup
+            pos = match.start()
+            if kind == "word":
+                word = match.group()
+                if word[0].isdigit():
+                    yield Token("NUMBER", int(word), pos)
+                    continue
+                kind = KEYWORDS.get(word, "VARIBLE")
+                if kind == "TYPE" and heads:
+                    # заголовок "тип имя(" сверяется с записями кэша, текст
+                    # функции целиком -- по хэшу
+                    paren = programm.find("(", pos, pos + longest)
+                    for length, key in heads.get(programm[pos : paren + 1], ()) if paren >= 0 else ():
+                        if cache.key(programm[pos : pos + length]) == key:
+                            yield Token("FUNCTION", key, pos)
+                            end = pos + length
+                            break
+                    if end is not None:
+                        break
+                yield Token(kind, word, pos)
+            elif kind == "math":
+                yield Token("MATH", match.group(), pos)
+            elif kind == "separator":
+                yield Token("SEPARATOR", None, pos)
+            elif kind == "string":
+                yield Token("STRING", match.group("text"), pos)
+            elif kind == "open_string":
+                print("string at " + str(pos + 1) + " not closed")
+                exit(1)
+            elif kind == "open_comment":
+                print("comment at " + str(pos) + " not closed")
+                exit(1)
 
 
 ast_errors = []
 
 
 class ASTNode:
+    __slots__ = ("children", "pos", "type", "value")
+
     def __init__(self, value, type, pos, children=None):
         self.value = value
         self.type = type
@@ -155,14 +109,37 @@ class ASTNode:
         self.children = [] if children is None else children
 
 
-def build_ast(tokens):
+class TokenCursor:
+    """Курсор по потоку лексем: `peek()` -- текущая лексема (None в конце),
+    `take()` возвращает её и переходит к следующей. Лексемы читаются из
+    итератора по одной, поэтому разбор линеен по их числу."""
+
+    __slots__ = ("current", "tokens")
+
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.current = next(self.tokens, None)
+
+    def __bool__(self):
+        return self.current is not None
+
+    def peek(self):
+        return self.current
+
+    def take(self):
+        token = self.current
+        self.current = next(self.tokens, None)
+        return token
+
+
+def build_ast(tokens, cache=None):
     # do REMOVE_TOKEN(); while (f != True)
     def skip_sep(tokens):
         if not tokens:
             ast_errors.append("Unexpected EOF")
             return False
-        while (len(tokens) > 0) and (tokens[0] is not None) and tokens[0]["t"] == "SEPARATOR":
-            tokens.pop(0)
+        while tokens and tokens.peek().t == "SEPARATOR":
+            tokens.take()
         if not tokens:
             ast_errors.append("Unexpected EOF")
             return False
@@ -173,12 +150,12 @@ def build_ast(tokens):
         if not tokens:
             ast_errors.append("Unexpected EOF")
             return True
-        if not f(tokens[0]):
+        if not f(tokens.peek()):
             ast_errors.append(
                 "Unexpected token "
-                + ('"' + tokens[0]["v"] + '" ' if "v" in tokens[0] else "")
+                + ('"' + tokens.peek().v + '" ' if tokens.peek().v is not None else "")
                 + "at "
-                + str(tokens[0]["pos"])
+                + str(tokens.peek().pos)
             )
             return True
         return False
@@ -190,88 +167,88 @@ def build_ast(tokens):
     def parse_branching(tokens):
         if not tokens:
             return None
-        b_type = tokens.pop(0)  # ["do", "while", "for", "if"]
-        node = ASTNode(b_type["v"], "BRANCHING", b_type["pos"])
+        b_type = tokens.take()  # ["do", "while", "for", "if"]
+        node = ASTNode(b_type.v, "BRANCHING", b_type.pos)
         if not skip_sep(tokens):
             return node
 
-        if b_type["v"] == "do":
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "{"):
+        if b_type.v == "do":
+            if check(tokens, lambda x: x.t == "MATH" and x.v == "{"):
                 return node
-            tokens.pop(0)
+            tokens.take()
             node.children = parse_instructions(tokens)
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "}"):
+            if check(tokens, lambda x: x.t == "MATH" and x.v == "}"):
                 return node
-            tokens.pop(0)
+            tokens.take()
             if not skip_sep(tokens):
                 return node
-            if check(tokens, lambda x: x["t"] == "BRANCHING" and x["v"] == "while"):
+            if check(tokens, lambda x: x.t == "BRANCHING" and x.v == "while"):
                 return node
-            tokens.pop(0)
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "("):
+            tokens.take()
+            if check(tokens, lambda x: x.t == "MATH" and x.v == "("):
                 return node
-            tokens.pop(0)
+            tokens.take()
             node.children.append(parse_formula(tokens))
             if node.children[-1] is None:
                 return node
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == ")"):
+            if check(tokens, lambda x: x.t == "MATH" and x.v == ")"):
                 return node
-            tokens.pop(0)
+            tokens.take()
             return node
-        if b_type["v"] == "for":
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "("):
+        if b_type.v == "for":
+            if check(tokens, lambda x: x.t == "MATH" and x.v == "("):
                 return node
-            tokens.pop(0)
+            tokens.take()
             node.children.append(parse_instr(tokens))
             if node.children[-1] is None:
                 return node
-            if check(tokens, lambda x: x["t"] == "SEPARATOR"):
+            if check(tokens, lambda x: x.t == "SEPARATOR"):
                 return node
-            tokens.pop(0)
+            tokens.take()
             node.children.append(parse_formula(tokens))
             if node.children[-1] is None:
                 return node
-            if check(tokens, lambda x: x["t"] == "SEPARATOR"):
+            if check(tokens, lambda x: x.t == "SEPARATOR"):
                 return node
-            tokens.pop(0)
+            tokens.take()
             node.children.append(parse_instr(tokens))
             if node.children[-1] is None:
                 return node
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == ")"):
+            if check(tokens, lambda x: x.t == "MATH" and x.v == ")"):
                 return node
-            tokens.pop(0)
+            tokens.take()
             if not skip_sep(tokens):
                 return node
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "{"):
+            if check(tokens, lambda x: x.t == "MATH" and x.v == "{"):
                 return node
-            tokens.pop(0)
+            tokens.take()
             if not skip_sep(tokens):
                 return node
-            node.children.append(ASTNode("BODY", "INSTRUCTIONS", tokens[0]["pos"], parse_instructions(tokens)))
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "}"):
+            node.children.append(ASTNode("BODY", "INSTRUCTIONS", tokens.peek().pos, parse_instructions(tokens)))
+            if check(tokens, lambda x: x.t == "MATH" and x.v == "}"):
                 return node
-            tokens.pop(0)
+            tokens.take()
             return node
-        if b_type["v"] == "if" or b_type["v"] == "while":
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "("):
+        if b_type.v == "if" or b_type.v == "while":
+            if check(tokens, lambda x: x.t == "MATH" and x.v == "("):
                 return node
-            tokens.pop(0)
+            tokens.take()
             node.children.append(parse_formula(tokens))
             if node.children[-1] is None:
                 return node
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == ")"):
+            if check(tokens, lambda x: x.t == "MATH" and x.v == ")"):
                 return node
-            tokens.pop(0)
+            tokens.take()
             if not skip_sep(tokens):
                 return node
-            if tokens[0]["t"] == "MATH" and tokens[0]["v"] == "{":  # have body
-                tokens.pop(0)
-                node.children.append(ASTNode("BODY", "INSTRUCTIONS", tokens[0]["pos"], parse_instructions(tokens)))
-                if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "}"):
+            if tokens.peek().t == "MATH" and tokens.peek().v == "{":  # have body
+                tokens.take()
+                node.children.append(ASTNode("BODY", "INSTRUCTIONS", tokens.peek().pos, parse_instructions(tokens)))
+                if check(tokens, lambda x: x.t == "MATH" and x.v == "}"):
                     return node
-                tokens.pop(0)
+                tokens.take()
             else:
-                node.children.append(ASTNode("BODY", "INSTRUCTIONS", tokens[0]["pos"], [parse_instr(tokens)]))
+                node.children.append(ASTNode("BODY", "INSTRUCTIONS", tokens.peek().pos, [parse_instr(tokens)]))
             return node
         return None
 
@@ -281,23 +258,23 @@ def build_ast(tokens):
             return []
         list = []
         while tokens:
-            if tokens[0]["t"] == "MATH" and tokens[0]["v"] == ")":
+            if tokens.peek().t == "MATH" and tokens.peek().v == ")":
                 break
-            if check(tokens, lambda x: x["t"] == "TYPE"):
+            if check(tokens, lambda x: x.t == "TYPE"):
                 # print('1')
                 return None
-            _type = tokens.pop(0)
-            if check(tokens, lambda x: x["t"] == "VARIBLE"):
+            _type = tokens.take()
+            if check(tokens, lambda x: x.t == "VARIBLE"):
                 # print('2')
                 return None
-            _name = tokens.pop(0)
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] in (",", ")")):
+            _name = tokens.take()
+            if check(tokens, lambda x: x.t == "MATH" and x.v in (",", ")")):
                 # print('3')
                 return None
-            list.append([_type["v"], _name["v"], _type["pos"]])
-            if tokens[0]["v"] == ")":
+            list.append([_type.v, _name.v, _type.pos])
+            if tokens.peek().v == ")":
                 break
-            tokens.pop(0)
+            tokens.take()
         return list
 
     # [
@@ -320,45 +297,45 @@ def build_ast(tokens):
         if not tokens:
             return None
 
-        node = ASTNode("FORMULA", "FORMULA", tokens[0]["pos"])
+        node = ASTNode("FORMULA", "FORMULA", tokens.peek().pos)
         input_stack = []
         tmp = 0
         while tokens:
-            child = tokens[0]
+            child = tokens.peek()
             if child is None:
                 break
-            if child["t"] == "MATH" and child["v"] == "(":
+            if child.t == "MATH" and child.v == "(":
                 tmp += 1
-            if child["t"] == "MATH" and child["v"] == "[":
+            if child.t == "MATH" and child.v == "[":
                 tmp += 1
-            if child["t"] == "MATH" and child["v"] == ")":
+            if child.t == "MATH" and child.v == ")":
                 tmp -= 1
                 if tmp < 0:
                     break
-            if child["t"] == "MATH" and child["v"] == "]":
+            if child.t == "MATH" and child.v == "]":
                 tmp -= 1
                 if tmp < 0:
                     break
-            if child["t"] == "MATH" and child["v"] == ",":
+            if child.t == "MATH" and child.v == ",":
                 if tmp <= 0:
                     break
-            if child["t"] == "SEPARATOR":
+            if child.t == "SEPARATOR":
                 if tmp <= 0:
                     break
                 continue
-            if child["t"] == "MATH" and child["v"] in ("{", "}"):
+            if child.t == "MATH" and child.v in ("{", "}"):
                 if tmp <= 0:
                     break
                 else:
                     ast_errors.append(
                         "Unexpected token "
-                        + ('"' + tokens[0]["v"] + '" ' if "v" in tokens[0] else "")
+                        + ('"' + tokens.peek().v + '" ' if tokens.peek().v is not None else "")
                         + "at "
-                        + str(tokens[0]["pos"])
+                        + str(tokens.peek().pos)
                     )
                     break
             input_stack.append(child)
-            tokens.pop(0)
+            tokens.take()
 
         input_stack = list(reversed(input_stack))
         output_tokens = []
@@ -373,7 +350,7 @@ def build_ast(tokens):
             if stack1:
                 stack2.append(stack1.pop())
                 return False
-            ast_errors.append("Unexpected token " + ('"' + t["v"] + '" ' if "v" in t else "") + "at " + str(t["pos"]))
+            ast_errors.append("Unexpected token " + ('"' + t.v + '" ' if t.v is not None else "") + "at " + str(t.pos))
             return True
 
         def cmp_op(op1, op2):
@@ -383,14 +360,14 @@ def build_ast(tokens):
 
         while input_stack:
             t = input_stack[-1]
-            if t["t"] == "VARIBLE":
-                if len(input_stack) > 1 and input_stack[-2]["t"] == "MATH" and input_stack[-2]["v"] == "(":
+            if t.t == "VARIBLE":
+                if len(input_stack) > 1 and input_stack[-2].t == "MATH" and input_stack[-2].v == "(":
                     if move(input_stack, tokens_stack):
                         break
                     if move(input_stack, tokens_stack):
                         break
                     continue
-                if len(input_stack) > 1 and input_stack[-2]["t"] == "MATH" and input_stack[-2]["v"] == "[":
+                if len(input_stack) > 1 and input_stack[-2].t == "MATH" and input_stack[-2].v == "[":
                     if move(input_stack, tokens_stack):
                         break
                     if move(input_stack, tokens_stack):
@@ -398,63 +375,63 @@ def build_ast(tokens):
                     continue
                 if move(input_stack, output_tokens):
                     break
-            elif t["t"] == "NUMBER":
+            elif t.t == "NUMBER":
                 move(input_stack, output_tokens)
-            elif t["t"] == "STRING":
+            elif t.t == "STRING":
                 move(input_stack, output_tokens)
-            elif t["t"] == "MATH" and t["v"] in ("&&", "||", ">>", "<<", "+", "-", "%", "*", "!=", "==", "<", ">"):
+            elif t.t == "MATH" and t.v in ("&&", "||", ">>", "<<", "+", "-", "%", "*", "!=", "==", "<", ">"):
                 while (
                     len(tokens_stack)
-                    and tokens_stack[-1]["t"] == "MATH"
-                    and tokens_stack[-1]["v"] in ("&&", "||", ">>", "<<", ",", "+", "-", "%", "*", "!=", "==", "<", ">")
-                    and cmp_op(tokens_stack[-1]["v"], t["v"])
+                    and tokens_stack[-1].t == "MATH"
+                    and tokens_stack[-1].v in ("&&", "||", ">>", "<<", ",", "+", "-", "%", "*", "!=", "==", "<", ">")
+                    and cmp_op(tokens_stack[-1].v, t.v)
                 ):
                     if move(tokens_stack, output_tokens):
                         break
                 if move(input_stack, tokens_stack):
                     break
-            elif t["t"] == "MATH" and t["v"] == "(":
+            elif t.t == "MATH" and t.v == "(":
                 if move(input_stack, tokens_stack):
                     break
-                # if input_stack and input_stack[-1]["t"] == "VARIBLE":
+                # if input_stack and input_stack[-1].t == "VARIBLE":
                 #    if move(input_stack, tokens_stack):
                 #        break
-            elif t["t"] == "MATH" and t["v"] == ")":
+            elif t.t == "MATH" and t.v == ")":
                 while (
                     tokens_stack
-                    and tokens_stack[-1]["t"] == "MATH"
-                    and tokens_stack[-1]["v"] in ("&&", "||", ">>", "<<", ",", "+", "-", "%", "*", "!=", "==", "<", ">")
+                    and tokens_stack[-1].t == "MATH"
+                    and tokens_stack[-1].v in ("&&", "||", ">>", "<<", ",", "+", "-", "%", "*", "!=", "==", "<", ">")
                 ):
                     if move(tokens_stack, output_tokens):
                         break
-                if len(tokens_stack) == 0 or not (tokens_stack[-1]["t"] == "MATH" and tokens_stack[-1]["v"] == "("):
+                if len(tokens_stack) == 0 or not (tokens_stack[-1].t == "MATH" and tokens_stack[-1].v == "("):
                     ast_errors.append(
-                        "Unexpected token " + ('"' + t["v"] + '" ' if "v" in t else "") + "at " + str(t["pos"])
+                        "Unexpected token " + ('"' + t.v + '" ' if t.v is not None else "") + "at " + str(t.pos)
                     )
                     break
                 if move(tokens_stack, remove_stack):
                     break
-                if len(tokens_stack) and tokens_stack[-1]["t"] == "VARIBLE":
-                    tokens_stack[-1]["t"] = "CALC_FUNCTION"
+                if len(tokens_stack) and tokens_stack[-1].t == "VARIBLE":
+                    tokens_stack[-1].t = "CALC_FUNCTION"
                     if move(tokens_stack, output_tokens):
                         break
                 if move(input_stack, remove_stack):
                     break
-            elif t["t"] == "MATH" and t["v"] == "[":
+            elif t.t == "MATH" and t.v == "[":
                 ast_errors.append(
-                    "Unexpected token " + ('"' + t["v"] + '" ' if "v" in t else "") + "at " + str(t["pos"])
+                    "Unexpected token " + ('"' + t.v + '" ' if t.v is not None else "") + "at " + str(t.pos)
                 )
                 break
-            elif t["t"] == "MATH" and t["v"] == "]":
+            elif t.t == "MATH" and t.v == "]":
                 while (
                     len(tokens_stack)
-                    and tokens_stack[-1]["t"] == "MATH"
-                    and tokens_stack[-1]["v"] in ("&&", "||", ">>", "<<", ",", "+", "-", "%", "*", "!=", "==", "<", ">")
+                    and tokens_stack[-1].t == "MATH"
+                    and tokens_stack[-1].v in ("&&", "||", ">>", "<<", ",", "+", "-", "%", "*", "!=", "==", "<", ">")
                 ):
                     move(tokens_stack, output_tokens)
-                if len(tokens_stack) == 0 or not (tokens_stack[-1]["t"] == "MATH" and tokens_stack[-1]["v"] == "["):
+                if len(tokens_stack) == 0 or not (tokens_stack[-1].t == "MATH" and tokens_stack[-1].v == "["):
                     ast_errors.append(
-                        "Unexpected token " + ('"' + t["v"] + '" ' if "v" in t else "") + "at " + str(t["pos"])
+                        "Unexpected token " + ('"' + t.v + '" ' if t.v is not None else "") + "at " + str(t.pos)
                     )
                     break
                 if move(tokens_stack, remove_stack):
@@ -463,30 +440,28 @@ def build_ast(tokens):
                     break
                 if move(input_stack, remove_stack):
                     break
-                output_tokens[-1]["t"] = "CALC_ARRAY"
-            elif t["t"] == "MATH" and t["v"] == ",":
+                output_tokens[-1].t = "CALC_ARRAY"
+            elif t.t == "MATH" and t.v == ",":
                 while (
                     tokens_stack
-                    and tokens_stack[-1]["t"] == "MATH"
-                    and tokens_stack[-1]["v"] in ("&&", "||", ">>", "<<", ",", "+", "-", "%", "*", "!=", "==", "<", ">")
+                    and tokens_stack[-1].t == "MATH"
+                    and tokens_stack[-1].v in ("&&", "||", ">>", "<<", ",", "+", "-", "%", "*", "!=", "==", "<", ">")
                 ):
                     if move(tokens_stack, output_tokens):
                         break
                 if len(tokens_stack) < 2 or not (
-                    tokens_stack[-1]["t"] == "MATH"
-                    and tokens_stack[-1]["v"] == "("
-                    and tokens_stack[-2]["t"] == "VARIBLE"
+                    tokens_stack[-1].t == "MATH" and tokens_stack[-1].v == "(" and tokens_stack[-2].t == "VARIBLE"
                 ):
                     ast_errors.append(
-                        "Unexpected token " + ('"' + t["v"] + '" ' if "v" in t else "") + "at " + str(t["pos"])
+                        "Unexpected token " + ('"' + t.v + '" ' if t.v is not None else "") + "at " + str(t.pos)
                     )
                     break
-                tokens_stack[-2]["v"] += "-"
+                tokens_stack[-2].v += "-"
                 if move(input_stack, remove_stack):
                     break
             else:
                 ast_errors.append(
-                    "Unexpected token " + ('"' + t["v"] + '" ' if "v" in t else "") + "at " + str(t["pos"])
+                    "Unexpected token " + ('"' + t.v + '" ' if t.v is not None else "") + "at " + str(t.pos)
                 )
                 break
 
@@ -494,17 +469,17 @@ def build_ast(tokens):
             return node
         while (
             tokens_stack
-            and tokens_stack[-1]["t"] == "MATH"
-            and tokens_stack[-1]["v"] in ("&&", "||", ">>", "<<", ",", "+", "-", "%", "*", "!=", "==", "<", ">")
+            and tokens_stack[-1].t == "MATH"
+            and tokens_stack[-1].v in ("&&", "||", ">>", "<<", ",", "+", "-", "%", "*", "!=", "==", "<", ">")
         ):
             move(tokens_stack, output_tokens)
-        node.children = list(map(lambda x: ASTNode(x["v"], x["t"], x["pos"]), output_tokens))
+        node.children = list(map(lambda x: ASTNode(x.v, x.t, x.pos), output_tokens))
         if tokens_stack:
             ast_errors.append(
                 "Unexpected token "
-                + ('"' + tokens_stack[-1]["v"] + '" ' if "v" in tokens_stack[-1] else "")
+                + ('"' + tokens_stack[-1].v + '" ' if tokens_stack[-1].v is not None else "")
                 + "at "
-                + str(tokens_stack[-1]["pos"])
+                + str(tokens_stack[-1].pos)
             )
         return node
 
@@ -514,105 +489,122 @@ def build_ast(tokens):
     def parse_instr(tokens):
         if not tokens:
             return None
-        current_token = tokens[0]
+        current_token = tokens.peek()
 
-        if current_token["t"] == "BRANCHING":  # <instr> ::= <branching>
+        if current_token.t == "BRANCHING":  # <instr> ::= <branching>
             return parse_branching(tokens)
 
-        elif current_token["t"] == "TYPE":
-            var_type = tokens.pop(0)["v"]
-            if check(tokens, lambda x: x["t"] == "VARIBLE"):
+        elif current_token.t == "TYPE":
+            var_type = tokens.take().v
+            if check(tokens, lambda x: x.t == "VARIBLE"):
                 return None
-            var_name = tokens.pop(0)["v"]
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] in ("[", "=", "(")):
+            var_name = tokens.take().v
+            if check(tokens, lambda x: x.t == "MATH" and x.v in ("[", "=", "(")):
                 return None
-            if tokens[0]["v"] == "=":  # <instr> ::= <type> <name>=<formula>
-                tokens.pop(0)
+            if tokens.peek().v == "=":  # <instr> ::= <type> <name>=<formula>
+                tokens.take()
                 ch = parse_formula(tokens)
                 if ch is None:
                     return None
-                return ASTNode(
-                    {"type": var_type, "name": var_name}, "DECLARAT_VARIBLE", current_token["pos"], ch.children
-                )
-            elif tokens[0]["v"] == "[":  # <instr> ::= <type> <name>[<formula>]
-                tokens.pop(0)
+                return ASTNode({"type": var_type, "name": var_name}, "DECLARAT_VARIBLE", current_token.pos, ch.children)
+            elif tokens.peek().v == "[":  # <instr> ::= <type> <name>[<formula>]
+                tokens.take()
                 ch = parse_formula(tokens)
                 if ch is None:
                     return None
-                if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "]"):
+                if check(tokens, lambda x: x.t == "MATH" and x.v == "]"):
                     return None
-                tokens.pop(0)
+                tokens.take()
                 return ASTNode(
-                    {"type": "A" + var_type, "name": var_name}, "DECLARAT_ARRAY", current_token["pos"], ch.children
+                    {"type": "A" + var_type, "name": var_name}, "DECLARAT_ARRAY", current_token.pos, ch.children
                 )
-            elif tokens[0]["v"] == "(":  # <instr> ::= <type> <name>(<arg>) {<instructions>}
-                tokens.pop(0)
+            elif tokens.peek().v == "(":  # <instr> ::= <type> <name>(<arg>) {<instructions>}
+                tokens.take()
                 ch = parse_args(tokens)
                 if ch is None:
                     return None
-                if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == ")"):
+                if check(tokens, lambda x: x.t == "MATH" and x.v == ")"):
                     return None
-                tokens.pop(0)
+                tokens.take()
                 if not skip_sep(tokens):
                     return node
-                if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "{"):
+                if check(tokens, lambda x: x.t == "MATH" and x.v == "{"):
                     return None
-                tokens.pop(0)
+                tokens.take()
                 body = parse_instructions(tokens)
                 if not skip_sep(tokens):
                     return node
-                if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "}"):
+                if check(tokens, lambda x: x.t == "MATH" and x.v == "}"):
                     return None
-                tokens.pop(0)
+                end = tokens.take().pos + 1
                 if var_type != "void":
-                    ch.insert(0, ["int32", "return", current_token["pos"]])
+                    ch.insert(0, ["int32", "return", current_token.pos])
                 return ASTNode(
-                    {"type": var_type, "name": var_name, "args": ch}, "DECLARAT_FUNCTION", current_token["pos"], body
+                    {"type": var_type, "name": var_name, "args": ch, "end": end},
+                    "DECLARAT_FUNCTION",
+                    current_token.pos,
+                    body,
                 )
             return parse_formula(tokens)
 
-        elif current_token["t"] == "VARIBLE":
-            var_name = tokens.pop(0)["v"]
-            if check(tokens, lambda x: x["t"] == "MATH" and x["v"] in ("=", "(", "[")):
+        elif current_token.t == "FUNCTION":  # функция из кэша (FunctionCache), текст не разбирался
+            tokens.take()
+            entry = cache.entries[current_token.v]
+            start = current_token.pos
+            return ASTNode(
+                {
+                    "type": entry["type"],
+                    "name": entry["name"],
+                    "args": [[datatype, name, start + pos] for datatype, name, pos in entry["args"]],
+                    "end": start + entry["length"],
+                    "cached": current_token.v,
+                },
+                "DECLARAT_FUNCTION",
+                start,
+            )
+
+        elif current_token.t == "VARIBLE":
+            var_name = tokens.take().v
+            if check(tokens, lambda x: x.t == "MATH" and x.v in ("=", "(", "[")):
                 return None
-            if tokens[0]["v"] == "=":  # <instr> ::= <name>=<formula>
-                tokens.pop(0)
+            if tokens.peek().v == "=":  # <instr> ::= <name>=<formula>
+                tokens.take()
                 ch = parse_formula(tokens)
                 if ch is None:
                     return None
-                return ASTNode(var_name, "ASSIGN", current_token["pos"], ch.children)
-            elif tokens[0]["v"] == "(":  # <instr> ::= <name>(<args>)
-                tokens.pop(0)
+                return ASTNode(var_name, "ASSIGN", current_token.pos, ch.children)
+            elif tokens.peek().v == "(":  # <instr> ::= <name>(<args>)
+                tokens.take()
                 formuls = []
                 while True:
-                    if tokens and tokens[0]["t"] == "MATH" and tokens[0]["v"] == ")":
+                    if tokens and tokens.peek().t == "MATH" and tokens.peek().v == ")":
                         break
                     ch = parse_formula(tokens)
                     if ch is None:
                         return None
-                    if check(tokens, lambda x: x["t"] == "MATH" and x["v"] in (",", ")")):
+                    if check(tokens, lambda x: x.t == "MATH" and x.v in (",", ")")):
                         return None
                     formuls.append(ch)
-                    if tokens[0]["v"] == ")":
+                    if tokens.peek().v == ")":
                         break
-                tokens.pop(0)
-                return ASTNode(var_name, "EVAL_PROCEDURE", current_token["pos"], formuls)
-            elif tokens[0]["v"] == "[":  # <name>[<formula>]=<formula>
-                tokens.pop(0)
+                tokens.take()
+                return ASTNode(var_name, "EVAL_PROCEDURE", current_token.pos, formuls)
+            elif tokens.peek().v == "[":  # <name>[<formula>]=<formula>
+                tokens.take()
                 ch = parse_formula(tokens)
                 if ch is None:
                     return None
-                if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "]"):
+                if check(tokens, lambda x: x.t == "MATH" and x.v == "]"):
                     return None
-                tokens.pop(0)
-                if check(tokens, lambda x: x["t"] == "MATH" and x["v"] == "="):
+                tokens.take()
+                if check(tokens, lambda x: x.t == "MATH" and x.v == "="):
                     return None
-                tokens.pop(0)
+                tokens.take()
                 ch2 = parse_formula(tokens)
                 if ch2 is None:
                     return None
-                return ASTNode(var_name, "ASSIGN_ARRAY", current_token["pos"], [ch, ch2])
-        ast_errors.append('Unexpected token "' + current_token["v"] + '" at ' + str(current_token["pos"]))
+                return ASTNode(var_name, "ASSIGN_ARRAY", current_token.pos, [ch, ch2])
+        ast_errors.append('Unexpected token "' + current_token.v + '" at ' + str(current_token.pos))
         return None
 
     # parse inner functions
@@ -620,27 +612,26 @@ def build_ast(tokens):
     def parse_instructions(tokens):
         nodes = []
         while tokens:
-            current_token = tokens[0]
+            current_token = tokens.peek()
             child = None
-            if current_token["t"] == "MATH" and current_token["v"] == "}":
+            if current_token.t == "MATH" and current_token.v == "}":
                 break
-            elif current_token["t"] == "SEPARATOR":
-                tokens.pop(0)
+            elif current_token.t == "SEPARATOR":
+                tokens.take()
                 continue
             else:
                 child = parse_instr(tokens)
                 if child is None:
-                    while (len(tokens) > 0) and (tokens[0] is not None) and (tokens[0]["t"] != "SEPARATOR"):
-                        tokens.pop(0)
+                    while tokens and (tokens.peek().t != "SEPARATOR"):
+                        tokens.take()
                     continue
             if child is None:
                 break
             nodes.append(child)
         return nodes
 
-    remaining_tokens = tokens.copy()
     # <programm> ::= <instructions>
-    return ASTNode("main", "INSTRUCTIONS", 0, parse_instructions(remaining_tokens))
+    return ASTNode("main", "INSTRUCTIONS", 0, parse_instructions(TokenCursor(tokens)))
 
 
 # Printing the AST for visualization
@@ -731,6 +722,15 @@ def print_ast(node, indent=0):
 compile_errors = []
 
 
+class ASMline(str):
+    """Строка ассемблера с позицией `pos` узла исходного кода, из которого она получена."""
+
+    def __new__(cls, text, pos=None):
+        line = super().__new__(cls, text)
+        line.pos = pos
+        return line
+
+
 class ASMdata:
     def __init__(self, name, datatype, type, pos, is_global=False, value={}):
         self.name = name
@@ -742,6 +742,156 @@ class ASMdata:
         self.fullname = type + ":" + name + ":" + str(pos)
 
 
+class SymbolTable:
+    """Таблица символов блока: имя -> полное имя ("v:имя:позиция" или
+    "f:имя:позиция"), у переменных и функций -- отдельные словари. Вложенный
+    блок получает свою таблицу со ссылкой на родительскую; поиск идёт от
+    внутреннего блока к внешним, позднее объявление перекрывает раннее."""
+
+    __slots__ = ("functions", "parent", "variables")
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.functions = {}
+        self.variables = {}
+
+    def declare(self, kind, name, pos):
+        fullname = kind + ":" + name + ":" + str(pos)
+        (self.functions if kind == "f" else self.variables)[name] = fullname
+        return fullname
+
+    def lookup(self, kind, name):
+        table = self
+        while table is not None:
+            fullname = (table.functions if kind == "f" else table.variables).get(name)
+            if fullname is not None:
+                return fullname
+            table = table.parent
+        return None
+
+
+class FunctionCache:
+    """Кэш трансляции функций между запусками `main`: скомпонованный код функции
+    по хэшу её исходного текста. Функцию из кэша не разбирают ни лексер, ни
+    парсер, а компоновщик только подставляет в её код адреса функций,
+    строковых констант и глобальных переменных. Позиции внутри функции
+    хранятся относительно её начала, поэтому запись годится и после сдвига
+    функции в файле. Ссылки на глобальные переменные и функции хранятся по
+    имени вместе с сигнатурой объявления (тип, типы аргументов); запись
+    используется, только если имена указывают на объявления с теми же
+    сигнатурами. Кэш действителен для одной версии транслятора."""
+
+    VERSION = 2
+
+    def __init__(self, entries=None):
+        self.entries = {} if entries is None else entries
+        self.used = {}  # записи, использованные или созданные в этом запуске
+        self.stale = []  # записи, тело которых не разбиралось, но которые не подошли
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    # заголовок функции ("тип имя(") -> [(длина текста, ключ), ...]
+    def heads(self):
+        heads = {}
+        for key, entry in self.entries.items():
+            if "code" in entry:  # записи этого запуска до компоновки без кода
+                heads.setdefault(entry["head"], []).append((entry["length"], key))
+        return heads
+
+    def drop_stale(self):
+        for key in self.stale:
+            self.entries.pop(key, None)
+        self.used, self.stale, self.hits, self.misses = {}, [], 0, 0
+
+    @staticmethod
+    def compiler_hash():
+        with open(__file__, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    @classmethod
+    def load(cls, file_name):
+        try:
+            with open(file_name, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls()
+        if data.get("version") != cls.VERSION or data.get("compiler") != cls.compiler_hash():
+            return cls()
+        return cls(data["functions"])
+
+    def save(self, file_name):
+        # сохраняются только записи этого запуска -- старые версии функций отбрасываются
+        with open(file_name, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"version": self.VERSION, "compiler": self.compiler_hash(), "functions": self.used}))
+
+    # key -- хэш исходного текста функции с позиции start, resolve(вид, имя) ->
+    # (позиция, сигнатура) или None; возвращает (код для компоновщика,
+    # строковые константы) или None
+    def get(self, key, start, resolve):
+        entry = self.entries[key]
+        positions = {}
+        for category, name, signature in entry["externals"]:
+            found = resolve(category, name)
+            if found is None or found[1] != signature:
+                return None
+            positions[(category, name)] = found[0]
+
+        self.used[key] = entry
+        self.hits += 1
+        code = []
+        for text, pos in entry["code"]:
+            if text.__class__ is not str:  # [текст, вид, имя, позиция, текст, ...]
+                text = text[:]
+                for j in range(1, len(text), 4):
+                    kind, name, ref = text[j : j + 3]
+                    text[j + 2] = positions[("f" if kind == "f" else "v", name)] if ref is None else start + ref
+            code.append((text, pos if pos is None else start + pos))
+        strings = [{"type": "string", "value": value, "pos": start + pos} for value, pos in entry["strings"]]
+        return code, strings
+
+    # функция asm_data с исходным текстом text и строковыми константами strings;
+    # signature(полное имя) -> сигнатура глобального объявления. Возвращает
+    # запись, код в неё добавляет компоновщик (`relative`)
+    def put(self, text, asm_data, strings, signature):
+        key = self.key(text)
+        start, end = asm_data.pos, asm_data.pos + len(text)
+        externals = {}
+        for line in asm_data.value["asm"]:
+            for kind, name, ref in RELOCATION_RE.findall(line):
+                if kind != "g" and not start <= int(ref) < end:
+                    category = "f" if kind == "f" else "v"
+                    externals[(category, name)] = signature(category + ":" + name + ":" + ref)
+        entry = self.entries[key] = self.used[key] = {
+            "head": text[: text.index("(") + 1],
+            "length": len(text),
+            "type": asm_data.datatype,
+            "name": asm_data.name,
+            "args": [[datatype, name, pos - start] for datatype, name, pos in asm_data.value["args"]],
+            "strings": [[i["value"], i["pos"] - start] for i in strings],
+            "externals": [[category, name, sig] for (category, name), sig in externals.items()],
+        }
+        self.misses += 1
+        return entry
+
+    # код функции для записи кэша: позиции -- от начала функции start, ссылка
+    # на объявление вне функции [start, end) -- по имени (позиция None)
+    @staticmethod
+    def relative(code, start, end):
+        result = []
+        for text, pos in code:
+            if text.__class__ is not str:
+                text = text[:]
+                for j in range(1, len(text), 4):
+                    ref = text[j + 2]
+                    text[j + 2] = ref - start if text[j] == "g" or start <= ref < end else None
+            result.append([text, pos if pos is None else pos - start])
+        return result
+
+
 def get_size_type(type, for_array=False):
     if for_array == True:
         if type == "str":
@@ -767,11 +917,12 @@ def get_register_by_size(size):
     add_error("")
 
 
-def compileAST(AST):
+def compileAST(AST, source=None, cache=None):
     global_const_vars = []
     global_functions = []
     global_variables = []
     output_asm = []
+    escaped = set()  # массивы, адрес которых читается как значение (n = buffer, f(buffer))
 
     def add_error(node, text=""):
         compile_errors.append(
@@ -783,24 +934,29 @@ def compileAST(AST):
         )
         return None
 
-    def compile_formila(tokens, stack):
+    # строки asm, добавленные начиная со `start` и ещё не привязанные к исходному
+    # коду, относятся к узлу с позицией `pos`
+    def mark(asm, start, pos):
+        for k in range(start, len(asm)):
+            if not isinstance(asm[k], ASMline):
+                asm[k] = ASMline(asm[k], pos)
+
+    def compile_formila(tokens, scope):
         # print('---')
         asm = []
         for i in tokens:
+            start, pos = len(asm), i.pos
             # print(i.value, i.type, i.pos)
             if i.type == "NUMBER":
                 asm.append("PUSH " + str(i.value))  # TODO MIN_ABS_VALUE_FOR_STORE_NUMBER_IN_CONSTANTS
             elif i.type == "VARIBLE":
-                find = False
-                for e in reversed(stack):
-                    if e.split(":")[0] != "f" and e.split(":")[1] == i.value:
-                        asm.append("MOV %R" + e + "%, [%" + e + "%]")
-                        asm.append("PUSH EAX")
-                        find = True
-                        break
-                if not find:
+                e = scope.lookup("v", i.value)
+                if e is None:
                     add_error(i, "variable not declared")
                     return []
+                asm.append("MOV %R" + e + "%, [%" + e + "%]")
+                asm.append("PUSH EAX")
+                escaped.add(e)
             elif i.type == "MATH":
                 if i.value == "&&":
                     asm.append("POP")
@@ -849,16 +1005,12 @@ def compileAST(AST):
                 else:
                     add_error("")
             elif i.type == "CALC_ARRAY":
-                find = False
-                fe = ""
-                for e in reversed(stack):
-                    if e.split(":")[0] != "f" and e.split(":")[1] == i.value:
-                        asm.append("MOV EAX, [%" + e + "%]")
-                        fe = e
-                        find = True
-                        break
-                if not find:
+                fe = scope.lookup("v", i.value)
+                if fe is None:
+                    fe = ""
                     add_error(i, "array not declared")
+                else:
+                    asm.append("MOV EAX, [%" + fe + "%]")
                 asm.append("ADD [SP]")
                 asm.append("MOV %AR" + fe + "%, [EAX]")
                 asm.append("MOV [SP], EAX")
@@ -867,29 +1019,27 @@ def compileAST(AST):
                     asm.append("INT IN")
                     asm.append("PUSH EAX")
                 else:
-                    find = False
-                    for e in reversed(stack):
-                        if e.split(":")[0] == "f" and e.split(":")[1] == i.value.split("-")[0]:
-                            asm.append("CALL %" + e + "%")
-                            find = True
-                            break
-                    if not find:
+                    e = scope.lookup("f", i.value.split("-")[0])
+                    if e is None:
                         for i in range(max(i.value.count("-") - 1, 0)):
                             asm.append("POP")
                         add_error(i, "function not declared")
                     else:
-                        pass
+                        asm.append("CALL %" + e + "%")
             elif i.type == "STRING":  # TODO link if exists
                 asm.append("PUSH %g:" + str(len(global_variables)) + ":" + str(i.pos) + "%")
                 global_variables.append({"type": "string", "value": i.value, "pos": i.pos})
             else:
                 print(i.type)
                 add_error("")
+            mark(asm, start, pos)
         return asm
 
     def compile_branch(node, root, scope):
         asm = []
+        arrays = []  # массивы блока: освобождаются при выходе из него
         for i in node.children:
+            start, pos = len(asm), i.pos
             if i.type in ("DECLARAT_VARIBLE", "DECLARAT_ARRAY"):
                 asm_f = compile_formila(i.children, scope)
                 for e in asm_f:
@@ -898,6 +1048,7 @@ def compileAST(AST):
                 size = get_size_type(i.value["type"], i.type == "DECLARAT_ARRAY")
                 if i.type == "DECLARAT_ARRAY":
                     asm.append("INT MALLOC" + str(8 * size))
+                    arrays.append(i)
                 asm.append(
                     "MOV [%v:"
                     + i.value["name"]
@@ -907,8 +1058,7 @@ def compileAST(AST):
                     + (get_register_by_size(size) if i.type != "DECLARAT_ARRAY" else "EAX")
                     + " # :="
                 )
-                if "v:" + i.value["name"] + ":" + str(i.pos) not in scope:
-                    scope.append("v:" + i.value["name"] + ":" + str(i.pos))
+                scope.declare("v", i.value["name"], i.pos)
             elif i.type == "ASSIGN_ARRAY":
                 asm_index = compile_formila(i.children[0].children, scope)  # index
                 for e in asm_index:
@@ -916,16 +1066,12 @@ def compileAST(AST):
                 asm_value = compile_formila(i.children[1].children, scope)  # value
                 for e in asm_value:
                     asm.append(e)
-                find = False
-                fe = ""
-                for e in reversed(scope):
-                    if e.split(":")[0] != "f" and e.split(":")[1] == i.value:
-                        asm.append("MOV EAX, [%" + e + "%]")
-                        fe = e
-                        find = True
-                        break
-                if not find:
+                fe = scope.lookup("v", i.value)
+                if fe is None:
+                    fe = ""
                     add_error(i, "array not declared")
+                else:
+                    asm.append("MOV EAX, [%" + fe + "%]")
                 asm.append("ADD [SP-1]")
                 asm.append("SWAP [SP]")
                 asm.append("MOV [[SP]], %AR" + fe + "%")
@@ -935,15 +1081,12 @@ def compileAST(AST):
                 asm_value = compile_formila(i.children, scope)  # value
                 for e in asm_value:
                     asm.append(e)
-                find = False
                 asm.append("POP")
-                for e in reversed(scope):
-                    if e.split(":")[0] != "f" and e.split(":")[1] == i.value:
-                        asm.append("MOV [%" + e + "%], %R" + e + "%")
-                        find = True
-                        break
-                if not find:
+                e = scope.lookup("v", i.value)
+                if e is None:
                     add_error(i, "variable not declared")
+                else:
+                    asm.append("MOV [%" + e + "%], %R" + e + "%")
             elif i.type == "EVAL_PROCEDURE":
                 for j in i.children:
                     asm_arg = compile_formila(j.children, scope)  # arg
@@ -959,11 +1102,10 @@ def compileAST(AST):
                     find = True
                     asm.append("HALT")
                 else:
-                    for e in reversed(scope):
-                        if e.split(":")[0] == "f" and e.split(":")[1] == i.value:
-                            asm.append("CALL %" + e + "% # eval procedure")
-                            find = True
-                            break
+                    e = scope.lookup("f", i.value)
+                    if e is not None:
+                        asm.append("CALL %" + e + "% # eval procedure")
+                        find = True
                 if not find:
                     add_error(i, "functions not declared")
                 for j in i.children:
@@ -971,7 +1113,7 @@ def compileAST(AST):
             elif i.type == "BRANCHING":
                 if i.value == "do":  # do{body}while(condition)
                     condition = i.children.pop()
-                    asm_do_b = compile_branch(i, root, scope.copy())  # body
+                    asm_do_b = compile_branch(i, root, SymbolTable(scope))  # body
                     for e in asm_do_b:
                         asm.append(e)
                     asm_do_condition = compile_formila(condition.children, scope)  # condition
@@ -986,7 +1128,7 @@ def compileAST(AST):
                     # step
                     body = i.children.pop()
 
-                    for_scope = scope.copy()  # init
+                    for_scope = SymbolTable(scope)  # init
                     asm_f = compile_formila(init.children, for_scope)
                     for e in asm_f:
                         asm.append(e)
@@ -1001,12 +1143,12 @@ def compileAST(AST):
                         + get_register_by_size(size)
                         + " # for init"
                     )
-                    for_scope.append("v:" + init.value["name"] + ":" + str(init.pos))
+                    for_scope.declare("v", init.value["name"], init.pos)
 
-                    asm_for_b = compile_branch(body, root, for_scope.copy())  # body
+                    asm_for_b = compile_branch(body, root, SymbolTable(for_scope))  # body
                     for e in asm_for_b:
                         asm.append(e)
-                    asm_for_step = compile_branch(i, root, for_scope.copy())  # step
+                    asm_for_step = compile_branch(i, root, SymbolTable(for_scope))  # step
                     for e in asm_for_step:
                         asm.append(e)
 
@@ -1018,7 +1160,7 @@ def compileAST(AST):
                     asm.append("JMP NE IP-" + str(len(asm_for_b) + len(asm_for_step) + 3) + " # for condition")
                 if i.value == "while":  # while(condition){body}
                     asm_while_condition = compile_formila(i.children[0].children, scope)
-                    asm_while_b = compile_branch(i.children[1], root, scope.copy())
+                    asm_while_b = compile_branch(i.children[1], root, SymbolTable(scope))
 
                     for e in asm_while_condition:  # condition
                         asm.append(e)
@@ -1035,7 +1177,7 @@ def compileAST(AST):
                     for e in asm_if_condition:
                         asm.append(e)
 
-                    asm_if_b = compile_branch(i.children[1], root, scope.copy())  # body
+                    asm_if_b = compile_branch(i.children[1], root, SymbolTable(scope))  # body
 
                     asm.append("POP")
                     asm.append("CMP 0")
@@ -1045,6 +1187,22 @@ def compileAST(AST):
                         asm.append(e)
             else:
                 print("ERROR " + i.type)
+            mark(asm, start, pos)
+        # массивы верхнего уровня main живут до HALT, остальные освобождаются в
+        # конце блока (тела функции, цикла, условия). Массив, адрес которого
+        # присвоен, передан в функцию или возвращён, может пережить блок и не
+        # освобождается
+        if root.name != "" or node is not root.value["cut_node"]:
+            for i in arrays:
+                if "v:" + i.value["name"] + ":" + str(i.pos) in escaped:
+                    continue
+                start = len(asm)
+                asm.append("MOV EAX, [%v:" + i.value["name"] + ":" + str(i.pos) + "%]")
+                size = get_size_type(i.value["type"], True)
+                if size != 4:
+                    asm.append("SHR " + str({1: 2, 2: 1}[size]))  # адрес байта/полуслова -> адрес слова
+                asm.append("INT FREE")
+                mark(asm, start, i.pos)
         return asm
 
     def compile_global_function(node):  # get array ASMdata
@@ -1095,7 +1253,13 @@ def compileAST(AST):
                         "f",
                         node.pos,
                         in_global,
-                        {"node": node, "offset": 0, "args": node.value["args"]},
+                        {
+                            "node": node,
+                            "offset": 0,
+                            "args": node.value["args"],
+                            "end": node.value["end"],
+                            "cached": node.value.get("cached"),
+                        },
                     )
                 )
                 return None
@@ -1108,34 +1272,62 @@ def compileAST(AST):
                 node.children = ch_list
                 return node
 
-        while True:
-            data = None
-            for i in asm_data:
-                if "node" in i.value:
-                    data = i
-                    break
-            if data is None:
-                break
+        k = 0
+        while k < len(asm_data):
+            data = asm_data[k]
+            k += 1
+            if "node" not in data.value:
+                continue
+            count = len(asm_data)
             calc_vars_and_funcs(data.value["node"], data)
+            data.value["locals"] = asm_data[count:]
             # print('---')
             # print(data.name)
             # print_ast(data.value["node"])
             data.value["cut_node"] = data.value["node"]
             del data.value["node"]
-        global_stack = []
+        global_scope = SymbolTable()
+        symbols = {}
         for i in asm_data:
             # print(i.name, i.datatype, i.type, i.is_global, i.value)
             if i.is_global and i.name != "":
-                global_stack.append(i.fullname)
-        # print(global_stack)
+                symbols[global_scope.declare(i.type, i.name, i.pos)] = i
+
+        def signature(fullname):
+            i = symbols[fullname]
+            return [i.datatype, [arg[0] for arg in i.value["args"]]] if i.type == "f" else [i.datatype]
+
+        def resolve(kind, name):
+            fullname = global_scope.lookup(kind, name)
+            return None if fullname is None else (symbols[fullname].pos, signature(fullname))
+
         for i in asm_data:
             if i.type == "f":
-                scope = global_stack.copy()
+                scope = SymbolTable(global_scope)
                 if i.name != "":
-                    scope.append(i.fullname)
+                    scope.declare("f", i.name, i.pos)
                 for arg in i.value["args"]:
-                    scope.append("v:" + arg[1] + ":" + str(arg[2]))
+                    scope.declare("v", arg[1], arg[2])
+                if cache is None or i.name == "":
+                    i.value["asm"] = compile_branch(i.value["cut_node"], i, scope)
+                    continue
+                # функции берутся из кэша, если их текст и сигнатуры глобальных
+                # объявлений, на которые они ссылаются, не изменились
+                if i.value["cached"] is not None:
+                    cached = cache.get(i.value["cached"], i.pos, resolve)
+                    if cached is None:  # тело не разобрано -- нужен повторный разбор
+                        cache.stale.append(i.value["cached"])
+                        i.value["asm"] = []
+                        continue
+                    i.value["code"], strings = cached
+                    global_variables.extend(strings)
+                    continue
+                errors, base = len(compile_errors), len(global_variables)
                 i.value["asm"] = compile_branch(i.value["cut_node"], i, scope)
+                nested = any(j.type == "f" for j in i.value["locals"])
+                if len(compile_errors) == errors and not nested:
+                    text = source[i.pos : i.value["end"]]
+                    i.value["entry"] = cache.put(text, i, global_variables[base:], signature)
                 # print(i.name)
                 # print(' - '+'\n - '.join(i.value["asm"]))
         return asm_data
@@ -1202,114 +1394,138 @@ def linkASM(asm_datas):
             int32_list.append(list[i + 3] + (list[i + 2] << 8) + (list[i + 1] << 16) + (list[i] << 24))
         return int32_list
 
-    def find_value_between_percents(input_string):
-        start_percent_index = input_string.find("%")
-        if start_percent_index == -1:
-            return None
-        end_percent_index = input_string.find("%", start_percent_index + 1)
-        if end_percent_index == -1:
-            return None
-        return input_string[start_percent_index + 1 : end_percent_index]
-
-    def replace_value_between_percents(input_string, new_value):
-        start_percent_index = input_string.find("%")
-        if start_percent_index == -1:
-            return input_string
-        end_percent_index = input_string.find("%", start_percent_index + 1)
-        if end_percent_index == -1:
-            return input_string
-        return input_string[:start_percent_index] + new_value + input_string[end_percent_index + 1 :]
-
-    link_address = []
-    global_const = []
-
-    def linkFunction(asm_data):
-        for i in link_address:
-            if (i["name"] == asm_data.name) and (i["pos"] == asm_data.pos):
-                return
-        link_address.append({"name": asm_data.name, "pos": asm_data.pos, "adr": str(len(ASM))})
-        start = len(ASM)
-        for i in asm_data.value["asm"]:
-            ASM.append(i)
-        end = len(ASM)
+    functions = {}  # (имя, позиция) -> ASMdata функции
+    variables = {}  # (имя, позиция) -> ASMdata переменной
+    for i in asm_datas:
+        if i.type == "f":
+            functions[(i.name, i.pos)] = i
+        elif i.type == "v":
+            variables.setdefault((i.name, i.pos), i)
+    strings = {}  # позиция строки в исходном коде -> адрес константы
+    link_address = {}  # (имя, позиция) -> адрес функции
+    lines = {}  # (имя, позиция) -> код функции (`relocate`)
+    arguments = {}  # (имя, позиция) -> {(имя, позиция) аргумента: номер}
+
+    # (регистр по размеру, адрес) переменной или аргумента функции asm_data
+    def find_varible(asm_data, name, pos, stack_size, for_array=False):
+        i = variables.get((name, pos))
+        if i is not None:
+            if i.is_global:
+                return (
+                    get_register_by_size(get_size_type(i.datatype, for_array)),
+                    str((ASM_info["GLOBAL_VARIBLE_ADR"] + i.value["offset"]) // get_size_type(i.datatype)),
+                )
+            return (
+                get_register_by_size(get_size_type(i.datatype, for_array)),
+                "SP-" + str((stack_size * 4 - i.value["offset"] - 4) // get_size_type(i.datatype)),
+            )
+        args = asm_data.value["args"]
+        k = arguments[(asm_data.name, asm_data.pos)].get((name, pos))
+        if k is None:
+            print("compile error 1150")
+            exit(1)
+        return get_register_by_size(get_size_type(args[k][0], for_array)), "SP-" + str(stack_size + len(args) - k)
+
+    # код функции: пары (строка, позиция в исходном коде). Ссылки на регистры
+    # и на адреса в кадре функции заменяются сразу, а ссылки на адреса функций,
+    # строковых констант и глобальных переменных остаются до размещения:
+    # строка с ними разбита на [текст, вид, имя, позиция, текст, ...]. В таком
+    # виде код функции хранится и в кэше (FunctionCache)
+    def relocate(asm_data):
+        key = (asm_data.name, asm_data.pos)
+        arguments[key] = {}
+        for k, arg in enumerate(asm_data.value["args"]):
+            arguments[key].setdefault((arg[1], arg[2]), k)
+        if "code" in asm_data.value:  # из кэша
+            return asm_data.value["code"]
+        code_lines = []
         stack_size = 0
-        for i in range(start, end):
-            cmd = ASM[i].split("#")[0].strip().split(" ")
-            for key in range(len(cmd)):
-                percents_text = find_value_between_percents(cmd[key])
-                if percents_text is not None:
-                    # print(percents_text)
-                    percents_text = percents_text.split(":")
-
-                    def find_varible(name, pos, for_array=False):
-                        for i in asm_datas:
-                            if i.type == "v" and i.name == name and i.pos == pos:
-                                if i.is_global:
-                                    return (
-                                        get_register_by_size(get_size_type(i.datatype, for_array)),
-                                        str(
-                                            (ASM_info["GLOBAL_VARIBLE_ADR"] + i.value["offset"])
-                                            // get_size_type(i.datatype)
-                                        ),
-                                    )
-                                else:
-                                    return (
-                                        get_register_by_size(get_size_type(i.datatype, for_array)),
-                                        "SP-"
-                                        + str((stack_size * 4 - i.value["offset"] - 4) // get_size_type(i.datatype)),
-                                    )
-                        for i in range(len(asm_data.value["args"])):
-                            if asm_data.value["args"][i][1] == name and asm_data.value["args"][i][2] == pos:
-                                return (
-                                    get_register_by_size(get_size_type(asm_data.value["args"][i][0], for_array)),
-                                    "SP-" + str(stack_size + len(asm_data.value["args"]) - i),
-                                )
-
-                    if percents_text[0] == "g":
-                        find = False
-                        for j in global_const:
-                            if (j["type"] == "string") and (j["pos"] == int(percents_text[2])):
-                                cmd[key] = replace_value_between_percents(cmd[key], j["addres"])
-                                find = True
-                        if not find:
-                            print("compile error 1161")
-                            exit(1)
-                    elif percents_text[0] == "f":
-                        find = None
-                        for j in asm_datas:
-                            if j.type == "f" and j.name == percents_text[1] and j.pos == int(percents_text[2]):
-                                find = j
-                        if find is None:
-                            print("compile error 1169")
-                            exit(1)
-                        linkFunction(find)
-                        for j in link_address:
-                            if j["name"] == percents_text[1] and j["pos"] == int(percents_text[2]):
-                                cmd[key] = replace_value_between_percents(cmd[key], j["adr"])
-                    elif percents_text[0] == "Rv":
-                        cmd[key] = replace_value_between_percents(
-                            cmd[key], find_varible(percents_text[1], int(percents_text[2]))[0]
-                        )
-                    elif percents_text[0] == "ARv":
-                        cmd[key] = replace_value_between_percents(
-                            cmd[key], find_varible(percents_text[1], int(percents_text[2]), True)[0]
-                        )
-                    elif percents_text[0] == "v":
-                        cmd[key] = replace_value_between_percents(
-                            cmd[key], find_varible(percents_text[1], int(percents_text[2]))[1]
-                        )
-                    else:
-                        print("compile error 1150")
-                        exit(1)
-
-            ASM[i] = " ".join(cmd) + (" #" + ASM[i].split("#")[1] if ASM[i].find("#") > 0 else "")
-            if cmd[0] == "PUSH":
+        for line in asm_data.value["asm"]:
+            code = line.split("#")[0].strip()
+            comment = " #" + line.split("#")[1] if line.find("#") > 0 else ""
+            parts = [""]
+            last = 0
+            for m in RELOCATION_RE.finditer(code):
+                kind, name, pos = m.group(1), m.group(2), int(m.group(3))
+                i = variables.get((name, pos))
+                parts[-1] += code[last : m.start()]
+                if kind in ("f", "g") or (kind == "v" and i is not None and i.is_global):
+                    parts += (kind, name, pos, "")
+                elif kind == "Rv":
+                    parts[-1] += find_varible(asm_data, name, pos, stack_size)[0]
+                elif kind == "ARv":
+                    parts[-1] += find_varible(asm_data, name, pos, stack_size, True)[0]
+                elif kind == "v":
+                    parts[-1] += find_varible(asm_data, name, pos, stack_size)[1]
+                else:
+                    print("compile error 1150")
+                    exit(1)
+                last = m.end()
+            parts[-1] += code[last:] + comment
+            code_lines.append((parts[0] if len(parts) == 1 else parts, getattr(line, "pos", None)))
+            opcode = code.split(" ", 1)[0]
+            if opcode == "PUSH":
                 stack_size += 1
-            if cmd[0] == "POP":
+            if opcode == "POP":
                 stack_size -= 1
         if stack_size != 0:
             print("compile error 1132")
             exit(1)
+        return code_lines
+
+    # функции располагаются в порядке первого вызова (обход в глубину от main),
+    # поэтому адреса всех функций известны до разрешения ссылок
+    def layout(main):
+        order = []
+        address = len(ASM)
+
+        def place(asm_data):
+            nonlocal address
+            key = (asm_data.name, asm_data.pos)
+            link_address[key] = address
+            order.append(asm_data)
+            lines[key] = relocate(asm_data)
+            address += len(lines[key])
+            return iter(
+                [
+                    (text[j + 1], text[j + 2])
+                    for text, _ in lines[key]
+                    if text.__class__ is not str
+                    for j in range(1, len(text), 4)
+                    if text[j] == "f"
+                ]
+            )
+
+        pending = [place(main)]
+        while pending:
+            key = next(pending[-1], None)
+            if key is None:
+                pending.pop()
+            elif key not in link_address:
+                if key not in functions:
+                    print("compile error 1169")
+                    exit(1)
+                pending.append(place(functions[key]))
+        return order
+
+    def link(asm_data):
+        for text, pos in lines[(asm_data.name, asm_data.pos)]:
+            if text.__class__ is not str:
+                parts = [text[0]]
+                for j in range(1, len(text), 4):
+                    kind, name, ref = text[j : j + 3]
+                    if kind == "g":
+                        if ref not in strings:
+                            print("compile error 1161")
+                            exit(1)
+                        value = strings[ref]
+                    elif kind == "f":
+                        value = str(link_address[(name, ref)])
+                    else:
+                        value = find_varible(asm_data, name, ref, 0)[1]
+                    parts += (value, text[j + 3])
+                text = "".join(parts)
+            ASM.append(ASMline(text, pos))
 
     ASM_info = {"STACK_ADR": 1, "GLOBAL_VARIBLE_ADR": 1, "CONSTANTS_ADR": 1, "START_ADR": 1}
     ASM = [""]
@@ -1328,10 +1544,10 @@ def linkASM(asm_datas):
     #        else
     #            global_scope.append({"name": i.name, "type": i.datatype, "pos": i.pos, "addres": 'SP-'str(i.value["offset"])})
 
-    CONSTANTS_ADR = len(ASM) * 4
+    ASM_info["CONSTANTS_ADR"] = len(ASM) * 4
     for i in asm_datas[0].value["constants"]:
         if i["type"] == "string":
-            global_const.append({"name": i["value"], "type": "string", "pos": i["pos"], "addres": str(len(ASM) * 4)})
+            strings.setdefault(i["pos"], str(len(ASM) * 4))
             for int32 in string_to_int32_array(i["value"]):
                 ASM.append("WORD32 " + str(int32))
         else:
@@ -1341,23 +1557,67 @@ def linkASM(asm_datas):
     ASM_info["START_ADR"] = len(ASM) * 4
     ASM[0] = "JMP " + str(len(ASM))
     for i in asm_datas:
-        if i.type == "f":
+        if i.type == "f" and "code" not in i.value:
             while asm_datas[0].value["offset"] % 4 != 0:
                 asm_datas[0].value["offset"] += 1
-            for j in range(i.value["offset"] // 4):
-                i.value["asm"].insert(0, "PUSH 0")
-                i.value["asm"].append("POP")
+            # пролог и эпилог относятся к объявлению функции
+            locals_size = i.value["offset"] // 4
+            i.value["asm"] = (
+                [ASMline("PUSH 0", i.pos)] * locals_size + i.value["asm"] + [ASMline("POP", i.pos)] * locals_size
+            )
             if i.name == "":  # main
-                i.value["asm"].append("HALT")
+                i.value["asm"].append(ASMline("HALT", i.pos))
             else:
-                i.value["asm"].append("RET")
-    # print(global_const)
+                i.value["asm"].append(ASMline("RET", i.pos))
     # print(ASM);
     # for i in asm_datas:
     #    print(i.name, i.datatype, i.type, i.pos, i.is_global, i.value)
-    linkFunction(asm_datas[0])
+    order = layout(asm_datas[0])
+    for i in order:
+        link(i)
+    # в кэш попадает код и тех функций, которые не вызываются
+    for i in asm_datas:
+        if i.value.get("entry") is not None:
+            key = (i.name, i.pos)
+            if key not in lines:
+                lines[key] = relocate(i)
+            i.value["entry"]["code"] = FunctionCache.relative(lines[key], i.pos, i.value["end"])
     # print(ASM);
-    return ASM
+    # области образа (адреса в словах), куча -- за концом образа
+    regions = [
+        ["code", 0],
+        ["stack", ASM_info["STACK_ADR"] // 4],
+        ["globals", ASM_info["GLOBAL_VARIBLE_ADR"] // 4],
+        ["constants", ASM_info["CONSTANTS_ADR"] // 4],
+        ["code", ASM_info["START_ADR"] // 4],
+        ["heap", len(ASM)],
+    ]
+    # функции: имя, начало и конец кода (адреса в словах)
+    symbols = [
+        [i.name or "<main>", link_address[(i.name, i.pos)], link_address[(i.name, i.pos)] + len(lines[(i.name, i.pos)])]
+        for i in order
+    ]
+    return ASM, regions, symbols
+
+
+def line_table(code, source):
+    """Таблица строк: [адрес, смещение, строка, столбец] для каждого адреса, с
+    которого начинается код другой позиции исходного кода (None -- код и данные
+    без позиции). Строки и столбцы считаются с 1."""
+    newlines = [m.start() for m in re.finditer("\n", source)]
+    table = []
+    previous = -1
+    for address, line in enumerate(code):
+        pos = getattr(line, "pos", None)
+        if pos == previous:
+            continue
+        previous = pos
+        if pos is None:
+            table.append([address, None, None, None])
+        else:
+            k = bisect.bisect_left(newlines, pos)  # переводов строки до pos
+            table.append([address, pos, k + 1, pos - (newlines[k - 1] if k else -1)])
+    return table
 
 
 def write_code(file_path, code):
@@ -1367,29 +1627,59 @@ def write_code(file_path, code):
         json.dump(code, file)
 
 
-def main(source, target):
-    with open(source, encoding="utf-8") as f:
-        source = f.read()
-    tokens = tokenize(source)
-    ast = build_ast(tokens)
-
-    if ast_errors:
-        for error in ast_errors:
+def write_image(file_path, code, regions=None, symbols=None, lines=None):
+    """Записывает программу двоичным образом (`image.write_image`), текст
+    ассемблера сохраняется в отладочной секции для журнала симуляции."""
+    words = image.assemble(code)
+    if image.error_list:
+        for error in image.error_list:
             print(error)
         exit(1)
-    ASM = compileAST(ast)
+    debug = {"asm": code}
+    if regions is not None:
+        debug["regions"] = regions
+    if symbols is not None:
+        debug["symbols"] = symbols
+    if lines is not None:
+        debug["lines"] = lines
+    image.write_image(file_path, words, debug)
+
+
+def main(source, target, cache_file=None):
+    with open(source, encoding="utf-8") as f:
+        source = f.read()
+    cache = FunctionCache.load(cache_file) if cache_file is not None else None
+    while True:
+        tokens = tokenize(source, cache)
+        ast = build_ast(tokens, cache)
+
+        if ast_errors:
+            for error in ast_errors:
+                print(error)
+            exit(1)
+        ASM = compileAST(ast, source, cache)
+        if cache is None or not cache.stale:
+            break
+        # часть функций взята из кэша без разбора, но их записи не подошли
+        cache.drop_stale()
+        compile_errors.clear()
     # TODO variable is already defined + test in arg
     # TODO return in function
     if compile_errors:
         for error in compile_errors:
             print(error)
         exit(1)
-    ASM = linkASM(ASM)
-    write_code(target, ASM)
+    ASM, regions, symbols = linkASM(ASM)
+    if target.endswith(".bin"):
+        write_image(target, ASM, regions, symbols, line_table(ASM, source))
+    else:
+        write_code(target, ASM)
     print("source LoC:", len(source.split("\n")), "code instr:", len(ASM))
+    if cache is not None:
+        cache.save(cache_file)
+        print("functions compiled:", cache.misses, "cached:", cache.hits)
 
 
 if __name__ == "__main__":
-    assert len(sys.argv) == 3, "Wrong arguments: translator.py <input_file> <target_file>"
-    _, source, target = sys.argv
-    main(source, target)
+    assert len(sys.argv) in (3, 4), "Wrong arguments: translator.py <input_file> <target_file> [cache_file]"
+    main(*sys.argv[1:])
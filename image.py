@@ -0,0 +1,165 @@
+"""Образ программы: кодирование ассемблера в машинные слова и двоичный
+формат, общий для транслятора (`compiler.py`) и модели процессора (`runner.py`).
+"""
+
+import array
+import json
+import mmap
+import struct
+import sys
+
+error_list = []
+
+
+def crop_int_to_uint16(num):
+    max_uint16 = 2**16 - 1
+    min_uint16 = 0
+    cropped_num = num & 0xFFFF
+    return min(max_uint16, max(min_uint16, cropped_num))
+
+
+def assemble(programm):
+    """Кодирует строки ассемблера в машинные слова (`array('I')`).
+
+    Неизвестные команды добавляются в `error_list`.
+    """
+
+    def A(REG):
+        return ["AL", "AX", "EAX"].index(REG) * 0b00000100_00000000_00000000_00000000
+
+    def F(NUM):
+        #            000     001      010       011         100        101         110        111
+        # F(ARG) ::= NUM || [NUM] || EAX+NUM || [EAX+NUM] ||  IP+NUM || [IP+NUM] ||  SP+NUM || [SP+NUM]
+        NUM = NUM.strip()
+        in_mem = 1 if "[" in NUM else 0
+        if in_mem == 1:
+            NUM = NUM[1:-1]
+        value = 0
+        if NUM.replace("+", " ").replace("-", " ").split(" ")[-1].isdigit():
+            value = (1 if NUM.count("-") % 2 == 0 else -1) * int(NUM.replace("+", " ").replace("-", " ").split(" ")[-1])
+        if NUM.isdigit():
+            return in_mem * 0b1_00000000_00000000 + crop_int_to_uint16(value)
+        REG = NUM.replace("+", " ").replace("-", " ").split(" ")[0]
+        return (["", "EAX", "IP", "SP"].index(REG) * 2 + in_mem) * 0b1_00000000_00000000 + crop_int_to_uint16(value)
+
+    words = array.array("I", bytes(4 * len(programm)))
+
+    def setmem(i, value):
+        words[i] = value & 0xFFFFFFFF
+
+    for i in range(len(programm)):
+        cmd = programm[i].split("#")[0].strip().replace(",", " ").replace("  ", " ").replace("  ", " ").split(" ")
+        # print(cmd)
+        if cmd[0] == "NOP":
+            setmem(i, 0b00000000_00000000_00000000_00000000)
+        elif cmd[0] == "HALT":
+            setmem(i, 0b00010000_00000000_00000000_00000000)
+        elif cmd[0] == "MOV":
+            if cmd[1] in ("AL", "AX", "EAX"):
+                setmem(i, 0b00100000_00000000_00000000_00000000 + A(cmd[1]) + F(cmd[2]))
+            else:
+                setmem(i, 0b00110000_00000000_00000000_00000000 + A(cmd[2]) + F(cmd[1][1:-1]))
+        elif cmd[0] == "WORD32":
+            setmem(i, int(cmd[1]))
+        elif cmd[0] in ("ADC", "ADD", "SBC", "SUB", "OR", "XOR", "AND", "MUL", "SHR", "SHL", "CMP", "MOD"):
+            setmem(
+                i,
+                0b01000000_00000000_00000000_00000000
+                + (
+                    ["ADC", "ADD", "SBC", "SUB", "OR", "XOR", "AND", "MUL", "SHR", "SHL", "CMP", "MOD"].index(cmd[0])
+                    << 20
+                )
+                + A("EAX")
+                + F(cmd[1]),
+            )
+        elif cmd[0] in ("NOT", "NEG", "RCL", "RCR", "ZEXT8", "ZEXT16", "EXT8", "EXT16"):
+            setmem(
+                i,
+                0b01010000_00000000_00000000_00000000
+                + (["NOT", "NEG", "RCL", "RCR", "ZEXT8", "ZEXT16", "EXT8", "EXT16"].index(cmd[0]) << 20),
+            )
+        elif cmd[0] in ("OUT", "IN", "MALLOC32", "MALLOC16", "MALLOC8", "FREE"):
+            setmem(
+                i,
+                0b01100000_00000000_00000000_00000000
+                + (["OUT", "IN", "MALLOC32", "MALLOC16", "MALLOC8", "FREE"].index(cmd[0]) << 16),
+            )
+        elif cmd[0] == "INT" and cmd[1] in ("OUT", "IN", "MALLOC32", "MALLOC16", "MALLOC8", "FREE"):
+            setmem(
+                i,
+                0b01100000_00000000_00000000_00000000
+                + (["OUT", "IN", "MALLOC32", "MALLOC16", "MALLOC8", "FREE"].index(cmd[1]) << 16),
+            )
+        elif cmd[0] == "CALL" and cmd[1] in ["A", "E", "NE", "G", "L", "GE", "LE"]:
+            setmem(
+                i,
+                0b10000000_00000000_00000000_00000000
+                + (["A", "E", "NE", "G", "L", "GE", "LE"].index(cmd[1]) << 20)
+                + F(cmd[2]),
+            )
+        elif cmd[0] == "CALL":
+            setmem(i, 0b10000000_00000000_00000000_00000000 + F(cmd[1]))
+        elif cmd[0] == "RET":
+            setmem(i, 0b10010000_00000000_00000000_00000000)
+        elif cmd[0] == "JMP" and cmd[1] in ["A", "E", "NE", "G", "L", "GE", "LE"]:
+            setmem(
+                i,
+                0b10100000_00000000_00000000_00000000
+                + (["A", "E", "NE", "G", "L", "GE", "LE"].index(cmd[1]) << 20)
+                + F(cmd[2]),
+            )
+        elif cmd[0] == "JMP":
+            setmem(i, 0b10100000_00000000_00000000_00000000 + F(cmd[1]))
+        elif cmd[0] == "PUSH":
+            setmem(i, 0b10110000_00000000_00000000_00000000 + F(cmd[1]))
+        elif cmd[0] == "POP":
+            setmem(i, 0b11000000_00000000_00000000_00000000)
+        elif cmd[0] == "SWAP":
+            setmem(i, 0b11010000_00000000_00000000_00000000 + F(cmd[1][1:-1]))
+        else:
+            error_list.append("undefined command: " + " ".join(cmd))
+    return words
+
+
+# Двоичный образ программы:
+#   заголовок IMAGE_HEADER: сигнатура, версия, флаги (0), число слов,
+#   размер отладочной секции в байтах;
+#   слова программы (32 бит, big-endian);
+#   необязательная отладочная секция -- JSON (например, {"asm": [...]}).
+IMAGE_MAGIC = b"JSIM"
+IMAGE_VERSION = 1
+IMAGE_HEADER = struct.Struct(">4sHHII")
+IMAGE_MMAP_THRESHOLD = 1 << 20  # образы от 1 МиБ читаются через mmap
+
+
+def write_image(file_name, words, debug=None):
+    body = array.array("I", words)
+    if sys.byteorder == "little":
+        body.byteswap()
+    debug_bytes = json.dumps(debug).encode("utf-8") if debug is not None else b""
+    with open(file_name, "wb") as f:
+        f.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, 0, len(body), len(debug_bytes)))
+        f.write(body.tobytes())
+        f.write(debug_bytes)
+
+
+def read_image(file_name):
+    """Читает образ `write_image`; возвращает слова (`array('I')`) и отладочную секцию (или None)."""
+    with open(file_name, "rb") as f:
+        magic, version, _, count, debug_size = IMAGE_HEADER.unpack(f.read(IMAGE_HEADER.size))
+        assert magic == IMAGE_MAGIC, "not a program image"
+        assert version == IMAGE_VERSION, "unsupported image version"
+        words = array.array("I")
+        start, end = IMAGE_HEADER.size, IMAGE_HEADER.size + 4 * count
+        if end - start >= IMAGE_MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                with view[start:end] as section:
+                    words.frombytes(section)
+        else:
+            words.frombytes(f.read(end - start))
+        assert len(words) == count, "truncated image"
+        f.seek(end)
+        debug = json.loads(f.read(debug_size).decode("utf-8")) if debug_size else None
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words, debug
@@ -5,13 +5,17 @@
 
 import contextlib
 import io
+import json
 import logging
 import os
 import tempfile
 
-import pytest
+import benchmark
+import codegen_benchmark
 import compiler
+import pytest
 import runner
+import trace_dump
 
 
 @pytest.mark.golden_test("golden/*.yml")
@@ -73,3 +77,433 @@ def test_translator_and_machine(golden):
         # Проверяем, что ожидания соответствуют реальности.
         assert debug_output == golden.out["out_dbg"]
         assert stdout.getvalue() == golden.out["out_stdout"]
+
+
+def compile_source(source, tmpdirname, suffix=".asm"):
+    """Транслирует `source` в `tmpdirname` и возвращает имя образа
+    (`suffix` -- ".asm" или ".bin")."""
+    source_name = os.path.join(tmpdirname, "source.lsp")
+    target_name = os.path.join(tmpdirname, "target" + suffix)
+    with open(source_name, "w", encoding="utf-8") as file:
+        file.write(source)
+    with contextlib.redirect_stdout(io.StringIO()):
+        compiler.main(source_name, target_name)
+    return target_name
+
+
+def load(target_name):
+    mm = runner.MemoryManager()
+    runner.load_program(mm, target_name)
+    return mm
+
+
+def to_tokens(text):
+    return [ord(char) for char in text] + [0]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_block_engine(golden):
+    """Исполнение базовыми блоками (`engine="blocks"`) и оттранслированным
+    образом (`engine="translated"`) должно давать тот же вывод, число
+    инструкций и тактов, что и пошаговый интерпретатор."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target_name = compile_source(golden["in_source"], tmpdirname)
+        input_tokens = to_tokens(golden["in_stdin"])
+        results = []
+        for engine in ("step", "blocks", "translated"):
+            results.append(runner.simulation(load(target_name), list(input_tokens), limit=1500, engine=engine))
+        assert results[0] == results[1] == results[2]
+
+
+def test_negative_address_invalidates_code():
+    """Запись по отрицательному адресу (SP ниже 0) попадает в слово с конца
+    памяти и сбрасывает его декодированную копию во всех движках, в том числе
+    когда это слово -- часть исполняемого блока."""
+    word_write = [
+        "JMP 2",
+        "WORD32 268435456",  # HALT
+        "MOV EAX, [1]",
+        "MOV [SP-1], EAX",  # SP = 0: пишет HALT в слово 4 того же блока
+        "JMP 2",
+    ]
+    byte_write = [
+        "JMP 2",
+        "WORD32 16",
+        "MOV EAX, [1]",
+        "PUSH -4",
+        "MOV [[SP]], AL",  # старший байт слова 5 того же блока: JMP 2 -> HALT
+        "JMP 2",
+    ]
+    for programm, result in ((word_write, (3, 7)), (byte_write, (4, 14))):
+        words = runner.assemble(programm)
+        for engine in ("step", "blocks", "translated"):
+            mm = runner.MemoryManager()
+            mm.load_words(words)
+            assert runner.simulation(mm, [], limit=100, engine=engine)[1:] == result
+            assert mm.memory[-1] >> 28 == 1  # HALT
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_binary_image(golden):
+    """Двоичный образ (`*.bin`) загружается в ту же память и исполняется так
+    же, как JSON-список строк ассемблера."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        results = []
+        for suffix in (".asm", ".bin"):
+            mm = load(compile_source(golden["in_source"], tmpdirname, suffix))
+            memory = list(mm.memory)
+            results.append((memory, runner.programm, runner.simulation(mm, to_tokens(golden["in_stdin"]), limit=1500)))
+        assert results[0] == results[1]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_cache_model(golden):
+    """Кэш меняет только число тактов: вывод и число инструкций те же, каждое
+    обращение к памяти учтено как попадание или промах."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target_name = compile_source(golden["in_source"], tmpdirname)
+        input_tokens = to_tokens(golden["in_stdin"])
+        expected = runner.simulation(load(target_name), list(input_tokens), limit=1500)
+        for replacement, write_policy in (("lru", "back"), ("fifo", "through"), ("random", "back")):
+            cache = runner.Cache(size=64, replacement=replacement, write_policy=write_policy)
+            output, instr_counter, ticks = runner.simulation(
+                load(target_name), list(input_tokens), limit=1500, cache=cache
+            )
+            stats = cache.report()
+            assert (output, instr_counter) == expected[:2]
+            assert ticks >= expected[2] + cache.miss_ticks * stats["read_misses"]
+            assert stats["reads"] == stats["read_hits"] + stats["read_misses"]
+            assert stats["writes"] == stats["write_hits"] + stats["write_misses"]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_split_caches(golden):
+    """Раздельные кэши инструкций и данных со статистикой по областям образа."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        mm = load(compile_source(golden["in_source"], tmpdirname, ".bin"))
+        assert [name for _, name in mm.regions] == ["code", "stack", "globals", "constants", "code", "heap"]
+        icache, dcache = runner.Cache(), runner.Cache()
+        _, instr_counter, _ = runner.simulation(
+            mm, to_tokens(golden["in_stdin"]), limit=1500, icache=icache, dcache=dcache
+        )
+        istats, dstats = icache.report(), dcache.report()
+        # выборка остановившей машину инструкции (HALT) в instr_counter не входит
+        assert istats["reads"] in (instr_counter, instr_counter + 1)
+        assert set(istats["regions"]) == {"code"}
+        assert "stack" in dstats["regions"]
+        for stats in (istats, dstats):
+            for key in ("reads", "read_misses", "writes", "write_misses"):
+                assert stats[key] == sum(region[key] for region in stats["regions"].values())
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_binary_trace(golden):
+    """Двоичная трасса (в файл и в кольцевой буфер) восстанавливается
+    `trace_dump` в тот же журнал, что пишет `runner.main`."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target_name = compile_source(golden["in_source"], tmpdirname)
+        trace_name = os.path.join(tmpdirname, "target.trace")
+        ring = runner.TraceRecorder(capacity=1 << 12)
+        with open(trace_name, "wb") as stream:
+            for trace in (runner.TraceRecorder(stream), ring):
+                runner.simulation(load(target_name), to_tokens(golden["in_stdin"]), limit=1500, trace=trace)
+
+        for records in (runner.read_trace(trace_name), list(ring.records())):
+            lines = trace_dump.render(records, runner.programm)
+            assert "".join(line + "\n" for line in lines) == golden.out["out_dbg"]
+        with pytest.raises(ValueError, match="not a trace file"):
+            runner.read_trace(target_name)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_profiler(golden):
+    """Профиль учитывает каждую исполненную инструкцию и каждый такт, а
+    стеки вызовов начинаются с функции `<main>`."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        mm = load(compile_source(golden["in_source"], tmpdirname, ".bin"))
+        profile = runner.Profiler()
+        _, instr_counter, ticks = runner.simulation(mm, to_tokens(golden["in_stdin"]), limit=1500, profile=profile)
+
+        assert sum(profile.counts.values()) == instr_counter
+        assert sum(profile.ticks.values()) == ticks
+        assert sum(int(line.rsplit(" ", 1)[1]) for line in profile.collapsed()) == ticks
+        assert profile.functions()["<main>"][2] == ticks - profile.stacks["?"]
+        assert "hot addresses:" in profile.report(runner.programm)
+
+        # всё исполненное, кроме JMP START, привязано к строкам исходного кода
+        source_lines = golden["in_source"].split("\n")
+        for address in profile.counts:
+            position = runner.source_position(mm.lines, address)
+            assert (position is None) == (address == 0)
+            if position is not None:
+                offset, line, column = position
+                assert source_lines[line - 1][column - 1] == golden["in_source"][offset]
+        assert sum(ticks for _, ticks in profile.source_lines().values()) == ticks - profile.ticks[0]
+
+
+def write_inputs(texts, tmpdirname):
+    input_names = []
+    for i, text in enumerate(texts):
+        input_names.append(os.path.join(tmpdirname, "input{}.txt".format(i)))
+        with open(input_names[-1], "w", encoding="utf-8") as file:
+            file.write(text)
+    return input_names
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_batch(golden):
+    """`run_batch` возвращает результаты в порядке входных файлов, такие же,
+    как у отдельных запусков."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target_name = compile_source(golden["in_source"], tmpdirname, ".bin")
+        inputs = [golden["in_stdin"], "", golden["in_stdin"][::-1], "Bob"] * 2
+        input_names = write_inputs(inputs, tmpdirname)
+        expected = [runner.simulation(load(target_name), to_tokens(text), limit=1500) for text in inputs]
+        for engine, workers, snapshot in (("step", 1, True), ("translated", 2, False), ("blocks", 2, True)):
+            results = runner.run_batch(target_name, input_names, engine=engine, workers=workers, snapshot=snapshot)
+            assert list(results) == expected
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_lockstep(golden):
+    """`LockstepEngine` на многих входах даёт те же вывод, число инструкций и
+    тактов, что и отдельные запуски `simulation`."""
+    pytest.importorskip("numpy")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target_name = compile_source(golden["in_source"], tmpdirname, ".bin")
+        texts = [golden["in_stdin"], "", golden["in_stdin"][::-1], "Bob", "Alice", "x" * 20]
+        inputs = [to_tokens(text) for text in texts]
+        mm = load(target_name)
+        expected = [runner.simulation(mm.copy(), list(tokens), limit=1500) for tokens in inputs]
+        assert runner.LockstepEngine(mm.memory, inputs).run(1500) == expected
+        input_names = write_inputs(texts, tmpdirname)
+        assert list(runner.run_batch(target_name, input_names, engine="lockstep")) == expected
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_snapshot(golden):
+    """Исполнение со снимка перед первым `INT IN` (после записи в файл и
+    чтения) приходит в то же состояние, что и исполнение с начала."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        mm = load(compile_source(golden["in_source"], tmpdirname))
+        snapshot_name = os.path.join(tmpdirname, "target.snapshot")
+        snapshot = runner.snapshot_before_input(mm.copy(), limit=1500)
+        if snapshot is None:  # программа не читает ввод
+            return
+        snapshot.save(snapshot_name)
+        input_tokens = to_tokens(golden["in_stdin"])
+        expected = runner.simulation(mm, list(input_tokens), limit=1500)
+        for engine in ("step", "blocks"):
+            restored = runner.MemoryManager()
+            result = runner.simulation(
+                restored, list(input_tokens), limit=1500, engine=engine, start=runner.Snapshot.load(snapshot_name)
+            )
+            assert result == expected
+            assert restored.memory == mm.memory
+
+
+HEAP_PROGRAMM = [
+    "MOV EAX, 4",
+    "INT MALLOC32",  # 16..19
+    "MOV EAX, 2",
+    "INT MALLOC32",  # 20..21
+    "MOV EAX, 57005",
+    "MOV [20], EAX",
+    "MOV [21], EAX",
+    "MOV EAX, 16",
+    "INT FREE",
+    "MOV EAX, 3",
+    "INT MALLOC32",  # 16..18, свободно 19
+    "MOV EAX, 20",
+    "INT FREE",  # свободно 19..21
+    "MOV EAX, 16",
+    "INT MALLOC8",  # 19..22
+    "HALT",
+]
+
+
+def test_heap():
+    """`FREE` возвращает блок в кучу: следующий `MALLOC` переиспользует его,
+    соседние свободные блоки сливаются, свободный блок в конце памяти
+    дорастает до нужного размера и выделяется обнулённым."""
+    words = runner.assemble(HEAP_PROGRAMM)
+    for engine in ("step", "blocks"):
+        mm = runner.MemoryManager()
+        mm.load_words(words)
+        assert runner.simulation(mm, [], limit=100, engine=engine)[1] == 15
+        assert mm.heap_blocks == {16: 3, 19: 4}
+        assert list(mm.memory[19:]) == [0, 0, 0, 0]
+        stats = mm.heap_stats()
+        assert (stats["live_bytes"], stats["peak_bytes"], stats["allocations"], stats["frees"]) == (28, 28, 4, 2)
+        assert mm.copy().heap_stats() == stats
+
+    mm = runner.MemoryManager()
+    mm.load_words(runner.assemble(["MOV EAX, 12", "INT FREE", "HALT"]))
+    assert runner.simulation(mm, [], limit=100)[1] == 1  # E762: блок не выделен
+
+
+def test_lockstep_heap():
+    """`MALLOC` и `FREE` в `LockstepEngine`: у каждой машины своя куча, блоки
+    выделяются обнулёнными, как в `MemoryManager`."""
+    pytest.importorskip("numpy")
+    words = runner.assemble(HEAP_PROGRAMM)
+    mm = runner.MemoryManager()
+    mm.load_words(words)
+    expected = runner.simulation(mm, [], limit=100)
+    engine = runner.LockstepEngine(words, [[], []])
+    assert engine.run(100) == [expected] * 2
+    assert list(engine.length) == [len(mm.memory)] * 2
+    assert engine.memory[:, : len(mm.memory)].tolist() == [list(mm.memory)] * 2
+
+
+def test_lockstep_fault():
+    """Адрес за пределами памяти машины (а не общей матрицы, расширенной
+    кучей соседней машины) завершает ошибкой только эту машину, отрицательный
+    адрес отсчитывается от конца её памяти -- как в `simulation`."""
+    pytest.importorskip("numpy")
+    words = runner.assemble(["INT IN", "INT MALLOC32", "INT IN", "MOV EAX, [EAX]", "INT OUT", "HALT", "WORD32 65"])
+    inputs = [[40, 6], [1, 20], [1, -2], [1, 6], [1, -100]]
+    engine = runner.LockstepEngine(words, [list(tokens) for tokens in inputs])
+    results = engine.run(50)
+    for tokens, result, error in zip(inputs, results, engine.errors):
+        mm = runner.MemoryManager()
+        mm.load_words(words)
+        try:
+            expected = runner.simulation(mm, list(tokens), limit=50)
+        except IndexError:
+            assert isinstance(error, IndexError)
+        else:
+            assert error is None
+            assert result == expected
+    assert [error is None for error in engine.errors] == [True, False, True, True, False]
+
+
+def test_local_arrays_freed():
+    """Массивы функций и блоков освобождаются при выходе из них: вызовы в
+    цикле не увеличивают кучу."""
+    source = """
+void fill(int32 n) {
+    int16 buffer[n + 1]
+    buffer[0] = n
+    if (n > 2) {
+        int32 tmp[3]
+        tmp[1] = n
+    }
+}
+int8 global[4]
+int32 i = 0
+while (i < 10) {
+    int8 chars[2]
+    fill(i)
+    i = i + 1
+}
+OUT(65)
+"""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target_name = compile_source(source, tmpdirname)
+        for engine in ("step", "blocks"):
+            mm = load(target_name)
+            assert runner.simulation(mm, [], limit=100000, engine=engine)[0] == "A"
+            stats = mm.heap_stats()
+            assert stats["allocations"] == 1 + 10 + 10 + 7
+            assert stats["frees"] == 10 + 10 + 7
+            assert stats["live_bytes"] == 4  # global
+            assert stats["heap_bytes"] <= 4 + 4 + 20 + 12  # global, chars, buffer[10], tmp
+
+
+def test_escaping_array_not_freed():
+    """Массив, адрес которого функция возвращает, не освобождается: блок,
+    выделенный следующим, не затирает его."""
+    source = """
+void print_str(str pnt){int32 i=0;while(pnt[i]){OUT(pnt[i]);i=i+1}}
+int32 make(int32 n) {
+    int8 buffer[n]
+    buffer[0] = 65
+    buffer[1] = 66
+    buffer[2] = 0
+    n = buffer
+}
+void clobber(int32 n) {
+    int8 other[n]
+    int32 i = 0
+    while (i < n) { other[i] = 88; i = i + 1 }
+}
+int32 pnt = make(4)
+clobber(4)
+print_str(pnt)
+"""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target_name = compile_source(source, tmpdirname)
+        for engine in ("step", "blocks"):
+            mm = load(target_name)
+            assert runner.simulation(mm, [], limit=100000, engine=engine)[0] == "AB"
+            stats = mm.heap_stats()
+            assert stats["allocations"] == 2
+            assert stats["frees"] == 1  # other
+
+
+def test_heap_fragmentation():
+    mm = runner.MemoryManager()
+    blocks = [mm.malloc(size) for size in (1, 2, 4, 8)]
+    mm.free(blocks[0])
+    mm.free(blocks[2])
+    assert mm.free_blocks == {0: 1, 3: 4}
+    assert mm.heap_stats()["fragmentation"] == 1 - 4 / 5
+    assert mm.malloc(3) == 3  # класс 1 пуст, берётся блок из класса 2
+    mm.free(blocks[1])
+    assert mm.free_blocks == {0: 3, 6: 1}
+    assert not mm.free(blocks[1])
+
+
+def test_benchmark():
+    """Бенчмарк записывает результаты в JSON; счётчики совпадают у всех движков."""
+    workloads = [*benchmark.golden_workloads(), *benchmark.synthetic_workloads(scale=0.01)]
+    results = benchmark.run(workloads, min_time=0, isolate=False)
+    assert len(results) == len(workloads) * len(benchmark.ENGINES)
+    for i in range(0, len(results), len(benchmark.ENGINES)):
+        group = results[i : i + len(benchmark.ENGINES)]
+        assert len({(r["instr_counter"], r["ticks"], r["output_length"]) for r in group}) == 1
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        file_name = os.path.join(tmpdirname, "results.json")
+        benchmark.write_results(file_name, results, 0.01)
+        with open(file_name, encoding="utf-8") as file:
+            assert json.load(file)["results"] == results
+
+
+def test_codegen_baseline():
+    """Инструкции, такты и размер кода эталонных программ не хуже базовых
+    (`codegen_benchmark.py update` обновляет их после улучшений)."""
+    report = codegen_benchmark.compare(codegen_benchmark.measure_all(), codegen_benchmark.load_baseline())
+    assert [(name, status) for name, status, _ in report if status not in ("same", "improvement")] == []
+
+
+def test_compile_cache():
+    """Повторная трансляция берёт функции из кэша, а образ совпадает с
+    трансляцией без кэша -- в том числе после сдвига и правки функций."""
+    main = "int32 k = 12345\nprint_int(k)\n"
+    edited = benchmark.PRINT_INT.replace("result + 1", "1 + result")
+    runs = [
+        (benchmark.PRINT_INT + main, 2, 0),
+        ("int32 n = 7\n" + benchmark.PRINT_INT + main, 0, 2),  # сдвиг позиций
+        (edited + main, 1, 1),
+    ]
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        source_name = os.path.join(tmpdirname, "source.lsp")
+        cache_name = os.path.join(tmpdirname, "cache.json")
+        for source, compiled, cached in runs:
+            with open(source_name, "w", encoding="utf-8") as file:
+                file.write(source)
+            images = []
+            for cache_file in (None, cache_name):
+                target_name = os.path.join(tmpdirname, "target.bin")
+                with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                    compiler.main(source_name, target_name, cache_file)
+                with open(target_name, "rb") as file:
+                    images.append(file.read())
+            assert images[0] == images[1]
+            assert "functions compiled: {} cached: {}".format(compiled, cached) in stdout.getvalue()
+        # функцию из кэша лексер выдаёт одной лексемой, не разбирая её текст
+        cache = compiler.FunctionCache.load(cache_name)
+        kinds = [token.t for token in compiler.tokenize(edited + main, cache)]
+        assert kinds.count("FUNCTION") == 2
+        assert "BRANCHING" not in kinds
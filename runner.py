@@ -1,6 +1,24 @@
 #!/usr/bin/python3
+import array
+import bisect
+import collections
+import concurrent.futures
+import hashlib
+import json
 import logging
+import multiprocessing
+import pathlib
+import random
+import struct
 import sys
+from typing import ClassVar
+
+from image import IMAGE_MAGIC, assemble, error_list, read_image
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только LockstepEngine
+    np = None
 
 
 class MemoryManager:
@@ -94,199 +112,282 @@ class MemoryManager:
          ```
     """
 
+    # номер полуслова/байта внутри слова при обратном (little-endian) порядке
+    # байт в самом массиве: старшие байты слова идут первыми (big-endian)
+    SWAP: ClassVar[dict] = {1: 0, 2: 1, 4: 3} if sys.byteorder == "little" else {1: 0, 2: 0, 4: 0}
+    MASK: ClassVar[dict] = {1: 0xFFFFFFFF, 2: 0xFFFF, 4: 0xFF}
+
     def __init__(self):
-        self.memory = []
+        self.memory = array.array("I")
+        assert self.memory.itemsize == 4
         self.mod = 1
+        self.write_listeners = []
+        # области адресного пространства: [(начало в словах, имя)] по возрастанию
+        self.regions = [(0, "memory")]
+        # функции образа: [(начало, конец, имя)] по возрастанию
+        self.symbols = []
+        # таблица строк: [(адрес, смещение, строка, столбец)] по возрастанию адреса
+        self.lines = []
+        self.halfwords = None
+        self.bytes = None
+        self.views = None
+        self._make_views()
+        # куча: занятые блоки {начало: размер в словах}, свободные блоки
+        # {начало: размер} и {конец: начало} для слияния соседей, списки
+        # начал свободных блоков по классам размера (класс k -- от 2**k до
+        # 2**(k+1)-1), упорядоченные по адресу
+        self.heap_blocks = {}
+        self.free_blocks = {}
+        self.free_ends = {}
+        self.free_lists = [[] for _ in range(32)]
+        self.heap_live = 0
+        self.heap_peak = 0
+        self.heap_allocations = 0
+        self.heap_frees = 0
+
+    def _make_views(self):
+        raw = memoryview(self.memory).cast("B")
+        self.halfwords = raw.cast("H")
+        self.bytes = raw
+        self.views = {1: self.memory, 2: self.halfwords, 4: self.bytes}
+
+    def grow(self, count_of_int32):
+        """Добавляет `count_of_int32` нулевых слов в конец памяти."""
+        address = len(self.memory)
+        # пока есть представления memoryview, массив нельзя расширить
+        self.halfwords.release()
+        self.bytes.release()
+        self.memory.frombytes(bytes(4 * count_of_int32))
+        self._make_views()
+        return address
 
     def malloc(self, count_of_int32):
+        """Выделяет блок из `count_of_int32` нулевых слов в куче.
+
+        Сначала ищется свободный блок в списке класса размера запроса (первый
+        подходящий по адресу), затем в старших классах; остаток блока
+        возвращается в списки. Если подходящего блока нет, память
+        расширяется (свободный блок в конце памяти дорастает до нужного размера).
+        """
         assert count_of_int32 > 0, "count_of_int32<=0"
-        address = len(self.memory)
-        self.memory.extend([0] * count_of_int32)
+        address = self._take_free(count_of_int32)
+        if address is None:
+            address = len(self.memory)
+            if self.free_ends.get(address) is not None:
+                address = self.free_ends[address]
+                # освобождённый блок мог быть записан, обнуляем его, как в `_take_free`
+                self.memory[address:] = array.array("I", bytes(4 * (len(self.memory) - address)))
+                self.grow(count_of_int32 - self._unlink(address))
+            else:
+                self.grow(count_of_int32)
+        self.heap_blocks[address] = count_of_int32
+        self.heap_live += count_of_int32
+        self.heap_peak = max(self.heap_peak, self.heap_live)
+        self.heap_allocations += 1
         return address
 
+    def free(self, address):
+        """Освобождает блок, выделенный `malloc` по адресу `address` (в
+        словах), и сливает его со свободными соседями. Возвращает False, если
+        по адресу нет занятого блока."""
+        size = self.heap_blocks.pop(address, None)
+        if size is None:
+            return False
+        self.heap_live -= size
+        self.heap_frees += 1
+        if address + size in self.free_blocks:
+            size += self._unlink(address + size)
+        previous = self.free_ends.get(address)
+        if previous is not None:
+            size += self._unlink(previous)
+            address = previous
+        self._link(address, size)
+        return True
+
+    def _take_free(self, count):
+        size_class = count.bit_length() - 1
+        # в своём классе -- первый подходящий по адресу, в старших подходит любой
+        address = next((start for start in self.free_lists[size_class] if self.free_blocks[start] >= count), None)
+        if address is None:
+            address = next((starts[0] for starts in self.free_lists[size_class + 1 :] if starts), None)
+            if address is None:
+                return None
+        size = self._unlink(address)
+        if size > count:
+            self._link(address + count, size - count)
+        # выделенная память всегда нулевая, как и при расширении
+        self.memory[address : address + count] = array.array("I", bytes(4 * count))
+        return address
+
+    def _link(self, start, size):
+        self.free_blocks[start] = size
+        self.free_ends[start + size] = start
+        bisect.insort(self.free_lists[size.bit_length() - 1], start)
+
+    def _unlink(self, start):
+        size = self.free_blocks.pop(start)
+        del self.free_ends[start + size]
+        starts = self.free_lists[size.bit_length() - 1]
+        del starts[bisect.bisect_left(starts, start)]
+        return size
+
+    def heap_stats(self):
+        """Статистика кучи в байтах: занято сейчас, пик, свободно внутри кучи,
+        размер кучи, число выделений и освобождений и фрагментация
+        (1 - наибольший свободный блок / весь свободный объём)."""
+        free = sum(self.free_blocks.values())
+        largest = max(self.free_blocks.values(), default=0)
+        return {
+            "live_bytes": 4 * self.heap_live,
+            "peak_bytes": 4 * self.heap_peak,
+            "free_bytes": 4 * free,
+            "heap_bytes": 4 * (self.heap_live + free),
+            "allocations": self.heap_allocations,
+            "frees": self.heap_frees,
+            "fragmentation": 1 - largest / free if free else 0.0,
+        }
+
+    def heap_state(self):
+        """Состояние кучи в виде, пригодном для JSON (для снимков)."""
+        return {
+            "blocks": sorted(self.heap_blocks.items()),
+            "free": sorted(self.free_blocks.items()),
+            "peak": self.heap_peak,
+            "allocations": self.heap_allocations,
+            "frees": self.heap_frees,
+        }
+
+    def set_heap_state(self, state):
+        self.heap_blocks = {start: size for start, size in state["blocks"]}
+        self.heap_live = sum(self.heap_blocks.values())
+        for start, size in state["free"]:
+            self._link(start, size)
+        self.heap_peak = state["peak"]
+        self.heap_allocations = state["allocations"]
+        self.heap_frees = state["frees"]
+
+    def load_words(self, words):
+        """Выделяет память под `words` (`array('I')`) и копирует их одним блоком."""
+        address = self.grow(len(words))
+        self.memory[address : address + len(words)] = words
+        return address
+
+    def copy(self):
+        """Новый `MemoryManager` с копией памяти и описания образа."""
+        mm = MemoryManager()
+        mm.load_words(self.memory)
+        mm.regions = self.regions
+        mm.symbols = self.symbols
+        mm.lines = self.lines
+        mm.set_heap_state(self.heap_state())
+        return mm
+
     def set_mod(self, mod):
         assert mod in [1, 2, 4]
         self.mod = mod
 
     def setmem(self, address, value):
-        assert address // self.mod < len(self.memory)
-        self.memory[address // self.mod] = self._set_word(
-            self.memory[address // self.mod], value, address % self.mod, self.mod
-        )
-
-    def _set_word(self, int32, word, select_word, word_size):
-        MAG = 0b11111111_11111111_11111111_11111111
-        MAG2 = 32
-        start_word = 0
-        if word_size == 2:
-            MAG = 0b11111111_11111111
-            MAG2 = 16
-            start_word = (1 - select_word) * MAG2
-        elif word_size == 4:
-            MAG = 0b11111111
-            MAG2 = 8
-            start_word = (3 - select_word) * MAG2
-        mask = MAG << start_word
-        masked_int32 = int32 & ~mask
-        new_word = word & MAG
-        new_word = new_word << start_word
-        return masked_int32 | new_word
-
-    def _get_word(self, int32, select_word, word_size):
-        MAG = 0b11111111_11111111_11111111_11111111
-        MAG2 = 32
-        start_word = 0
-        if word_size == 2:
-            MAG = 0b11111111_11111111
-            MAG2 = 16
-            start_word = (1 - select_word) * MAG2
-        elif word_size == 4:
-            MAG = 0b11111111
-            MAG2 = 8
-            start_word = (3 - select_word) * MAG2
-        return (int32 >> start_word) & MAG
+        mod = self.mod
+        index = address // mod
+        assert index < len(self.memory)
+        self.views[mod][address ^ self.SWAP[mod]] = value & self.MASK[mod]
+        if index < 0:
+            # отрицательный адрес (SP ниже 0) пишет в слово с конца памяти, как
+            # индекс списка; кэшам сообщаем настоящий номер слова
+            index += len(self.memory)
+        # машина фон-неймановская: запись может попасть в код, сообщаем кэшам
+        for listener in self.write_listeners:
+            listener(index)
 
     def getmem(self, address):
-        return self._get_word(self.memory[address // self.mod], address % self.mod, self.mod)
+        mod = self.mod
+        return self.views[mod][address ^ self.SWAP[mod]]
 
 
 mm = MemoryManager()
-error_list = []
 
 
 def crop_int_to_int32(num):
-    max_int32 = 2**31 - 1
-    min_int32 = -(2**31)
-    cropped_num = num & 0xFFFFFFFF
-    if cropped_num & 0x80000000:
-        return -(0x100000000 - cropped_num) if cropped_num > max_int32 else cropped_num
-    else:
-        return cropped_num
+    return ((num + 0x80000000) & 0xFFFFFFFF) - 0x80000000
 
 
 def crop_int_to_int16(num):
-    max_int32 = 2**15 - 1
-    min_int32 = -(2**15)
-    cropped_num = num & 0xFFFF
-    if cropped_num & 0x8000:
-        return -(0x10000 - cropped_num) if cropped_num > max_int32 else cropped_num
+    return ((num + 0x8000) & 0xFFFF) - 0x8000
+
+
+programm = []
+
+
+def load_image(mm, file_name):
+    global programm
+    words, debug = read_image(file_name)
+    if debug is not None and "asm" in debug:
+        programm = debug["asm"]
     else:
-        return cropped_num
+        programm = ["WORD32 {}".format(crop_int_to_int32(word)) for word in words]
+    mm.load_words(words)
+    mm.regions = image_regions(words, debug)
+    mm.symbols = image_symbols(words, debug, mm.regions)
+    mm.lines = [tuple(row) for row in debug["lines"]] if debug is not None and "lines" in debug else []
 
 
-def crop_int_to_uint16(num):
-    max_uint16 = 2**16 - 1
-    min_uint16 = 0
-    cropped_num = num & 0xFFFF
-    return min(max_uint16, max(min_uint16, cropped_num))
+def image_regions(words, debug=None):
+    """Области образа для статистики кэшей.
 
+    Берутся из отладочной секции (их записывает `compiler.write_image`), а без
+    неё восстанавливаются по первой инструкции `JMP START`: данные (стек,
+    глобальные переменные и строки) лежат между ней и началом кода.
+    """
+    if debug is not None and "regions" in debug:
+        return [(start, name) for name, start in debug["regions"]]
+    if words and words[0] >> 28 == 10 and words[0] >> 16 & 0xF == 0:
+        start = words[0] & 0xFFFF
+        return [(0, "code"), (1, "data"), (start, "code"), (len(words), "heap")]
+    return [(0, "code"), (len(words), "heap")]
 
-programm = []
 
+def image_symbols(words, debug, regions):
+    """Функции образа для профилировщика.
 
-def load_program(mm, file_name):
-    def A(REG):
-        return ["AL", "AX", "EAX"].index(REG) * 0b00000100_00000000_00000000_00000000
-
-    def F(NUM):
-        #            000     001      010       011         100        101         110        111
-        # F(ARG) ::= NUM || [NUM] || EAX+NUM || [EAX+NUM] ||  IP+NUM || [IP+NUM] ||  SP+NUM || [SP+NUM]
-        NUM = NUM.strip()
-        in_mem = 1 if "[" in NUM else 0
-        if in_mem == 1:
-            NUM = NUM[1:-1]
-        value = 0
-        if NUM.replace("+", " ").replace("-", " ").split(" ")[-1].isdigit():
-            value = (1 if NUM.count("-") % 2 == 0 else -1) * int(NUM.replace("+", " ").replace("-", " ").split(" ")[-1])
-        if NUM.isdigit():
-            return in_mem * 0b1_00000000_00000000 + crop_int_to_uint16(value)
-        REG = NUM.replace("+", " ").replace("-", " ").split(" ")[0]
-        return (["", "EAX", "IP", "SP"].index(REG) * 2 + in_mem) * 0b1_00000000_00000000 + crop_int_to_uint16(value)
-
-    def compile_programm(ptr, programm):
-        for i in range(len(programm)):
-            cmd = programm[i].split("#")[0].strip().replace(",", " ").replace("  ", " ").replace("  ", " ").split(" ")
-            # print(cmd)
-            if cmd[0] == "NOP":
-                mm.setmem(ptr + i, 0b00000000_00000000_00000000_00000000)
-            elif cmd[0] == "HALT":
-                mm.setmem(ptr + i, 0b00010000_00000000_00000000_00000000)
-            elif cmd[0] == "MOV":
-                if cmd[1] in ("AL", "AX", "EAX"):
-                    mm.setmem(ptr + i, 0b00100000_00000000_00000000_00000000 + A(cmd[1]) + F(cmd[2]))
-                else:
-                    mm.setmem(ptr + i, 0b00110000_00000000_00000000_00000000 + A(cmd[2]) + F(cmd[1][1:-1]))
-            elif cmd[0] == "WORD32":
-                mm.setmem(ptr + i, crop_int_to_int32(int(cmd[1])))
-            elif cmd[0] in ("ADC", "ADD", "SBC", "SUB", "OR", "XOR", "AND", "MUL", "SHR", "SHL", "CMP", "MOD"):
-                mm.setmem(
-                    ptr + i,
-                    0b01000000_00000000_00000000_00000000
-                    + (
-                        ["ADC", "ADD", "SBC", "SUB", "OR", "XOR", "AND", "MUL", "SHR", "SHL", "CMP", "MOD"].index(
-                            cmd[0]
-                        )
-                        << 20
-                    )
-                    + A("EAX")
-                    + F(cmd[1]),
-                )
-            elif cmd[0] in ("NOT", "NEG", "RCL", "RCR", "ZEXT8", "ZEXT16", "EXT8", "EXT16"):
-                mm.setmem(
-                    ptr + i,
-                    0b01010000_00000000_00000000_00000000
-                    + (["NOT", "NEG", "RCL", "RCR", "ZEXT8", "ZEXT16", "EXT8", "EXT16"].index(cmd[0]) << 20),
-                )
-            elif cmd[0] in ("OUT", "IN", "MALLOC32", "MALLOC16", "MALLOC8"):
-                mm.setmem(
-                    ptr + i,
-                    0b01100000_00000000_00000000_00000000
-                    + (["OUT", "IN", "MALLOC32", "MALLOC16", "MALLOC8"].index(cmd[0]) << 16),
-                )
-            elif cmd[0] == "INT" and cmd[1] in ("OUT", "IN", "MALLOC32", "MALLOC16", "MALLOC8"):
-                mm.setmem(
-                    ptr + i,
-                    0b01100000_00000000_00000000_00000000
-                    + (["OUT", "IN", "MALLOC32", "MALLOC16", "MALLOC8"].index(cmd[1]) << 16),
-                )
-            elif cmd[0] == "CALL" and cmd[1] in ["A", "E", "NE", "G", "L", "GE", "LE"]:
-                mm.setmem(
-                    ptr + i,
-                    0b10000000_00000000_00000000_00000000
-                    + (["A", "E", "NE", "G", "L", "GE", "LE"].index(cmd[1]) << 20)
-                    + F(cmd[2]),
-                )
-            elif cmd[0] == "CALL":
-                mm.setmem(ptr + i, 0b10000000_00000000_00000000_00000000 + F(cmd[1]))
-            elif cmd[0] == "RET":
-                mm.setmem(ptr + i, 0b10010000_00000000_00000000_00000000)
-            elif cmd[0] == "JMP" and cmd[1] in ["A", "E", "NE", "G", "L", "GE", "LE"]:
-                mm.setmem(
-                    ptr + i,
-                    0b10100000_00000000_00000000_00000000
-                    + (["A", "E", "NE", "G", "L", "GE", "LE"].index(cmd[1]) << 20)
-                    + F(cmd[2]),
-                )
-            elif cmd[0] == "JMP":
-                mm.setmem(ptr + i, 0b10100000_00000000_00000000_00000000 + F(cmd[1]))
-            elif cmd[0] == "PUSH":
-                mm.setmem(ptr + i, 0b10110000_00000000_00000000_00000000 + F(cmd[1]))
-            elif cmd[0] == "POP":
-                mm.setmem(ptr + i, 0b11000000_00000000_00000000_00000000)
-            elif cmd[0] == "SWAP":
-                mm.setmem(ptr + i, 0b11010000_00000000_00000000_00000000 + F(cmd[1][1:-1]))
-            else:
-                error_list.append("undefined command: " + " ".join(cmd))
+    Берутся из отладочной секции (`compiler.write_image`), а без неё
+    функциями считаются точка входа (`<main>`, цель `JMP START`) и цели
+    инструкций CALL в коде (`sub_<адрес>`); функция продолжается до начала
+    следующей.
+    """
+    if debug is not None and "symbols" in debug:
+        return sorted((start, end, name) for name, start, end in debug["symbols"])
+    bounds = [start for start, _ in regions] + [len(words)]
+    code = [(bounds[i], bounds[i + 1]) for i, (start, name) in enumerate(regions) if name == "code" and start > 0]
+    if not code:
+        return []
+    entry = code[0][0]
+    starts = {entry}
+    for first, last in code:
+        for address in range(first, min(last, len(words))):
+            word = words[address]
+            if word >> 28 == 8 and word >> 16 & 0x7 in (0, 4):
+                target = crop_int_to_int16(word) + (0 if word >> 16 & 0x7 == 0 else address + 1)
+                if first <= target < last:
+                    starts.add(target)
+    starts = sorted(starts)
+    ends = starts[1:] + [code[-1][1]]
+    return [(start, end, "<main>" if start == entry else "sub_{}".format(start)) for start, end in zip(starts, ends)]
 
-    import json
 
+def load_program(mm, file_name):
+    """Загружает программу: двоичный образ (`image.write_image`) или JSON-список строк ассемблера."""
+    global programm
+    with open(file_name, "rb") as f:
+        binary = f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
+    if binary:
+        load_image(mm, file_name)
+        return
     with open(file_name) as f:
-        global programm
         programm = json.load(f)
-        ptr = mm.malloc(len(programm))
-        compile_programm(ptr, programm)
-        # for i in range(0,len(programm)):
-        #    print('at '+str(ptr+i)+' with command "'+programm[i]+'" value is '+str(mm.getmem(ptr+i)))
+    words = assemble(programm)
+    mm.load_words(words)
+    mm.regions = image_regions(words)
+    mm.symbols = image_symbols(words, None, mm.regions)
 
 
 class magic_numbers:
@@ -310,6 +411,251 @@ class magic_numbers:
     MUX_DM_MOD_4 = 2
 
 
+ALU_OPERATIONS = ["ADC", "ADD", "SBC", "SUB", "OR", "XOR", "AND", "MUL", "SHR", "SHL", "CMP", "MOD"]
+
+
+class AluOps:
+    """Коды операций АЛУ (`alu_op`): номер операции в `ALU_OPERATIONS` и биты-модификаторы."""
+
+    ADC = 0
+    ADD = 1
+    SBC = 2
+    SUB = 3
+    OR = 4
+    XOR = 5
+    AND = 6
+    MUL = 7
+    SHR = 8
+    SHL = 9
+    CMP = 10
+    MOD = 11
+    OP_MASK = 0xF
+
+    CROP_RIGHT_TO_INT16 = 1 << 4
+    SET_FLAG = 1 << 5
+    CEIL_DIV_2 = 1 << 6
+    CEIL_DIV_4 = 1 << 7
+    UNCEIL_DIV_2 = 1 << 8
+    UNCEIL_DIV_4 = 1 << 9
+    SCALE = CEIL_DIV_2 | CEIL_DIV_4 | UNCEIL_DIV_2 | UNCEIL_DIV_4
+
+    ADD_INT16 = ADD | CROP_RIGHT_TO_INT16
+
+
+ALU_FUNCTIONS = [
+    lambda left, right, carry: left + right + carry,  # ADC
+    lambda left, right, carry: left + right,  # ADD
+    lambda left, right, carry: left - right - carry,  # SBC
+    lambda left, right, carry: left - right,  # SUB
+    lambda left, right, carry: left | right,  # OR
+    lambda left, right, carry: left ^ right,  # XOR
+    lambda left, right, carry: left & right,  # AND
+    lambda left, right, carry: left * right,  # MUL
+    lambda left, right, carry: left >> right,  # SHR
+    lambda left, right, carry: left << right,  # SHL
+    lambda left, right, carry: left - right,  # CMP
+    lambda left, right, carry: left % right,  # MOD
+]
+
+# операции, устанавливающие OF и C (остальные меняют только Z и S)
+ALU_ARITHMETIC = (AluOps.ADC, AluOps.ADD, AluOps.SBC, AluOps.SUB, AluOps.CMP)
+
+
+class TokenInputPort:
+    """Порт ввода из готовой последовательности кодов символов."""
+
+    def __init__(self, tokens):
+        self.tokens = collections.deque(tokens)
+        self.consumed = 0
+
+    def read(self):
+        if not self.tokens:
+            raise EOFError()
+        self.consumed += 1
+        return self.tokens.popleft()
+
+
+class InputPort:
+    """Порт ввода из текстового потока (файл, канал).
+
+    Поток читается блоками по `chunk_size` символов по мере исполнения IN,
+    после конца потока порт один раз отдаёт `terminator` (если он задан),
+    затем -- EOFError.
+    """
+
+    def __init__(self, stream, chunk_size=1 << 16, terminator=0):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.terminator = terminator
+        self.chunk = ""
+        self.position = 0
+        self.consumed = 0
+
+    def read(self):
+        self.consumed += 1
+        if self.position == len(self.chunk):
+            self.chunk = self.stream.read(self.chunk_size)
+            self.position = 0
+            if not self.chunk:
+                if self.terminator is None:
+                    raise EOFError()
+                terminator, self.terminator = self.terminator, None
+                return terminator
+        symbol = self.chunk[self.position]
+        self.position += 1
+        return ord(symbol)
+
+
+class OutputPort:
+    """Порт вывода.
+
+    Выведенные символы копятся в `buffer` (его печатает журнал и возвращает
+    `simulation`), если `keep`, и пишутся в `stream`, если он задан. Политика
+    сброса `flush`: "end" -- только в `close`, "line" -- на каждом переводе
+    строки, целое n -- каждые n символов.
+    """
+
+    def __init__(self, stream=None, flush="end", keep=True):
+        assert flush in ("end", "line") or (isinstance(flush, int) and flush > 0), flush
+        self.stream = stream
+        self.flush = flush
+        self.keep = keep
+        self.buffer = []
+        self.pending = []
+
+    def write(self, symbol):
+        if self.keep:
+            self.buffer.append(symbol)
+        if self.stream is None:
+            return
+        self.pending.append(symbol)
+        if (self.flush == "line" and symbol == "\n") or len(self.pending) == self.flush:
+            self.flush_pending()
+
+    def writer(self):
+        """Функция вывода одного символа для горячих путей исполнения."""
+        return self.buffer.append if self.stream is None and self.keep else self.write
+
+    def flush_pending(self):
+        if self.pending:
+            self.stream.write("".join(self.pending))
+            self.pending.clear()
+        self.stream.flush()
+
+    def close(self):
+        if self.stream is not None:
+            self.flush_pending()
+
+
+class Cache:
+    """Модель кэша между `DataPath` и `MemoryManager`.
+
+    Адреса -- номера 32-битных слов памяти. `size` и `line_size` задаются в
+    словах, число наборов -- `size // (line_size * associativity)`.
+    Вытеснение -- "lru", "fifo" или "random", запись -- "back" (с
+    размещением строки при промахе, грязная строка записывается в память при
+    вытеснении) или "through" (без размещения, каждая запись доходит до
+    памяти).
+
+    Обращение в кэш стоит `hit_ticks`, обращение в память -- `miss_ticks`;
+    такты добавляются через `tick`, который подставляет `ControlUnit`.
+    Статистика за запуск копится в `stats`, а по областям памяти `regions`
+    (`MemoryManager.regions`: стек, глобальные переменные, строки, код,
+    куча) -- в `region_stats`.
+    """
+
+    def __init__(
+        self,
+        size=256,
+        line_size=4,
+        associativity=2,
+        replacement="lru",
+        write_policy="back",
+        hit_ticks=0,
+        miss_ticks=10,
+        seed=0,
+        regions=None,
+    ):
+        assert size % (line_size * associativity) == 0, "size % (line_size * associativity) != 0"
+        assert replacement in ("lru", "fifo", "random"), replacement
+        assert write_policy in ("back", "through"), write_policy
+        self.line_size = line_size
+        self.associativity = associativity
+        self.replacement = replacement
+        self.write_policy = write_policy
+        self.hit_ticks = hit_ticks
+        self.miss_ticks = miss_ticks
+        self.random = random.Random(seed)
+        # набор: номер строки -> строка грязная; порядок -- очередь вытеснения
+        self.sets = [collections.OrderedDict() for _ in range(size // (line_size * associativity))]
+        self.stats = collections.Counter()
+        self.region_stats = collections.defaultdict(collections.Counter)
+        self.set_regions(regions)
+        self.tick = lambda n: None
+
+    def set_regions(self, regions):
+        self.regions = regions
+        regions = regions if regions is not None else [(0, "memory")]
+        self.region_starts = [start for start, _ in regions]
+        self.region_names = [name for _, name in regions]
+
+    def region(self, index):
+        return self.region_names[max(bisect.bisect_right(self.region_starts, index) - 1, 0)]
+
+    def access(self, index, write=False):
+        kind = "write" if write else "read"
+        line = index // self.line_size
+        ways = self.sets[line % len(self.sets)]
+        self.stats[kind + "s"] += 1
+        region = self.region_stats[self.region(index)]
+        region[kind + "s"] += 1
+        if line in ways:
+            self.stats[kind + "_hits"] += 1
+            region[kind + "_hits"] += 1
+            ticks = self.hit_ticks
+            if self.replacement == "lru":
+                ways.move_to_end(line)
+            if write and self.write_policy == "back":
+                ways[line] = True
+        else:
+            self.stats[kind + "_misses"] += 1
+            region[kind + "_misses"] += 1
+            ticks = self.miss_ticks
+            if not write or self.write_policy == "back":
+                if len(ways) == self.associativity:
+                    ticks += self.evict(ways)
+                ways[line] = write
+        if write and self.write_policy == "through":
+            ticks = self.miss_ticks
+        self.tick(ticks)
+
+    def evict(self, ways):
+        if self.replacement == "random":
+            victim = self.random.choice(list(ways))
+        else:
+            victim = next(iter(ways))
+        self.stats["evictions"] += 1
+        if ways.pop(victim):
+            self.stats["writebacks"] += 1
+            return self.miss_ticks
+        return 0
+
+    def report(self):
+        """Статистика запуска: счётчики, доля попаданий и то же по областям памяти."""
+        stats = self.summary(self.stats, ("evictions", "writebacks"))
+        stats["regions"] = {name: self.summary(counter) for name, counter in self.region_stats.items()}
+        return stats
+
+    @staticmethod
+    def summary(counter, extra=()):
+        keys = ("reads", "read_hits", "read_misses", "writes", "write_hits", "write_misses") + extra
+        stats = {key: counter[key] for key in keys}
+        accesses = counter["reads"] + counter["writes"]
+        hits = counter["read_hits"] + counter["write_hits"]
+        stats["hit_rate"] = round(hits / accesses, 4) if accesses else 0.0
+        return stats
+
+
 class DataPath:
     """
 
@@ -366,12 +712,14 @@ class DataPath:
     - data_memory -- однопортовая, поэтому либо читаем, либо пишем.
 
     - input/output -- токенизированная логика ввода-вывода. Не детализируется в
-      рамках модели.
+      рамках модели. Порты -- внешние устройства: `input_port` (`InputPort`,
+      `TokenInputPort`) и `output_port` (`OutputPort`).
 
     - input -- чтение может вызвать остановку процесса моделирования, если буфер
       входных значений закончился.
 
-    - malloc -- операция над памятью добавляющая n нулевых машинных слов в конец.
+    - malloc -- выделение n нулевых машинных слов в куче (свободный блок или
+      расширение памяти), free -- освобождение блока.
 
     Реализованные методы соответствуют сигналам защёлкивания значений:
 
@@ -382,6 +730,7 @@ class DataPath:
     - `signal_oe` -- чтение из память
     - `signal_wr` -- запись в память
     - `signal_malloc` -- выделение памяти
+    - `signal_free` -- освобождение памяти
     - `signal_out` -- вывод в порт.
     - `signal_adress_mod` -- устанавливает режим адресации.
 
@@ -395,27 +744,44 @@ class DataPath:
     rSP = None
     rIP = None
     rDR = None
-    alu_flags = None
-    input_buffer = None
+    flags_result = None
+    flags_arith = None
+    flags_overflow = None
+    flags_carry = None
+    input_port = None
+    output_port = None
     output_buffer = None
+    icache = None
+    dcache = None
 
-    def __init__(self, memory_manager, input_buffer):
+    def __init__(self, memory_manager, input_buffer, output_port=None, icache=None, dcache=None):
         self.memory_manager = memory_manager
         self.rAC = 0
         self.rAR = 0
         self.rSP = 0
         self.rIP = 0
         self.rDR = 0
-        self.alu_flags = {"OF": False, "C": False, "Z": True, "S": False}
-        self.input_buffer = input_buffer
-        self.output_buffer = []
+        # Z, S -- по результату последней операции с флагами; OF, C -- по
+        # записи (op, left, right, carry_in, result) последней арифметической
+        # операции или, если её нет, по flags_overflow/flags_carry
+        self.flags_result = 0
+        self.flags_arith = None
+        self.flags_overflow = False
+        self.flags_carry = False
+        # список кодов символов или порт ввода
+        self.input_port = input_buffer if hasattr(input_buffer, "read") else TokenInputPort(input_buffer)
+        self.output_port = output_port if output_port is not None else OutputPort()
+        self.output_buffer = self.output_port.buffer
+        # кэши инструкций и данных; один и тот же объект -- общий кэш
+        self.icache = icache
+        self.dcache = dcache
 
     def signal_latch_ip(self, sel_l, sel_r, alu_op):
         self.rIP = self.alu(sel_l, sel_r, alu_op)
 
     def signal_latch_ac(self, sel_l, sel_r, alu_op, sel_a=magic_numbers.MUX_A_ALU):
         if sel_a == magic_numbers.MUX_A_INP:
-            self.rAC = self.input_buffer.pop(0)
+            self.rAC = self.input_port.read()
         else:
             self.rAC = self.alu(sel_l, sel_r, alu_op)
 
@@ -429,14 +795,21 @@ class DataPath:
             self.rSP -= 1
 
     def signal_oe(self):
+        if self.dcache is not None:
+            self.dcache.access(self.rAR // self.memory_manager.mod)
         self.rDR = self.memory_manager.getmem(self.rAR)
 
     def signal_wr(self, sel_l, sel_r, alu_op):
+        if self.dcache is not None:
+            self.dcache.access(self.rAR // self.memory_manager.mod, write=True)
         self.memory_manager.setmem(self.rAR, self.alu(sel_l, sel_r, alu_op))
 
     def signal_malloc(self, sel_l, sel_r, alu_op):
         self.rDR = self.memory_manager.malloc(self.alu(sel_l, sel_r, alu_op))
 
+    def signal_free(self, sel_l, sel_r, alu_op):
+        return self.memory_manager.free(self.alu(sel_l, sel_r, alu_op))
+
     def signal_adress_mod(self, sel_dm):
         if sel_dm == magic_numbers.MUX_DM_MOD_1:
             self.memory_manager.set_mod(1)
@@ -447,19 +820,40 @@ class DataPath:
 
     def signal_out(self):
         symbol = chr(self.rAC)
-        self.output_buffer.append(symbol)
+        self.output_port.write(symbol)
 
     def overflow(self):
-        return self.alu_flags["OF"]
+        if self.flags_arith is None:
+            return self.flags_overflow
+        result = self.flags_arith[4]
+        return crop_int_to_int32(result) != result
 
     def carry(self):
-        return self.alu_flags["C"]
+        if self.flags_arith is None:
+            return self.flags_carry
+        op, left, right, carry_in, _ = self.flags_arith
+        if op == AluOps.ADD:
+            return (left & 0xFFFFFFFF) + (right & 0xFFFFFFFF) > 0xFFFFFFFF
+        if op == AluOps.ADC:
+            return (left & 0xFFFFFFFF) + (right & 0xFFFFFFFF) + carry_in > 0xFFFFFFFF
+        # SBC, SUB, CMP: (left & 0xFFFFFFFF) + (right & 0xFFFFFFFF) [+ C] < 0
+        return False
 
     def zero(self):
-        return self.alu_flags["Z"]
+        return self.flags_result == 0
 
     def sign(self):
-        return self.alu_flags["S"]
+        return self.flags_result < 0
+
+    @property
+    def alu_flags(self):
+        return {"OF": self.overflow(), "C": self.carry(), "Z": self.zero(), "S": self.sign()}
+
+    def set_flags(self, of, c, z, s):
+        self.flags_result = 0 if z else (-1 if s else 1)
+        self.flags_arith = None
+        self.flags_overflow = of
+        self.flags_carry = c
 
     def alu(self, sel_l, sel_r, alu_op):
         left_value = 0
@@ -476,62 +870,27 @@ class DataPath:
         elif sel_r == magic_numbers.MUX_R_IP:
             right_value = self.rIP
 
-        if "crop_right_to_int16" in alu_op and alu_op["crop_right_to_int16"]:
+        if alu_op & AluOps.CROP_RIGHT_TO_INT16:
             right_value = crop_int_to_int16(right_value)
 
-        out_value = 0
-        if alu_op["op"] == "ADC":
-            out_value = left_value + right_value + int(self.alu_flags["C"])
-        elif alu_op["op"] == "ADD":
-            out_value = left_value + right_value
-        elif alu_op["op"] == "SBC":
-            out_value = left_value - right_value - int(self.alu_flags["C"])
-        elif alu_op["op"] == "SUB":
-            out_value = left_value - right_value
-        elif alu_op["op"] == "OR":
-            out_value = left_value | right_value
-        elif alu_op["op"] == "XOR":
-            out_value = left_value ^ right_value
-        elif alu_op["op"] == "AND":
-            out_value = left_value & right_value
-        elif alu_op["op"] == "MUL":
-            out_value = left_value * right_value
-        elif alu_op["op"] == "SHR":
-            out_value = left_value >> right_value
-        elif alu_op["op"] == "SHL":
-            out_value = left_value << right_value
-        elif alu_op["op"] == "CMP":
-            out_value = left_value - right_value
-        elif alu_op["op"] == "MOD":
-            out_value = left_value % right_value
-        else:
-            raise "E453"
-        if "ceil_div_2" in alu_op and alu_op["ceil_div_2"]:
-            out_value = (1 + out_value) >> 1
-        if "ceil_div_4" in alu_op and alu_op["ceil_div_4"]:
-            out_value = (3 + out_value) >> 2
-        if "unceil_div_2" in alu_op and alu_op["unceil_div_2"]:
-            out_value = out_value << 1
-        if "unceil_div_4" in alu_op and alu_op["unceil_div_4"]:
-            out_value = out_value << 2
-        if "set_flag" in alu_op:
-            self.alu_flags["Z"] = out_value == 0
-            self.alu_flags["S"] = out_value < 0
-            if alu_op["op"] in ("ADC", "ADD", "SBC", "SUB", "CMP"):
-                self.alu_flags["OF"] = crop_int_to_int32(out_value) != out_value
-                if alu_op["op"] == "ADC":
-                    self.alu_flags["C"] = (left_value & 0xFFFFFFFF) + (right_value & 0xFFFFFFFF) + int(
-                        self.alu_flags["C"]
-                    ) > 0xFFFFFFFF
-                if alu_op["op"] == "ADD":
-                    self.alu_flags["C"] = (left_value & 0xFFFFFFFF) + (right_value & 0xFFFFFFFF) > 0xFFFFFFFF
-                if alu_op["op"] == "SBC":
-                    self.alu_flags["C"] = (left_value & 0xFFFFFFFF) + (right_value & 0xFFFFFFFF) + int(
-                        self.alu_flags["C"]
-                    ) < 0
-                if alu_op["op"] in ("SUB", "CMP"):
-                    self.alu_flags["C"] = (left_value & 0xFFFFFFFF) + (right_value & 0xFFFFFFFF) < 0
-        if alu_op["op"] == "CMP":
+        op = alu_op & AluOps.OP_MASK
+        carry_in = int(self.carry()) if op == AluOps.ADC or op == AluOps.SBC else 0
+        out_value = ALU_FUNCTIONS[op](left_value, right_value, carry_in)
+        if alu_op & AluOps.SCALE:
+            if alu_op & AluOps.CEIL_DIV_2:
+                out_value = (1 + out_value) >> 1
+            if alu_op & AluOps.CEIL_DIV_4:
+                out_value = (3 + out_value) >> 2
+            if alu_op & AluOps.UNCEIL_DIV_2:
+                out_value = out_value << 1
+            if alu_op & AluOps.UNCEIL_DIV_4:
+                out_value = out_value << 2
+        if alu_op & AluOps.SET_FLAG:
+            # флаги вычисляются лениво, при обращении к zero/sign/overflow/carry
+            self.flags_result = out_value
+            if op in ALU_ARITHMETIC:
+                self.flags_arith = (op, left_value, right_value, carry_in, out_value)
+        if op == AluOps.CMP:
             return left_value
         else:
             return crop_int_to_int32(out_value)
@@ -577,6 +936,7 @@ class DataPath:
 # 0110xxxx.00000011.xxxxxxxx.xxxxxxxx MALLOC32    EAX := MALLOC(EAX)
 # 0110xxxx.00000100.xxxxxxxx.xxxxxxxx MALLOC16    EAX := MALLOC((1+EAX)>>1)
 # 0110xxxx.00000101.xxxxxxxx.xxxxxxxx MALLOC8     EAX := MALLOC((3+EAX)>>2)
+# 0110xxxx.00000110.xxxxxxxx.xxxxxxxx FREE        FREE(EAX)
 
 # COND = {
 #   A: 0000  # always
@@ -623,12 +983,34 @@ class ControlUnit:
 
     data_path = None
     step_counter = None
+    decoded = None
+    dispatch = None
+    conditions = None
+    interrupts = None
     _tick = None
 
     def __init__(self, data_path):
         self.data_path = data_path
         self.step_counter = 0
+        self.decoded = {}
+        self.dispatch = self.build_dispatch()
+        self.conditions = self.build_conditions()
+        self.interrupts = {
+            0: self._int_out,
+            1: self._int_in,
+            2: self._int_malloc32,
+            3: self._int_malloc16,
+            4: self._int_malloc8,
+            5: self._int_free,
+        }
         self._tick = 0
+        data_path.memory_manager.write_listeners.append(self.invalidate)
+        for cache in (data_path.icache, data_path.dcache):
+            if cache is not None:
+                cache.tick = self.tick
+
+    def invalidate(self, address):
+        self.decoded.pop(address, None)
 
     def tick(self, n=1):
         self._tick += n
@@ -637,382 +1019,375 @@ class ControlUnit:
         return self._tick
 
     def execute_instruction(self, instr, data):
-        # print(data)
+        self.dispatch[instr, data["F"], data["RR"]](data)
+
+    def build_dispatch(self):
+        """Таблица обработчиков `(instr, F, RR) -> handler(data)`.
+
+        Строится один раз при создании `ControlUnit`, после чего исполнение
+        инструкции -- это один вызов обработчика без перебора вариантов.
+        """
+        return {
+            (instr, f, rr): self.select_handler(instr, f, rr)
+            for instr in range(16)
+            for f in range(8)
+            for rr in range(4)
+        }
+
+    def select_handler(self, instr, f, rr):  # noqa: C901
         if instr == 0:  # NOP
-            return
+            return self._nop
         elif instr == 1:  # HALT
-            raise "STOP"
+            return self._halt
         elif instr == 2:  # MOV A 5
-            if data["RR"] != 2:
-                self.tick()
-                self.data_path.signal_adress_mod(
-                    {0: magic_numbers.MUX_DM_MOD_4, 1: magic_numbers.MUX_DM_MOD_2}[data["RR"]]
-                )
-            if data["F"] == 0:  # MOV A 5
-                self.tick()
-                self.data_path.signal_latch_ac(
-                    magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-            elif data["F"] == 1:  # MOV A [5]
-                self.tick(3)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-            elif data["F"] == 2:  # MOV A A+5
-                self.tick()
-                self.data_path.signal_latch_ac(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-            elif data["F"] == 3:  # MOV A [A+5]
-                self.tick(3)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-            elif data["F"] == 4:  # MOV A IP+5
-                raise "E594"
-            elif data["F"] == 5:  # MOV A [IP+5]
-                raise "E596"
-            elif data["F"] == 6:  # MOV A SP+5
-                raise "E602"
-            elif data["F"] == 7:  # MOV A [SP+5]
-                if data["RR"] != 2:
-                    raise "E601"
-                self.tick(4)
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_AR, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-
-            if data["RR"] != 2:
-                self.tick()
-                self.data_path.signal_adress_mod(magic_numbers.MUX_DM_MOD_1)
+            handler = {
+                0: self._mov_a_imm,  # MOV A 5
+                1: self._mov_a_mem,  # MOV A [5]
+                2: self._mov_a_a_rel,  # MOV A A+5
+                3: self._mov_a_mem_a_rel,  # MOV A [A+5]
+                4: self._fault("E594"),  # MOV A IP+5
+                5: self._fault("E596"),  # MOV A [IP+5]
+                6: self._fault("E602"),  # MOV A SP+5
+                7: self._mov_a_mem_sp_rel if rr == 2 else self._fault("E601"),  # MOV A [SP+5]
+            }[f]
+            return handler if rr == 2 else self._narrow(handler)
         elif instr == 3:  # MOV [5] A
-            if data["F"] == 0:  # MOV [5] A
-                self.tick(2)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                if data["RR"] != 2:
-                    self.data_path.signal_adress_mod(
-                        {0: magic_numbers.MUX_DM_MOD_4, 1: magic_numbers.MUX_DM_MOD_2}[data["RR"]]
-                    )
-                    self.tick(2)
-                self.data_path.signal_wr(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL"})
-                if data["RR"] != 2:
-                    self.data_path.signal_adress_mod(magic_numbers.MUX_DM_MOD_1)
-            if data["F"] == 1:  # MOV [[5]] A
-                self.tick(4)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-                self.data_path.signal_wr(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL"})
-            if data["F"] == 2:  # MOV [A+5] A
-                self.tick(3)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_wr(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL"})
-            if data["F"] == 3:  # MOV [[A+5]] A
-                self.tick(4)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-                self.data_path.signal_wr(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL"})
-            if data["F"] == 4:  # MOV [IP+5] A
-                raise "E625"
-            if data["F"] == 5:  # MOV [[IP+5]] A
-                raise "E627"
-            if data["F"] == 6:  # MOV [SP+5] A
-                self.tick(3)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_AR, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                self.data_path.signal_wr(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL"})
-            if data["F"] == 7:  # MOV [[SP+5]] A
-                self.tick(5)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_AR, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-                if data["RR"] != 2:
-                    self.data_path.signal_adress_mod(
-                        {0: magic_numbers.MUX_DM_MOD_4, 1: magic_numbers.MUX_DM_MOD_2}[data["RR"]]
-                    )
-                    self.tick(2)
-                self.data_path.signal_wr(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL"})
-                if data["RR"] != 2:
-                    self.data_path.signal_adress_mod(magic_numbers.MUX_DM_MOD_1)
+            store = self._store_ac if rr == 2 else self._store_ac_narrow
+            return {
+                0: lambda data: self._mov_mem_imm(data, store),  # MOV [5] A
+                1: self._mov_mem_mem,  # MOV [[5]] A
+                2: self._mov_mem_a_rel,  # MOV [A+5] A
+                3: self._mov_mem_mem_a_rel,  # MOV [[A+5]] A
+                4: self._fault("E625"),  # MOV [IP+5] A
+                5: self._fault("E627"),  # MOV [[IP+5]] A
+                6: self._mov_mem_sp_rel,  # MOV [SP+5] A
+                7: lambda data: self._mov_mem_mem_sp_rel(data, store),  # MOV [[SP+5]] A
+            }[f]
         elif instr == 4:  # ADD [5]
-            if data["F"] == 0:  # ADD 5
-                self.tick()
-                self.data_path.signal_latch_ac(
-                    magic_numbers.MUX_L_AC,
-                    magic_numbers.MUX_R_DR,
-                    {
-                        "op": ["ADC", "ADD", "SBC", "SUB", "OR", "XOR", "AND", "MUL", "SHR", "SHL", "CMP", "MOD"][
-                            data["OPER"]
-                        ],
-                        "crop_right_to_int16": True,
-                        "set_flag": True,
-                    },
-                )
-            elif data["F"] == 1:  # ADD [5]
-                self.tick(3)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ac(
-                    magic_numbers.MUX_L_AC,
-                    magic_numbers.MUX_R_DR,
-                    {
-                        "op": ["ADC", "ADD", "SBC", "SUB", "OR", "XOR", "AND", "MUL", "SHR", "SHL", "CMP", "MOD"][
-                            data["OPER"]
-                        ],
-                        "set_flag": True,
-                    },
-                )
-            elif data["F"] == 2:  # ADD A+5
-                raise "E594"
-            elif data["F"] == 3:  # ADD [A+5]
-                self.tick(3)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ac(
-                    magic_numbers.MUX_L_AC,
-                    magic_numbers.MUX_R_DR,
-                    {
-                        "op": ["ADC", "ADD", "SBC", "SUB", "OR", "XOR", "AND", "MUL", "SHR", "SHL", "CMP", "MOD"][
-                            data["OPER"]
-                        ],
-                        "set_flag": True,
-                    },
-                )
-            elif data["F"] == 4:  # ADD IP+5
-                raise "E594"
-            elif data["F"] == 5:  # ADD [IP+5]
-                raise "E596"
-            elif data["F"] == 6:  # ADD SP+5
-                raise "E602"
-            elif data["F"] == 7:  # ADD [SP+5]
-                if data["RR"] != 2:
-                    raise "E601"
-                self.tick(4)
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_AR, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ac(
-                    magic_numbers.MUX_L_AC,
-                    magic_numbers.MUX_R_DR,
-                    {
-                        "op": ["ADC", "ADD", "SBC", "SUB", "OR", "XOR", "AND", "MUL", "SHR", "SHL", "CMP", "MOD"][
-                            data["OPER"]
-                        ],
-                        "set_flag": True,
-                    },
-                )
+            return {
+                0: self._alu_imm,  # ADD 5
+                1: self._alu_mem,  # ADD [5]
+                2: self._fault("E594"),  # ADD A+5
+                3: self._alu_mem_a_rel,  # ADD [A+5]
+                4: self._fault("E594"),  # ADD IP+5
+                5: self._fault("E596"),  # ADD [IP+5]
+                6: self._fault("E602"),  # ADD SP+5
+                7: self._alu_mem_sp_rel if rr == 2 else self._fault("E601"),  # ADD [SP+5]
+            }[f]
         elif instr == 5:  # ['NOT','NEG','RCL','RCR','ZEXT8','ZEXT16','EXT8','EXT16']
-            self.tick(1)
-            self.data_path.signal_latch_ac(
-                magic_numbers.MUX_L_AC,
-                magic_numbers.MUX_R_DR,
-                {
-                    "un": ["NOT", "NEG", "RCL", "RCR", "ZEXT8", "ZEXT16", "EXT8", "EXT16"][data["OPER"]],
-                    "set_flag": True,
-                },
-            )
+            return self._unary
         elif instr == 6:  # INT
-            if data["INT_CODE"] == 0:  # OUT
-                self.tick(1)
-                self.data_path.signal_out()
-            elif data["INT_CODE"] == 1:  # IN
-                self.tick(1)
-                self.data_path.signal_latch_ac(None, None, {}, magic_numbers.MUX_A_INP)
-            elif data["INT_CODE"] == 2:  # MALLOC32
-                self.tick(2)
-                self.data_path.signal_malloc(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL"})
-                self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-            elif data["INT_CODE"] == 3:  # MALLOC16
-                self.tick(3)
-                self.data_path.signal_malloc(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL", "ceil_div_2": True}
-                )
-                self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-                self.data_path.signal_latch_ac(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL", "unceil_div_2": True}
-                )
-            elif data["INT_CODE"] == 4:  # MALLOC8
-                self.tick(3)
-                self.data_path.signal_malloc(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL", "ceil_div_4": True}
-                )
-                self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-                self.data_path.signal_latch_ac(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, {"op": "MUL", "unceil_div_4": True}
-                )
+            return self._interrupt
         elif instr == 7:  # reserved
-            raise "E678"
-        elif instr in (8, 10):  # CALL(8) and JMP(10)
-            need_jump = False
-            if data["COND"] == 0:
-                need_jump = True
-            elif data["COND"] == 1 and self.data_path.zero():
-                need_jump = True
-            elif data["COND"] == 2 and not self.data_path.zero():
-                need_jump = True
-            elif (
-                data["COND"] == 3
-                and ((self.data_path.sign() ^ self.data_path.overflow()) or self.data_path.zero()) == 0
-            ):
-                need_jump = True
-            elif data["COND"] == 4 and (self.data_path.sign() ^ self.data_path.overflow()) == 1:
-                need_jump = True
-            elif data["COND"] == 5 and (self.data_path.sign() ^ self.data_path.overflow()) == 0:
-                need_jump = True
-            elif (
-                data["COND"] == 6
-                and ((self.data_path.sign() ^ self.data_path.overflow()) or self.data_path.zero()) == 1
-            ):
-                need_jump = True
-            # print(data["COND"],self.data_path.zero(), need_jump)
-            if instr == 8 and need_jump:
-                if data["F"] == 0:  # CALL 5
-                    self.tick(4)
-                    self.data_path.signal_latch_sp(magic_numbers.MUX_S_INC)
-                    self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                    self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_IP, {"op": "ADD"})
-                    self.data_path.signal_latch_ip(
-                        magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                    )
-                elif data["F"] == 4:  # CALL IP+5
-                    self.tick(5)
-                    self.data_path.signal_latch_sp(magic_numbers.MUX_S_INC)
-                    self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                    self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_IP, {"op": "ADD"})
-                    self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_IP, {"op": "ADD"})
-                    self.data_path.signal_latch_ip(
-                        magic_numbers.MUX_L_AR, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                    )
-                else:
-                    raise "E709"
-            if instr == 10 and need_jump:
-                # print('!!!')
-                if data["F"] == 0:  # JMP 5
-                    self.tick()
-                    self.data_path.signal_latch_ip(
-                        magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                    )
-                elif data["F"] == 4:  # JMP IP+5
-                    self.tick(2)
-                    self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_IP, {"op": "ADD"})
-                    self.data_path.signal_latch_ip(
-                        magic_numbers.MUX_L_AR, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                    )
-                else:
-                    raise "E717"
+            return self._fault("E678")
+        elif instr == 8:  # CALL
+            action = {0: self._call_imm, 4: self._call_ip_rel}.get(f, self._fault("E709"))
+            return lambda data: self._branch(data, action)
+        elif instr == 10:  # JMP
+            action = {0: self._jmp_imm, 4: self._jmp_ip_rel}.get(f, self._fault("E717"))
+            return lambda data: self._branch(data, action)
         elif instr == 9:  # RET
-            # print(self.data_path.memory_manager.getmem(1))
-            self.tick(4)
-            self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-            self.data_path.signal_oe()
-            self.data_path.signal_latch_ip(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-            self.data_path.signal_latch_sp(magic_numbers.MUX_S_DEC)
-            # print(self.data_path.rDR)
+            return self._ret
         elif instr == 11:  # PUSH
-            self.tick()
-            self.data_path.signal_latch_sp(magic_numbers.MUX_S_INC)
-            if data["F"] == 0:  # PUSH 5
-                self.tick(2)
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                self.data_path.signal_wr(
-                    magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-            elif data["F"] == 1:  # PUSH [5]
-                self.tick(4)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-            elif data["F"] == 2:  # PUSH A+5
-                self.tick(2)
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                self.data_path.signal_wr(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-            elif data["F"] == 3:  # PUSH [A+5]
-                self.tick(4)
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-            elif data["F"] == 4:  # PUSH IP+5
-                raise "E722"
-            elif data["F"] == 5:  # PUSH [IP+5]
-                raise "E723"
-            elif data["F"] == 6:  # PUSH SP+5
-                raise "E726"
-            elif data["F"] == 7:  # PUSH [SP+5]
-                raise "E737"
+            return {
+                0: self._push_imm,  # PUSH 5
+                1: self._push_mem,  # PUSH [5]
+                2: self._push_a_rel,  # PUSH A+5
+                3: self._push_mem_a_rel,  # PUSH [A+5]
+                4: self._push_fault("E722"),  # PUSH IP+5
+                5: self._push_fault("E723"),  # PUSH [IP+5]
+                6: self._push_fault("E726"),  # PUSH SP+5
+                7: self._push_fault("E737"),  # PUSH [SP+5]
+            }[f]
         elif instr == 12:  # POP
-            self.tick(4)
-            self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-            self.data_path.signal_oe()
-            self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-            self.data_path.signal_latch_sp(magic_numbers.MUX_S_DEC)
+            return self._pop
         elif instr == 13:  # SWAP
-            if data["F"] == 6:  # SWAP SP+5
-                self.tick(5)
-                self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, {"op": "ADD"})
-                self.data_path.signal_latch_ar(
-                    magic_numbers.MUX_L_AR, magic_numbers.MUX_R_DR, {"op": "ADD", "crop_right_to_int16": True}
-                )
-                self.data_path.signal_oe()
-                (self.data_path.rDR, self.data_path.rAC) = (self.data_path.rAC, self.data_path.rDR)
-                self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
+            return self._swap_sp_rel if f == 6 else self._fault("E741")  # SWAP SP+5
+        return self._nop
 
-            else:
-                raise "E741"
+    def _nop(self, data):
+        return
 
-    def decode_and_execute_instruction(self):
+    def _halt(self, data):
+        raise "STOP"
+
+    def _fault(self, code):
+        def handler(data):
+            raise code
+
+        return handler
+
+    def _switch_mod(self, data):
+        self.data_path.signal_adress_mod({0: magic_numbers.MUX_DM_MOD_4, 1: magic_numbers.MUX_DM_MOD_2}[data["RR"]])
+
+    def _narrow(self, handler):
+        """Оборачивает обработчик MOV A,... переключением режима адресации памяти (AL/AX)."""
+
+        def narrow_handler(data):
+            self.tick()
+            self._switch_mod(data)
+            handler(data)
+            self.tick()
+            self.data_path.signal_adress_mod(magic_numbers.MUX_DM_MOD_1)
+
+        return narrow_handler
+
+    def _mov_a_imm(self, data):
+        self.tick()
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+
+    def _mov_a_mem(self, data):
+        self.tick(3)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+
+    def _mov_a_a_rel(self, data):
+        self.tick()
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+
+    def _mov_a_mem_a_rel(self, data):
+        self.tick(3)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+
+    def _mov_a_mem_sp_rel(self, data):
+        self.tick(4)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_AR, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+
+    def _store_ac(self, data):
+        self.data_path.signal_wr(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, AluOps.MUL)
+
+    def _store_ac_narrow(self, data):
+        self._switch_mod(data)
+        self.tick(2)
+        self.data_path.signal_wr(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, AluOps.MUL)
+        self.data_path.signal_adress_mod(magic_numbers.MUX_DM_MOD_1)
+
+    def _mov_mem_imm(self, data, store):
+        self.tick(2)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        store(data)
+
+    def _mov_mem_mem(self, data):
+        self.tick(4)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+        self._store_ac(data)
+
+    def _mov_mem_a_rel(self, data):
+        self.tick(3)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self._store_ac(data)
+
+    def _mov_mem_mem_a_rel(self, data):
+        self.tick(4)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+        self._store_ac(data)
+
+    def _mov_mem_sp_rel(self, data):
+        self.tick(3)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_AR, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self._store_ac(data)
+
+    def _mov_mem_mem_sp_rel(self, data, store):
+        self.tick(5)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_AR, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+        store(data)
+
+    def _alu_imm(self, data):
+        self.tick()
+        self.data_path.signal_latch_ac(
+            magic_numbers.MUX_L_AC,
+            magic_numbers.MUX_R_DR,
+            data["OPER"] | AluOps.CROP_RIGHT_TO_INT16 | AluOps.SET_FLAG,
+        )
+
+    def _alu_mem(self, data):
+        self.tick(3)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, data["OPER"] | AluOps.SET_FLAG)
+
+    def _alu_mem_a_rel(self, data):
+        self.tick(3)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, data["OPER"] | AluOps.SET_FLAG)
+
+    def _alu_mem_sp_rel(self, data):
+        self.tick(4)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_AR, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, data["OPER"] | AluOps.SET_FLAG)
+
+    def _unary(self, data):
+        # ["NOT", "NEG", "RCL", "RCR", "ZEXT8", "ZEXT16", "EXT8", "EXT16"] -- в АЛУ не реализованы
+        self.tick(1)
+        raise "E453"
+
+    def _interrupt(self, data):
+        handler = self.interrupts.get(data["INT_CODE"])
+        if handler is not None:
+            handler()
+
+    def _int_out(self):
+        self.tick(1)
+        self.data_path.signal_out()
+
+    def _int_in(self):
+        self.tick(1)
+        self.data_path.signal_latch_ac(None, None, None, magic_numbers.MUX_A_INP)
+
+    def _int_malloc32(self):
+        self.tick(2)
+        self.data_path.signal_malloc(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, AluOps.MUL)
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+
+    def _int_malloc16(self):
+        self.tick(3)
+        self.data_path.signal_malloc(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, AluOps.MUL | AluOps.CEIL_DIV_2)
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, AluOps.MUL | AluOps.UNCEIL_DIV_2)
+
+    def _int_malloc8(self):
+        self.tick(3)
+        self.data_path.signal_malloc(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, AluOps.MUL | AluOps.CEIL_DIV_4)
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, AluOps.MUL | AluOps.UNCEIL_DIV_4)
+
+    def _int_free(self):
+        self.tick(2)
+        if not self.data_path.signal_free(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_1, AluOps.MUL):
+            raise "E762"
+
+    def build_conditions(self):
+        """Условия переходов CALL/JMP по полю COND, коды 7-15 не выполняются никогда."""
+        dp = self.data_path
+        conditions = [
+            lambda: True,  # A
+            lambda: dp.zero(),  # E
+            lambda: not dp.zero(),  # NE
+            lambda: not ((dp.sign() ^ dp.overflow()) or dp.zero()),  # G
+            lambda: dp.sign() ^ dp.overflow(),  # L
+            lambda: not (dp.sign() ^ dp.overflow()),  # GE
+            lambda: bool((dp.sign() ^ dp.overflow()) or dp.zero()),  # LE
+        ]
+        return conditions + [lambda: False] * (16 - len(conditions))
+
+    def _branch(self, data, action):
+        if self.conditions[data["COND"]]():
+            action(data)
+
+    def _call_imm(self, data):
+        self.tick(4)
+        self.data_path.signal_latch_sp(magic_numbers.MUX_S_INC)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_IP, AluOps.ADD)
+        self.data_path.signal_latch_ip(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+
+    def _call_ip_rel(self, data):
+        self.tick(5)
+        self.data_path.signal_latch_sp(magic_numbers.MUX_S_INC)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_IP, AluOps.ADD)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_IP, AluOps.ADD)
+        self.data_path.signal_latch_ip(magic_numbers.MUX_L_AR, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+
+    def _jmp_imm(self, data):
+        self.tick()
+        self.data_path.signal_latch_ip(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+
+    def _jmp_ip_rel(self, data):
+        self.tick(2)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_IP, AluOps.ADD)
+        self.data_path.signal_latch_ip(magic_numbers.MUX_L_AR, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+
+    def _ret(self, data):
+        self.tick(4)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ip(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+        self.data_path.signal_latch_sp(magic_numbers.MUX_S_DEC)
+
+    def _push_prologue(self):
+        self.tick()
+        self.data_path.signal_latch_sp(magic_numbers.MUX_S_INC)
+
+    def _push_fault(self, code):
+        def handler(data):
+            self._push_prologue()
+            raise code
+
+        return handler
+
+    def _push_imm(self, data):
+        self._push_prologue()
+        self.tick(2)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+
+    def _push_mem(self, data):
+        self._push_prologue()
+        self.tick(4)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+
+    def _push_a_rel(self, data):
+        self._push_prologue()
+        self.tick(2)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_wr(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+
+    def _push_mem_a_rel(self, data):
+        self._push_prologue()
+        self.tick(4)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_AC, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+
+    def _pop(self, data):
+        self.tick(4)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_oe()
+        self.data_path.signal_latch_ac(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+        self.data_path.signal_latch_sp(magic_numbers.MUX_S_DEC)
+
+    def _swap_sp_rel(self, data):
+        self.tick(5)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_SP, AluOps.ADD)
+        self.data_path.signal_latch_ar(magic_numbers.MUX_L_AR, magic_numbers.MUX_R_DR, AluOps.ADD_INT16)
+        self.data_path.signal_oe()
+        (self.data_path.rDR, self.data_path.rAC) = (self.data_path.rAC, self.data_path.rDR)
+        self.data_path.signal_wr(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, AluOps.ADD)
+
+    def decode(self, address):
+        """Декодирует слово по адресу `address` в запись `(word, handler, data)`.
+
+        Обработчик выбирается из таблицы `dispatch`. Запись кэшируется в `decoded` при первом исполнении адреса и
+        сбрасывается `invalidate` при записи в это слово памяти.
+        """
         # INSTRRxx.INT_CODE.AAAAAAAA.AAAAAAAA
         # INSTRRxx.OPERxFFF.AAAAAAAA.AAAAAAAA
         # INSTRRxx.CONDxFFF.AAAAAAAA.AAAAAAAA
-        # - `signal_latch_ip` -- защёлкивание адреса следующей выполняемой команды
-        # - `signal_latch_ac` -- защёлкивание аккумулятора
-        # - `signal_latch_ar` -- защёлкивание адреса в памяти
-        # - `signal_latch_sp` -- защёлкивание адреса вершины стека
-        # - `signal_oe` -- чтение из память
-        # - `signal_wr` -- запись в память
-        # - `signal_malloc` -- выделение памяти
-        # - `signal_out` -- вывод в порт.
-
-        self.data_path.signal_latch_ar(magic_numbers.MUX_L_0, magic_numbers.MUX_R_IP, {"op": "ADD"})
-        self.data_path.signal_oe()
-        self.data_path.signal_latch_ip(magic_numbers.MUX_L_AR, magic_numbers.MUX_R_1, {"op": "ADD"})
-        instr = self.data_path.alu(magic_numbers.MUX_L_0, magic_numbers.MUX_R_DR, {"op": "ADD"})
-        # print(instr)
+        word = self.data_path.memory_manager.getmem(address)
+        instr = crop_int_to_int32(word)
         inst = instr >> (8 + 8 + 8 + 4) & 0xF
         rr = instr >> (8 + 8 + 8 + 2) & 0x3
         int_code = instr >> (8 + 8) & 0xFF
@@ -1020,8 +1395,6 @@ class ControlUnit:
         cond = instr >> (8 + 8 + 4) & 0xF
         F = instr >> (8 + 8) & 0x7
         A = instr & 0xFFFF
-        self.execute_instruction(inst, {"RR": rr, "INT_CODE": int_code, "OPER": oper, "COND": cond, "F": F, "A": A})
-        # WRITE PROGRAMM FOR RETURN OBJECT:
         # {
         #   INST: 0-15
         #   RR: 0-4
@@ -1031,9 +1404,36 @@ class ControlUnit:
         #   FFF: 0-7
         #   A: INT16
         # }
+        data = {"RR": rr, "INT_CODE": int_code, "OPER": oper, "COND": cond, "F": F, "A": A}
+        return word, self.dispatch[inst, F, rr], data
+
+    def decode_and_execute_instruction(self):
+        # - `signal_latch_ip` -- защёлкивание адреса следующей выполняемой команды
+        # - `signal_latch_ac` -- защёлкивание аккумулятора
+        # - `signal_latch_ar` -- защёлкивание адреса в памяти
+        # - `signal_latch_sp` -- защёлкивание адреса вершины стека
+        # - `signal_oe` -- чтение из память
+        # - `signal_wr` -- запись в память
+        # - `signal_malloc` -- выделение памяти
+        # - `signal_free` -- освобождение памяти
+        # - `signal_out` -- вывод в порт.
+
+        # выборка: AR <- IP; DR <- MEM(AR); IP <- AR + 1 (слово берётся из кэша декодера)
+        address = self.data_path.rIP
+        if self.data_path.icache is not None:
+            self.data_path.icache.access(address)
+        record = self.decoded.get(address)
+        if record is None:
+            record = self.decode(address)
+            if address >= 0:
+                self.decoded[address] = record
+        self.data_path.rAR = address
+        self.data_path.rDR = record[0]
+        self.data_path.rIP = crop_int_to_int32(address + 1)
+        record[1](record[2])
 
     def __repr__(self):  # TODO OF C S Z
-        return "TICK: {:4} ACC: {:6} SP: {:6} AR: {:6} IP: {:6} Flags: {} OUT: {} INST: {}".format(
+        return STATE_FORMAT.format(
             self._tick,
             self.data_path.rAC,
             self.data_path.rSP,
@@ -1045,29 +1445,1469 @@ class ControlUnit:
         )
 
 
-def simulation(mm, input_tokens, limit):
-    data_path = DataPath(mm, input_tokens)
+STATE_FORMAT = "TICK: {:4} ACC: {:6} SP: {:6} AR: {:6} IP: {:6} Flags: {} OUT: {} INST: {}"
+
+# Двоичная трасса: заголовок TRACE_HEADER (сигнатура, версия, размер записи),
+# затем записи TRACE_RECORD: вид, флаги (OF, C, Z, S -- биты 0-3), такт,
+# IP, AC, SP, AR. Запись TRACE_OUTPUT -- выведенный символ (код в поле AC),
+# TRACE_END -- завершение запуска (TRACE_END_* в поле AC).
+TRACE_MAGIC = b"JSTR"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("<4sHH")
+TRACE_RECORD = struct.Struct("<BB2xQiiii")
+TRACE_STATE = 0
+TRACE_OUTPUT = 1
+TRACE_END = 2
+TRACE_END_INPUT_EMPTY = 1
+TRACE_END_LIMIT = 2
+
+
+class TraceRecorder:
+    """Запись трассы исполнения записями фиксированного размера.
+
+    Состояние после каждого `sample`-го шага записывается, если IP попадает в
+    один из диапазонов `ranges` ([начало, конец)) или они не заданы. Выведенные
+    символы записываются всегда. При заданном `stream` (двоичный файл) записи
+    пишутся в него блоками, иначе хранятся последние `capacity` записей в
+    кольцевом буфере. Текст журнала по трассе восстанавливает `trace_dump.py`.
+    """
+
+    CHUNK = 1 << 16
+
+    def __init__(self, stream=None, capacity=1 << 16, sample=1, ranges=None):
+        assert sample > 0, "sample <= 0"
+        self.stream = stream
+        self.capacity = capacity
+        self.sample = sample
+        self.ranges = ranges
+        self.buffer = bytearray(TRACE_RECORD.size * (self.CHUNK if stream is not None else capacity))
+        self.count = 0  # записей в буфере (для кольцевого буфера -- всего записано)
+        self.steps = 0
+        self.output_length = 0
+        if stream is not None:
+            stream.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size))
+
+    def put(self, kind, flags, tick, ip, ac, sp, ar):
+        if self.stream is not None:
+            if self.count == self.CHUNK:
+                self.flush()
+            index = self.count
+        else:
+            index = self.count % self.capacity
+        TRACE_RECORD.pack_into(self.buffer, index * TRACE_RECORD.size, kind, flags, tick, ip, ac, sp, ar)
+        self.count += 1
+
+    def flush(self):
+        self.stream.write(memoryview(self.buffer)[: self.count * TRACE_RECORD.size])
+        self.count = 0
+
+    def record(self, control_unit):
+        data_path = control_unit.data_path
+        output = data_path.output_buffer
+        if len(output) != self.output_length:
+            for symbol in output[self.output_length :]:
+                self.put(TRACE_OUTPUT, 0, control_unit.current_tick(), 0, ord(symbol), 0, 0)
+            self.output_length = len(output)
+        self.steps += 1
+        if (self.steps - 1) % self.sample:
+            return
+        ip = data_path.rIP
+        if self.ranges is not None and not any(start <= ip < end for start, end in self.ranges):
+            return
+        flags = data_path.overflow() | data_path.carry() << 1 | data_path.zero() << 2 | data_path.sign() << 3
+        self.put(TRACE_STATE, flags, control_unit.current_tick(), ip, data_path.rAC, data_path.rSP, data_path.rAR)
+
+    def finish(self, control_unit, status):
+        self.put(TRACE_END, 0, control_unit.current_tick(), 0, status, 0, 0)
+        if self.stream is not None:
+            self.flush()
+            self.stream.flush()
+
+    def records(self):
+        """Записи кольцевого буфера, от старых к новым."""
+        assert self.stream is None, "records are written to the stream"
+        size = TRACE_RECORD.size
+        first = max(self.count - self.capacity, 0)
+        for i in range(first, self.count):
+            yield TRACE_RECORD.unpack_from(self.buffer, i % self.capacity * size)
+
+    def save(self, file_name):
+        with open(file_name, "wb") as f:
+            f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size))
+            for record in self.records():
+                f.write(TRACE_RECORD.pack(*record))
+
+
+def source_position(lines, address):
+    """(смещение, строка, столбец) исходного кода инструкции по таблице строк
+    `MemoryManager.lines` или None, если позиция неизвестна."""
+    i = bisect.bisect_right(lines, address, key=lambda row: row[0]) - 1
+    if i < 0 or lines[i][1] is None:
+        return None
+    return lines[i][1:]
+
+
+class Profiler:
+    """Профиль исполнения пошаговым интерпретатором.
+
+    Считает инструкции и такты по адресам; по функциям (`MemoryManager.symbols`)
+    и циклам (обратный JMP внутри функции) -- собственные такты адресов, по
+    стекам вызовов, построенным по CALL/RET, -- такты в формате collapsed
+    stacks (`collapsed`) для flamegraph. Если у образа есть таблица строк
+    (`MemoryManager.lines`), такты сводятся и по строкам исходного кода.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.ticks = collections.Counter()
+        self.stacks = collections.Counter()
+        self.stack = []  # имена функций от корня; пуст вне вызовов
+        self.stack_key = None
+        self.memory = None
+        self.symbols = []
+        self.starts = []
+        self.lines = []
+
+    def start(self, mm):
+        self.memory = mm.memory
+        self.symbols = mm.symbols
+        self.starts = [start for start, _, _ in self.symbols]
+        self.lines = mm.lines
+
+    def function(self, address):
+        i = bisect.bisect_right(self.starts, address) - 1
+        if i >= 0 and address < self.symbols[i][1]:
+            return self.symbols[i][2]
+        return "?"
+
+    def record(self, address, ticks, sp, data_path):
+        """Учитывает инструкцию по адресу `address`; `sp` -- SP до её исполнения."""
+        self.counts[address] += 1
+        self.ticks[address] += ticks
+        self.stacks[self.stack_key or self.function(address)] += ticks
+        inst = self.memory[address] >> 28
+        if inst == 8 and data_path.rSP != sp:  # CALL выполнен
+            if not self.stack:
+                self.stack.append(self.function(address))
+            self.stack.append(self.function(data_path.rIP))
+            self.stack_key = ";".join(self.stack)
+        elif inst == 9 and self.stack:  # RET
+            self.stack.pop()
+            if len(self.stack) == 1:
+                self.stack.clear()
+            self.stack_key = ";".join(self.stack) or None
+
+    def loops(self):
+        """Циклы: (функция, начало, конец) для каждого обратного JMP внутри функции."""
+        loops = []
+        for start, end, name in self.symbols:
+            for address in range(start, min(end, len(self.memory))):
+                word = self.memory[address]
+                f = word >> 16 & 0x7
+                if word >> 28 == 10 and f in (0, 4):
+                    target = crop_int_to_int16(word) + (0 if f == 0 else address + 1)
+                    if start <= target <= address:
+                        loops.append((name, target, address))
+        return loops
+
+    def functions(self):
+        """Функции: имя -> (инструкции, собственные такты, такты вместе с вызванными)."""
+        result = {}
+        for start, end, name in self.symbols:
+            count, ticks, total = result.get(name, (0, 0, 0))
+            for address in range(start, end):
+                count += self.counts[address]
+                ticks += self.ticks[address]
+            result[name] = (count, ticks, total)
+        for key, ticks in self.stacks.items():
+            for name in set(key.split(";")):
+                if name in result:
+                    count, own, total = result[name]
+                    result[name] = (count, own, total + ticks)
+        return result
+
+    def source_lines(self):
+        """Строки исходного кода: номер строки -> (инструкции, такты)."""
+        result = {}
+        for address, ticks in self.ticks.items():
+            position = source_position(self.lines, address)
+            if position is not None:
+                count, total = result.get(position[1], (0, 0))
+                result[position[1]] = (count + self.counts[address], total + ticks)
+        return result
+
+    def collapsed(self):
+        """Строки collapsed stacks: `f1;f2;f3 такты`."""
+        return ["{} {}".format(key, ticks) for key, ticks in sorted(self.stacks.items())]
+
+    def report(self, programm, top=10):
+        lines = ["hot addresses:", "{:>8} {:>8} {:>8}  {}".format("ticks", "instr", "address", "instruction")]
+        for address, ticks in self.ticks.most_common(top):
+            text = programm[address] if 0 <= address < len(programm) else ""
+            lines.append("{:>8} {:>8} {:>8}  {}".format(ticks, self.counts[address], address, text))
+        lines += ["functions:", "{:>8} {:>8} {:>8}  {}".format("self", "total", "instr", "function")]
+        functions = self.functions()
+        for name in sorted(functions, key=lambda name: -functions[name][2]):
+            count, ticks, total = functions[name]
+            lines.append("{:>8} {:>8} {:>8}  {}".format(ticks, total, count, name))
+        lines += ["loops:", "{:>8} {:>8} {:>13}  {}".format("ticks", "instr", "addresses", "function")]
+        loops = []
+        for name, first, last in self.loops():
+            ticks = sum(self.ticks[address] for address in range(first, last + 1))
+            count = sum(self.counts[address] for address in range(first, last + 1))
+            loops.append((ticks, count, "{}-{}".format(first, last), name))
+        for loop in sorted(loops, reverse=True)[:top]:
+            lines.append("{:>8} {:>8} {:>13}  {}".format(*loop))
+        if self.lines:
+            lines += ["source lines:", "{:>8} {:>8} {:>8}".format("ticks", "instr", "line")]
+            source_lines = self.source_lines()
+            for line in sorted(source_lines, key=lambda line: -source_lines[line][1])[:top]:
+                count, ticks = source_lines[line]
+                lines.append("{:>8} {:>8} {:>8}".format(ticks, count, line))
+        return "\n".join(lines)
+
+
+def read_trace(file_name):
+    """Записи трассы из файла `TraceRecorder`."""
+    with open(file_name, "rb") as f:
+        magic, version, size = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC:
+            raise ValueError("not a trace file")
+        if version != TRACE_VERSION:
+            raise ValueError("unsupported trace version")
+        if size != TRACE_RECORD.size:
+            raise ValueError("unsupported trace record size")
+        body = f.read()
+    return list(TRACE_RECORD.iter_unpack(body))
+
+
+def crop_expr_to_int32(expr):
+    """То же, что `crop_int_to_int32`, но над выражением генерируемого кода."""
+    if isinstance(expr, int):
+        return crop_int_to_int32(expr)
+    return "((({}) + 0x80000000) & 0xFFFFFFFF) - 0x80000000".format(expr)
+
+
+def mask_expr(expr):
+    if isinstance(expr, int):
+        return expr & 0xFFFFFFFF
+    return "({} & 0xFFFFFFFF)".format(expr)
+
+
+def operand(expr):
+    if isinstance(expr, int) and expr < 0:
+        return "({})".format(expr)
+    return str(expr)
+
+
+ALU_EXPRESSIONS = {
+    "ADC": "{l} + {r} + {c}",
+    "ADD": "{l} + {r}",
+    "SBC": "{l} - {r} - {c}",
+    "SUB": "{l} - {r}",
+    "OR": "{l} | {r}",
+    "XOR": "{l} ^ {r}",
+    "AND": "{l} & {r}",
+    "MUL": "{l} * {r}",
+    "SHR": "{l} >> {r}",
+    "SHL": "{l} << {r}",
+    "CMP": "{l} - {r}",
+    "MOD": "{l} % {r}",
+}
+
+# флаги, которые читает условие перехода CALL/JMP (COND 0-6)
+CONDITION_EXPRESSIONS = [
+    "True",  # A
+    "{z}",  # E
+    "not {z}",  # NE
+    "not (({s} ^ {of}) or {z})",  # G
+    "{s} ^ {of}",  # L
+    "not ({s} ^ {of})",  # GE
+    "(({s} ^ {of}) or {z})",  # LE
+]
+
+BLOCK_STEP = 1  # инструкция может стоять внутри блока
+BLOCK_END = 2  # инструкция завершает блок (переход)
+
+
+def classify_jump(word, rr, f):
+    if word >> 20 & 0xF >= len(CONDITION_EXPRESSIONS):
+        return BLOCK_STEP  # условие никогда не выполняется
+    return BLOCK_END if f in (0, 4) else None
+
+
+# INST -> (слово, RR, FFF) -> вид инструкции для classify_instruction; кодов
+# HALT и зарезервированных в таблице нет
+BLOCK_CLASSES = {
+    0: lambda word, rr, f: BLOCK_STEP,  # NOP
+    2: lambda word, rr, f: BLOCK_STEP if rr != 3 and (f in (0, 1, 2, 3) or (f == 7 and rr == 2)) else None,  # MOV A
+    3: lambda word, rr, f: BLOCK_STEP if f in (1, 2, 3, 6) or (f in (0, 7) and rr != 3) else None,  # MOV [...] A
+    4: lambda word, rr, f: (  # ALU
+        BLOCK_STEP if word >> 20 & 0xF < len(ALU_OPERATIONS) and (f in (0, 1, 3) or (f == 7 and rr == 2)) else None
+    ),
+    6: lambda word, rr, f: None if word >> 16 & 0xFF in (1, 5) else BLOCK_STEP,  # INT: IN и FREE -- пошагово
+    8: classify_jump,  # CALL
+    9: lambda word, rr, f: BLOCK_END,  # RET
+    10: classify_jump,  # JMP
+    11: lambda word, rr, f: BLOCK_STEP if f < 4 else None,  # PUSH
+    12: lambda word, rr, f: BLOCK_STEP,  # POP
+    13: lambda word, rr, f: BLOCK_STEP if f == 6 else None,  # SWAP
+    14: lambda word, rr, f: BLOCK_STEP,  # NOP
+    15: lambda word, rr, f: BLOCK_STEP,  # NOP
+}
+
+
+def classify_instruction(word):
+    """Можно ли транслировать инструкцию в составе блока.
+
+    Возвращает `BLOCK_STEP`, `BLOCK_END` или `None`, если инструкцию (HALT,
+    IN, FREE, ошибочные кодировки) исполняет пошаговый интерпретатор.
+    """
+    classify = BLOCK_CLASSES.get(word >> 28 & 0xF)
+    return None if classify is None else classify(word, word >> 26 & 0x3, word >> 16 & 0x7)
+
+
+MAX_BLOCK_LENGTH = 256
+
+
+def scan_block(memory, address):
+    """Слова базового блока, начинающегося с `address` (пустой список, если
+    первую же инструкцию должен исполнять пошаговый интерпретатор)."""
+    words = []
+    while 0 <= address + len(words) < len(memory) and len(words) < MAX_BLOCK_LENGTH:
+        word = memory[address + len(words)]
+        kind = classify_instruction(word)
+        if kind is None:
+            break
+        words.append(word)
+        if kind == BLOCK_END:
+            break
+    return words
+
+
+class BlockTranslator:
+    """Транслирует базовый блок в исходный код одной функции Python.
+
+    Регистры AC и SP и флаги живут в локальных переменных функции и
+    сохраняются в `DataPath` при выходе из блока, такты добавляются одним
+    вызовом `ControlUnit.tick`. Значения AR и DR, известные при трансляции
+    (адрес и слово инструкции после выборки), подставляются константами.
+
+    Сгенерированный код обращается к глобальным именам `dp`, `cu`, `mm`,
+    `memory`, `setmem`, `malloc` и `output_append`, которые предоставляет
+    исполняющая сторона. Флаги, как и в `DataPath`, не вычисляются: блок
+    хранит результат и операнды последней операции и считает флаг только
+    там, где его читает условный переход.
+    """
+
+    def __init__(self, address, words):
+        self.start = address
+        self.end = address + len(words)
+        self.words = words
+        self.lines = []
+        self.indent = 1
+        self.ticks = 0
+        self.ar = 0
+        self.dr = 0
+        self.alu_count = 0
+        self.result = None  # переменная с результатом последней операции с флагами
+        self.arith = None  # (op, left, right, carry_in, result) последней арифметической
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def source(self, name):
+        self.emit("ac = dp.rAC")
+        self.emit("sp = dp.rSP")
+        for i, word in enumerate(self.words):
+            address = self.start + i
+            self.ar, self.dr = address, word
+            if self.translate(address, word, i + 1):
+                break
+        else:
+            self.exit(self.end, len(self.words))
+        return "def {}():\n{}\n".format(name, "\n".join(self.lines))
+
+    def exit(self, ip, count):
+        self.emit("dp.rAC = ac")
+        self.emit("dp.rSP = sp")
+        self.emit("dp.rAR = {}".format(self.ar))
+        self.emit("dp.rDR = {}".format(self.dr))
+        self.emit("dp.rIP = {}".format(ip))
+        if self.result is not None:
+            self.emit("dp.flags_result = {}".format(self.result))
+        if self.arith is not None:
+            self.emit("dp.flags_arith = ({}, {}, {}, {}, {})".format(*self.arith))
+        if self.ticks:
+            self.emit("cu.tick({})".format(self.ticks))
+        self.emit("return {}".format(count))
+
+    def zero(self):
+        return "dp.zero()" if self.result is None else "({} == 0)".format(self.result)
+
+    def sign(self):
+        return "dp.sign()" if self.result is None else "({} < 0)".format(self.result)
+
+    def overflow(self):
+        if self.arith is None:
+            return "dp.overflow()"
+        result = self.arith[4]
+        return "({} != {})".format(crop_expr_to_int32(result), result)
+
+    def carry(self):
+        if self.arith is None:
+            return "int(dp.carry())"
+        op, left, right, carry_in, _ = self.arith
+        if op == AluOps.ADD:
+            return "int({} + {} > 0xFFFFFFFF)".format(mask_expr(left), mask_expr(right))
+        if op == AluOps.ADC:
+            return "int({} + {} + {} > 0xFFFFFFFF)".format(mask_expr(left), mask_expr(right), carry_in)
+        return "0"
+
+    def latch_ar(self, expr):
+        if isinstance(expr, int):
+            self.ar = expr
+        else:
+            self.emit("ar = {}".format(expr))
+            self.ar = "ar"
+
+    def load(self, width=1):
+        """DR := MEM(AR) в режиме адресации `width` (1, 2 или 4 слова на ячейку)."""
+        if width == 1:
+            self.emit("dr = memory[{}]".format(self.ar))
+        else:
+            view = "mm.halfwords" if width == 2 else "mm.bytes"
+            index = (
+                self.ar ^ MemoryManager.SWAP[width]
+                if isinstance(self.ar, int)
+                else "{} ^ {}".format(self.ar, MemoryManager.SWAP[width])
+            )
+            self.emit("dr = {}[{}]".format(view, index))
+        self.dr = "dr"
+
+    def store(self, value, count, width=1):
+        """MEM(AR) := value; если запись попала в сам блок, блок завершается."""
+        # отрицательный адрес пишет в слово с конца памяти, как в `setmem`
+        if isinstance(self.ar, int):
+            index = self.ar // width
+            if index < 0:
+                index = "{} + len(memory)".format(index)
+        elif width == 1:
+            index = "{} % len(memory)".format(self.ar)
+        else:
+            index = "{} // {} % len(memory)".format(self.ar, width)
+        if width != 1:
+            self.emit("mm.mod = {}".format(width))
+        self.emit("setmem({}, {})".format(self.ar, value))
+        if width != 1:
+            self.emit("mm.mod = 1")
+        self.emit("if {} <= {} < {}:".format(self.start, index, self.end))
+        self.indent += 1
+        self.exit(self.start + count, count)
+        self.indent -= 1
+
+    def translate(self, address, word, count):  # noqa: C901
+        """Добавляет код инструкции; возвращает True, если она завершает блок."""
+        inst = word >> 28 & 0xF
+        rr = word >> 26 & 0x3
+        f = word >> 16 & 0x7
+        imm = crop_int_to_int16(word)
+        width = {0: 4, 1: 2, 2: 1}.get(rr)
+        if inst == 2:  # MOV A ...
+            self.ticks += {0: 1, 1: 3, 2: 1, 3: 3, 7: 4}[f] + (2 if width != 1 else 0)
+            if f == 0:
+                self.emit("ac = {}".format(imm))
+            elif f == 2:
+                self.emit("ac = {}".format(crop_expr_to_int32("ac + {}".format(operand(imm)))))
+            else:
+                self.latch_ar(
+                    {1: imm, 3: crop_expr_to_int32("ac + {}".format(operand(imm))), 7: "sp + {}".format(operand(imm))}[
+                        f
+                    ]
+                )
+                self.load(width)
+                self.emit("ac = {}".format(crop_expr_to_int32("dr")))
+        elif inst == 3:  # MOV [...] A
+            self.ticks += {0: 2, 1: 4, 2: 3, 3: 4, 6: 3, 7: 5}[f]
+            if f in (0, 7) and width != 1:
+                self.ticks += 2
+            if f in (0, 6, 7):
+                self.latch_ar(imm if f == 0 else "sp + {}".format(operand(imm)))
+            else:
+                self.latch_ar(imm if f == 1 else crop_expr_to_int32("ac + {}".format(operand(imm))))
+            if f in (1, 2, 3, 7):
+                self.load()
+            if f in (1, 3, 7):
+                self.latch_ar(crop_expr_to_int32("dr"))
+            self.store("ac", count, width if f in (0, 7) else 1)
+        elif inst == 4:  # ALU
+            self.ticks += {0: 1, 1: 3, 3: 3, 7: 4}[f]
+            if f == 0:
+                right = imm
+            else:
+                self.latch_ar(
+                    {1: imm, 3: crop_expr_to_int32("ac + {}".format(operand(imm))), 7: "sp + {}".format(operand(imm))}[
+                        f
+                    ]
+                )
+                self.load()
+                right = "dr"
+            self.alu(word >> 20 & 0xF, right)
+        elif inst == 6:  # INT
+            int_code = word >> 16 & 0xFF
+            if int_code == 0:  # OUT
+                self.ticks += 1
+                self.emit("output_append(chr(ac))")
+            elif int_code in (2, 3, 4):  # MALLOC32, MALLOC16, MALLOC8
+                self.ticks += {2: 2, 3: 3, 4: 3}[int_code]
+                size = {2: "ac", 3: "(1 + ac) >> 1", 4: "(3 + ac) >> 2"}[int_code]
+                self.emit("dr = malloc({})".format(crop_expr_to_int32(size)))
+                self.dr = "dr"
+                self.emit("ac = {}".format(crop_expr_to_int32("dr")))
+                if int_code != 2:
+                    self.emit("ac = {}".format(crop_expr_to_int32("ac << {}".format(int_code - 2))))
+        elif inst in (8, 10):  # CALL, JMP
+            cond = word >> 20 & 0xF
+            if cond >= len(CONDITION_EXPRESSIONS):
+                return False
+            condition = CONDITION_EXPRESSIONS[cond]
+            if cond:
+                condition = condition.format(z=self.zero(), s=self.sign(), of=self.overflow())
+                self.emit("if {}:".format(condition))
+                self.indent += 1
+            self.jump(inst, f, imm, address, count)
+            if cond:
+                self.indent -= 1
+                self.emit("else:")
+                self.indent += 1
+                self.exit(address + 1, count)
+                self.indent -= 1
+            return True
+        elif inst == 9:  # RET
+            self.ticks += 4
+            self.latch_ar("sp")
+            self.load()
+            self.emit("sp -= 1")
+            self.exit(crop_expr_to_int32("dr"), count)
+            return True
+        elif inst == 11:  # PUSH
+            self.ticks += {0: 3, 1: 5, 2: 3, 3: 5}[f]
+            self.emit("sp += 1")
+            if f in (1, 3):
+                self.latch_ar(imm if f == 1 else crop_expr_to_int32("ac + {}".format(operand(imm))))
+                self.load()
+            self.latch_ar("sp")
+            value = {0: imm, 1: "dr", 2: crop_expr_to_int32("ac + {}".format(operand(imm))), 3: "dr"}[f]
+            self.store(value, count)
+        elif inst == 12:  # POP
+            self.ticks += 4
+            self.latch_ar("sp")
+            self.load()
+            self.emit("ac = {}".format(crop_expr_to_int32("dr")))
+            self.emit("sp -= 1")
+        elif inst == 13:  # SWAP [SP+5]
+            self.ticks += 5
+            self.latch_ar("sp + {}".format(operand(imm)))
+            self.load()
+            self.emit("ac, dr = dr, ac")
+            self.store("dr", count)
+        return False
+
+    def jump(self, inst, f, imm, address, count):
+        # такты и AR перехода относятся только к ветке, где переход выполняется
+        ticks = self.ticks
+        ar = self.ar
+        if inst == 8:  # CALL
+            self.ticks += 4 if f == 0 else 5
+            self.emit("sp += 1")
+            self.latch_ar("sp")
+            self.emit("setmem(sp, {})".format(address + 1))
+        else:
+            self.ticks += 1 if f == 0 else 2
+        if f == 4:
+            self.ar = address + 1
+        self.exit(imm if f == 0 else crop_int_to_int32(address + 1 + imm), count)
+        self.ticks = ticks
+        self.ar = ar
+
+    def alu(self, op, right):
+        n = self.alu_count = self.alu_count + 1
+        carry_in = 0
+        if op == AluOps.ADC or op == AluOps.SBC:
+            carry_in = "cin{}".format(n)
+            self.emit("{} = {}".format(carry_in, self.carry()))
+        left = "ac"
+        if op in ALU_ARITHMETIC:
+            # операнды нужны для ленивого вычисления OF и C
+            left = "left{}".format(n)
+            self.emit("{} = ac".format(left))
+            if not isinstance(right, int):
+                self.emit("right{} = {}".format(n, right))
+                right = "right{}".format(n)
+        result = "out{}".format(n)
+        self.emit(
+            "{} = {}".format(result, ALU_EXPRESSIONS[ALU_OPERATIONS[op]].format(l=left, r=operand(right), c=carry_in))
+        )
+        self.result = result
+        if op in ALU_ARITHMETIC:
+            self.arith = (op, left, right, carry_in, result)
+        if op != AluOps.CMP:
+            self.emit("ac = {}".format(crop_expr_to_int32(result)))
+
+
+class BlockEngine:
+    """Исполнение программы базовыми блоками, скомпилированными в функции Python.
+
+    Блок начинается с адреса, на который пришло управление, и продолжается до
+    перехода (CALL/JMP/RET) или инструкции, которую блок исполнить не может
+    (HALT, IN, ошибочные кодировки). Такие инструкции исполняет пошаговый
+    `ControlUnit`. Запись в память, попавшая в скомпилированный блок,
+    удаляет его; если запись попала в исполняемый сейчас блок, он
+    завершается сразу после записывающей инструкции.
+    """
+
+    def __init__(self, control_unit):
+        self.control_unit = control_unit
+        self.data_path = control_unit.data_path
+        self.memory_manager = control_unit.data_path.memory_manager
+        self.instr_counter = 0
+        self.blocks = {}  # адрес начала -> (длина, функция) или None
+        self.cover = {}  # слово памяти -> адреса начала блоков, которые его содержат
+        self.namespace = {
+            "dp": self.data_path,
+            "cu": control_unit,
+            "mm": self.memory_manager,
+            "memory": self.memory_manager.memory,
+            "setmem": self.memory_manager.setmem,
+            "malloc": self.memory_manager.malloc,
+            "output_append": self.data_path.output_port.writer(),
+        }
+        self.memory_manager.write_listeners.append(self.invalidate)
+
+    def invalidate(self, index):
+        for start in self.cover.pop(index, ()):
+            block = self.blocks.pop(start, None)
+            if block is None:
+                continue
+            for address in range(start, start + block[0]):
+                if address != index:
+                    self.cover.get(address, set()).discard(start)
+
+    def add_block(self, address, length, function):
+        block = (length, function)
+        self.blocks[address] = block
+        for index in range(address, address + length):
+            self.cover.setdefault(index, set()).add(address)
+        return block
+
+    def compile_block(self, address):
+        words = scan_block(self.memory_manager.memory, address)
+        if not words:
+            self.blocks[address] = None
+            return None
+        name = "block_{}".format(address)
+        exec(BlockTranslator(address, words).source(name), self.namespace)
+        return self.add_block(address, len(words), self.namespace.pop(name))
+
+    def load_translation(self, code):
+        """Подключает блоки модуля, полученного `translate_image`."""
+        exec(code, self.namespace)
+        for address, (length, function) in self.namespace.pop("BLOCKS").items():
+            self.add_block(address, length, function)
+
+    def run(self, limit):
+        data_path = self.data_path
+        blocks = self.blocks
+        step = self.control_unit.decode_and_execute_instruction
+        while self.instr_counter < limit:
+            address = data_path.rIP
+            block = blocks.get(address, False)
+            if block is False:
+                block = self.compile_block(address)
+            if block is not None and block[0] <= limit - self.instr_counter:
+                self.instr_counter += block[1]()
+            else:
+                step()
+                self.instr_counter += 1
+
+
+def block_successors(memory, address, words):
+    """Адреса, на которые может перейти управление после блока."""
+    end = address + len(words)
+    if not words:  # инструкцию исполняет интерпретатор
+        return [] if memory[address] >> 28 == 1 else [address + 1]  # HALT
+    last = words[-1]
+    if classify_instruction(last) != BLOCK_END:
+        return [end]
+    inst = last >> 28 & 0xF
+    if inst == 9:  # RET: адреса возврата уже учтены при CALL
+        return []
+    imm = crop_int_to_int16(last)
+    target = imm if last >> 16 & 0x7 == 0 else crop_int_to_int32(end + imm)
+    if inst == 10 and last >> 20 & 0xF == 0:  # безусловный JMP
+        return [target]
+    return [target, end]
+
+
+def translate_image(memory, entry=0):
+    """Статическая трансляция образа программы в исходный код модуля Python.
+
+    Модуль содержит по функции на каждый достижимый из `entry` базовый блок и
+    таблицу `BLOCKS = {адрес: (длина, функция)}` для `BlockEngine`. Код не
+    зависит от входных данных, поэтому один модуль годится для любого ввода.
+    """
+    regions = {}
+    todo = [entry]
+    while todo:
+        address = todo.pop()
+        if address in regions or not 0 <= address < len(memory):
+            continue
+        regions[address] = scan_block(memory, address)
+        todo.extend(block_successors(memory, address, regions[address]))
+
+    lines = ["# Сгенерировано runner.translate_image, не редактировать.", ""]
+    table = []
+    for address, words in sorted(regions.items()):
+        if not words:
+            continue
+        name = "block_{}".format(address)
+        lines.append(BlockTranslator(address, words).source(name))
+        table.append("    {}: ({}, {}),".format(address, len(words), name))
+    lines.append("BLOCKS = {")
+    lines.extend(table)
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+translation_cache = {}
+
+
+def compile_translation(memory, cache_dir=None):
+    """Код модуля `translate_image` для образа `memory`.
+
+    Скомпилированный модуль кэшируется в памяти по хэшу образа, а при
+    заданном `cache_dir` его исходный код сохраняется на диск и
+    переиспользуется следующими запусками.
+    """
+    key = hashlib.sha256(memory.tobytes()).hexdigest()
+    if key in translation_cache:
+        return translation_cache[key]
+    path = pathlib.Path(cache_dir, key + ".py") if cache_dir is not None else None
+    if path is not None and path.exists():
+        source = path.read_text(encoding="utf-8")
+    else:
+        source = translate_image(memory)
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(source, encoding="utf-8")
+    code = compile(source, str(path) if path is not None else "<translation {}>".format(key[:12]), "exec")
+    translation_cache[key] = code
+    return code
+
+
+def translate_program(code_file, module_file):
+    """Транслирует образ, записанный `compiler.write_code`, в модуль Python."""
+    mm = MemoryManager()
+    load_program(mm, code_file)
+    with open(module_file, "w", encoding="utf-8") as f:
+        f.write(translate_image(mm.memory))
+
+
+# Снимок состояния машины: заголовок SNAPSHOT_HEADER (сигнатура, версия,
+# размер JSON-описания, число слов памяти), описание регистров, флагов,
+# счётчиков и ввода-вывода в JSON, затем слова памяти (32 бит, little-endian).
+SNAPSHOT_MAGIC = b"JSSN"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sHxxII")
+
+
+class Snapshot:
+    """Полное состояние машины: память, режим адресации, регистры, флаги,
+    такты и счётчики, число прочитанных символов ввода и уже выведенный
+    текст.
+
+    `take` снимает состояние с `ControlUnit`, `restore` восстанавливает его в
+    новую машину (память копируется одним блоком), `save`/`load` -- запись в
+    файл и чтение.
+    """
+
+    def __init__(self, memory, state):
+        self.memory = memory
+        self.state = state
+
+    @classmethod
+    def take(cls, control_unit, instr_counter):
+        data_path = control_unit.data_path
+        mm = data_path.memory_manager
+        state = {
+            "mod": mm.mod,
+            "regions": mm.regions,
+            "heap": mm.heap_state(),
+            "registers": [data_path.rAC, data_path.rAR, data_path.rSP, data_path.rIP, data_path.rDR],
+            "flags": [data_path.flags_result, data_path.flags_arith, data_path.flags_overflow, data_path.flags_carry],
+            "tick": control_unit.current_tick(),
+            "step_counter": control_unit.step_counter,
+            "instr_counter": instr_counter,
+            "input_consumed": data_path.input_port.consumed,
+            "output": "".join(data_path.output_buffer),
+        }
+        return cls(array.array("I", mm.memory), state)
+
+    @property
+    def instr_counter(self):
+        return self.state["instr_counter"]
+
+    def restore(self, mm, input_tokens, output_port=None, icache=None, dcache=None):
+        """Новые `DataPath` и `ControlUnit` в состоянии снимка; ввод
+        продолжается из `input_tokens`, уже выведенный текст передаётся в
+        `output_port`."""
+        state = self.state
+        assert not mm.memory, "restore into an empty MemoryManager"
+        mm.load_words(self.memory)
+        mm.mod = state["mod"]
+        mm.regions = [tuple(region) for region in state["regions"]]
+        if "heap" in state:
+            mm.set_heap_state(state["heap"])
+        data_path = DataPath(mm, input_tokens, output_port, icache, dcache)
+        data_path.rAC, data_path.rAR, data_path.rSP, data_path.rIP, data_path.rDR = state["registers"]
+        result, arith, overflow, carry = state["flags"]
+        data_path.flags_result = result
+        data_path.flags_arith = tuple(arith) if arith is not None else None
+        data_path.flags_overflow = overflow
+        data_path.flags_carry = carry
+        for symbol in state["output"]:
+            data_path.output_port.write(symbol)
+        control_unit = ControlUnit(data_path)
+        control_unit.tick(state["tick"])
+        control_unit.step_counter = state["step_counter"]
+        return data_path, control_unit
+
+    def save(self, file_name):
+        description = json.dumps(self.state).encode("utf-8")
+        memory = array.array("I", self.memory)
+        if sys.byteorder == "big":
+            memory.byteswap()
+        with open(file_name, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(description), len(memory)))
+            f.write(description)
+            f.write(memory.tobytes())
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, "rb") as f:
+            magic, version, size, count = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+            assert magic == SNAPSHOT_MAGIC, "not a snapshot"
+            assert version == SNAPSHOT_VERSION, "unsupported snapshot version"
+            state = json.loads(f.read(size).decode("utf-8"))
+            memory = array.array("I")
+            memory.frombytes(f.read(4 * count))
+            assert len(memory) == count, "truncated snapshot"
+        if sys.byteorder == "big":
+            memory.byteswap()
+        return cls(memory, state)
+
+
+def snapshot_before_input(mm, limit):
+    """Исполняет программу до первой инструкции `INT IN` и возвращает снимок
+    состояния перед ней. Если программа остановилась раньше или исчерпан
+    лимит инструкций, возвращает None."""
+    data_path = DataPath(mm, [])
     control_unit = ControlUnit(data_path)
     instr_counter = 0
-
-    logging.debug("%s", control_unit)
     try:
         while instr_counter < limit:
+            address = data_path.rIP
+            if 0 <= address < len(mm.memory) and mm.memory[address] >> 16 & 0xF0FF == 0x6001:  # INT IN
+                return Snapshot.take(control_unit, instr_counter)
             control_unit.decode_and_execute_instruction()
             instr_counter += 1
-            logging.debug("%s", control_unit)
+    except TypeError:
+        pass
+    return None
+
+
+def simulation(
+    mm,
+    input_tokens,
+    limit,
+    engine="step",
+    output_port=None,
+    cache=None,
+    icache=None,
+    dcache=None,
+    trace=None,
+    profile=None,
+    start=None,
+):
+    """Запуск модели процессора.
+
+    `input_tokens` -- список кодов символов или порт ввода (`InputPort`),
+    `output_port` -- порт вывода (`OutputPort`), по умолчанию вывод только
+    копится в памяти.
+
+    `engine` -- "step" (пошаговый интерпретатор с журналом каждой инструкции),
+    "blocks" (`BlockEngine`, журнал по инструкциям не ведётся) или
+    "translated" (`BlockEngine` с заранее оттранслированным образом).
+
+    `cache` -- общий кэш инструкций и данных (`Cache`), `icache`/`dcache` --
+    раздельные. Статистика по областям берётся из `mm.regions`, если у кэша
+    они не заданы. Блоки читают память напрямую, поэтому кэши моделируются
+    только пошаговым интерпретатором.
+
+    `trace` -- `TraceRecorder`, который вместо журнала `logging.debug`
+    записывает состояние после каждого шага пошагового интерпретатора,
+    `profile` -- `Profiler`, который собирает профиль исполнения.
+
+    `start` -- `Snapshot`, с которого продолжается исполнение (тогда `mm` --
+    пустой `MemoryManager`, в который восстанавливается память снимка).
+    """
+    assert trace is None or engine == "step", "trace requires engine='step'"
+    assert profile is None or engine == "step", "profile requires engine='step'"
+    if cache is not None:
+        icache = dcache = cache
+    caches = [c for c in (icache, dcache) if c is not None]
+    assert not caches or engine == "step", "cache model requires engine='step'"
+    if start is not None:
+        data_path, control_unit = start.restore(mm, input_tokens, output_port, icache, dcache)
+        instr_counter = start.instr_counter
+    else:
+        data_path = DataPath(mm, input_tokens, output_port, icache, dcache)
+        control_unit = ControlUnit(data_path)
+        instr_counter = 0
+    for c in caches:
+        if c.regions is None:
+            c.set_regions(mm.regions)
+    block_engine = BlockEngine(control_unit) if engine in ("blocks", "translated") else None
+    if block_engine is not None:
+        block_engine.instr_counter = instr_counter
+    if engine == "translated":
+        block_engine.load_translation(compile_translation(mm.memory))
+    trace_status = 0
+
+    if trace is not None:
+        trace.record(control_unit)
+    else:
+        logging.debug("%s", control_unit)
+    try:
+        if block_engine is not None:
+            block_engine.run(limit)
+        elif profile is not None:
+            profile.start(mm)
+            step = control_unit.decode_and_execute_instruction
+            while instr_counter < limit:
+                address, tick, sp = data_path.rIP, control_unit.current_tick(), data_path.rSP
+                step()
+                instr_counter += 1
+                profile.record(address, control_unit.current_tick() - tick, sp, data_path)
+                if trace is not None:
+                    trace.record(control_unit)
+                else:
+                    logging.debug("%s", control_unit)
+        elif trace is not None:
+            step, record = control_unit.decode_and_execute_instruction, trace.record
+            while instr_counter < limit:
+                step()
+                instr_counter += 1
+                record(control_unit)
+        else:
+            while instr_counter < limit:
+                control_unit.decode_and_execute_instruction()
+                instr_counter += 1
+                logging.debug("%s", control_unit)
     except EOFError:
+        trace_status |= TRACE_END_INPUT_EMPTY
         logging.warning("Input buffer is empty!")
     except TypeError:
         pass
+    if block_engine is not None:
+        instr_counter = block_engine.instr_counter
 
     if instr_counter >= limit:
+        trace_status |= TRACE_END_LIMIT
         logging.warning("Limit exceeded!")
+    if trace is not None:
+        trace.finish(control_unit, trace_status)
+    data_path.output_port.close()
     logging.info("output_buffer: %s", repr("".join(data_path.output_buffer)))
+    if icache is dcache and icache is not None:
+        logging.info("cache: %s", icache.report())
+    else:
+        if icache is not None:
+            logging.info("icache: %s", icache.report())
+        if dcache is not None:
+            logging.info("dcache: %s", dcache.report())
     return "".join(data_path.output_buffer), instr_counter, control_unit.current_tick()
 
 
-def main(code_file, input_file, debug_file=None):
+LANE_RUNNING = 0
+LANE_STOPPED = 1  # HALT или ошибка исполнения
+LANE_INPUT_EMPTY = 2
+LANE_FAULT = 3  # ошибка памяти (адрес вне памяти машины), исключение -- в `errors`
+
+
+class LaneAddressError(Exception):
+    """Адрес обращения к памяти у машин `lanes` вне их памяти."""
+
+    def __init__(self, lanes):
+        super().__init__(lanes)
+        self.lanes = lanes
+
+
+class LockstepEngine:
+    """Исполнение одного образа на многих входах одновременно (NumPy).
+
+    Состояние N машин хранится массивами: регистры и флаги -- по элементу на
+    машину, память -- матрица N x слов. На каждом шаге выбирается наименьший
+    IP среди работающих машин, и инструкция по этому адресу исполняется
+    векторно для всех машин, стоящих на нём; остальные ждут (так машины,
+    разошедшиеся на ветвлении, снова сходятся). Семантика и такты инструкций
+    те же, что у `ControlUnit`. `MALLOC` и `FREE` исполняет для каждой машины
+    `ControlUnit` над её распределителем (`MemoryManager` с состоянием кучи,
+    содержимое памяти не копируется); ошибочные кодировки и операции, которые
+    векторно не считаются (сдвиг на отрицательное число, остаток от деления
+    на 0), -- пошаговый `ControlUnit` над копией памяти машины.
+
+    Адреса отсчитываются в памяти каждой машины (`length`), как в
+    `MemoryManager`: отрицательный -- от её конца, а обращение за её пределы
+    машина исполняет пошагово, и оно завершает ошибкой только эту машину.
+
+    `inputs` -- по списку кодов символов (или порту ввода) на машину. `run`
+    возвращает по кортежу `(вывод, instr_counter, ticks)` на машину, как
+    `simulation`; исключение, которым `simulation` завершилась бы на машине
+    с ошибкой памяти, сохраняется в `errors`.
+    """
+
+    def __init__(self, words, inputs):
+        assert np is not None, "LockstepEngine requires numpy"
+        self.count = len(inputs)
+        self.length = np.full(self.count, len(words), dtype=np.int64)  # длина памяти каждой машины
+        self.memory = np.tile(np.array(words, dtype=np.uint32), (self.count, 1))
+        self.views = None
+        self._make_views()
+        self.ac = np.zeros(self.count, dtype=np.int64)
+        self.sp = np.zeros(self.count, dtype=np.int64)
+        self.ip = np.zeros(self.count, dtype=np.int64)
+        self.of = np.zeros(self.count, dtype=bool)
+        self.c = np.zeros(self.count, dtype=bool)
+        self.z = np.ones(self.count, dtype=bool)
+        self.s = np.zeros(self.count, dtype=bool)
+        self.ticks = np.zeros(self.count, dtype=np.int64)
+        self.instr_counter = np.zeros(self.count, dtype=np.int64)
+        self.status = np.full(self.count, LANE_RUNNING, dtype=np.int8)
+        self.input_ports = [port if hasattr(port, "read") else TokenInputPort(port) for port in inputs]
+        self.output_ports = [OutputPort() for _ in inputs]
+        self.writers = [port.writer() for port in self.output_ports]
+        self.heaps = [None] * self.count  # распределители (MemoryManager) машин, выделявших память
+        self.errors = [None] * self.count
+        self.decoded = {}
+        self.control_unit = None
+
+    def _make_views(self):
+        self.views = {1: self.memory, 2: self.memory.view(np.uint16), 4: self.memory.view(np.uint8)}
+
+    def _widen(self, length):
+        memory = np.zeros((self.count, max(length, 2 * self.memory.shape[1])), dtype=np.uint32)
+        memory[:, : self.memory.shape[1]] = self.memory
+        self.memory = memory
+        self._make_views()
+
+    def index(self, lanes, address, mod):
+        """Индексы ячеек `address` машин `lanes` в `views[mod]`; адрес вне памяти
+        машины -- `LaneAddressError` до каких-либо изменений её состояния."""
+        size = self.length[lanes] * mod
+        address = np.asarray(address)
+        outside = (address < -size) | (address >= size)
+        if outside.any():
+            raise LaneAddressError(lanes[outside])
+        return np.where(address < 0, address + size, address) ^ MemoryManager.SWAP[mod]
+
+    def load(self, lanes, address, mod=1):
+        return self.views[mod][lanes, self.index(lanes, address, mod)].astype(np.int64)
+
+    def store(self, lanes, address, value, mod=1):
+        self.views[mod][lanes, self.index(lanes, address, mod)] = value & MemoryManager.MASK[mod]
+
+    def run(self, limit):
+        idle = np.iinfo(np.int64).max
+        active = (self.status == LANE_RUNNING) & (self.instr_counter < limit)
+        while active.any():
+            ips = np.where(active, self.ip, idle)
+            ip = int(ips.min())
+            lanes = np.flatnonzero(ips == ip)
+            outside = (ip < 0) | (ip >= self.length[lanes])
+            if outside.any():  # IP вне памяти машины: выборку делает пошаговый ControlUnit
+                self.fallback(lanes[outside], ip)
+                active[lanes] = (self.status[lanes] == LANE_RUNNING) & (self.instr_counter[lanes] < limit)
+                continue
+            words = self.memory[lanes, ip]
+            word = int(words[0])
+            if len(lanes) > 1:
+                same = words == word
+                if not same.all():  # код машин различается (самомодификация)
+                    lanes = lanes[same]
+            group = lanes
+            while len(lanes):
+                try:
+                    self.execute(lanes, ip, word)
+                    break
+                except LaneAddressError as fault:
+                    # машины с адресом вне своей памяти исполняют инструкцию пошагово
+                    self.fallback(fault.lanes, ip)
+                    lanes = np.setdiff1d(lanes, fault.lanes)
+            active[group] = (self.status[group] == LANE_RUNNING) & (self.instr_counter[group] < limit)
+        for port in self.output_ports:
+            port.close()
+        return [
+            ("".join(port.buffer), int(counter), int(ticks))
+            for port, counter, ticks in zip(self.output_ports, self.instr_counter, self.ticks)
+        ]
+
+    def decode(self, word):
+        record = self.decoded.get(word)
+        if record is None:
+            # INST, RR, FFF, OPER/COND/INT_CODE, A
+            field = word >> 16 & 0xFF if word >> 28 == 6 else word >> 20 & 0xF
+            record = (word >> 28 & 0xF, word >> 26 & 0x3, word >> 16 & 0x7, field, crop_int_to_int16(word))
+            self.decoded[word] = record
+        return record
+
+    def execute(self, lanes, ip, word):  # noqa: C901
+        """Исполняет инструкцию `word` по адресу `ip` на машинах `lanes`."""
+        inst, rr, f, field, imm = self.decode(word)
+        next_ip = crop_int_to_int32(ip + 1)
+        if inst in (0, 14, 15):  # NOP
+            self.ip[lanes] = next_ip
+            self.instr_counter[lanes] += 1
+            return
+        if inst == 1:  # HALT
+            self.ip[lanes] = next_ip
+            self.status[lanes] = LANE_STOPPED
+            return
+        if inst == 2:  # MOV A ...
+            if rr == 3 or f in (4, 5, 6) or (f == 7 and rr != 2):
+                self.fallback(lanes, ip)
+                return
+            mod = {2: 1, 1: 2, 0: 4}[rr]
+            ticks = 1 if f in (0, 2) else 3 if f in (1, 3) else 4
+            if f == 0:
+                ac = imm
+            elif f == 2:
+                ac = crop_int_to_int32(self.ac[lanes] + imm)
+            elif f == 1:
+                ac = crop_int_to_int32(self.load(lanes, imm, mod))
+            elif f == 3:
+                ac = crop_int_to_int32(self.load(lanes, crop_int_to_int32(self.ac[lanes] + imm), mod))
+            else:
+                ac = crop_int_to_int32(self.load(lanes, crop_int_to_int32(crop_int_to_int32(self.sp[lanes]) + imm)))
+            self.ac[lanes] = ac
+            self.ticks[lanes] += ticks if rr == 2 else ticks + 2
+        elif inst == 3:  # MOV [...] A
+            if f in (4, 5) or (f in (0, 7) and rr == 3):
+                self.fallback(lanes, ip)
+                return
+            ticks = {0: 2, 1: 4, 2: 3, 3: 4, 6: 3, 7: 5}[f]
+            if f == 0:
+                address = imm
+            elif f == 1:
+                address = crop_int_to_int32(self.load(lanes, imm))
+            elif f == 2:
+                address = crop_int_to_int32(self.ac[lanes] + imm)
+            elif f == 3:
+                address = crop_int_to_int32(self.load(lanes, crop_int_to_int32(self.ac[lanes] + imm)))
+            elif f == 6:
+                address = crop_int_to_int32(imm + self.sp[lanes])
+            else:
+                address = crop_int_to_int32(self.load(lanes, crop_int_to_int32(imm + self.sp[lanes])))
+            mod = 1
+            if f in (0, 7) and rr != 2:
+                mod = {0: 4, 1: 2}[rr]
+                ticks += 2
+            self.store(lanes, address, crop_int_to_int32(self.ac[lanes]), mod)
+            self.ticks[lanes] += ticks
+        elif inst == 4:  # ALU
+            if field >= len(ALU_OPERATIONS) or f in (2, 4, 5, 6) or (f == 7 and rr != 2):
+                self.fallback(lanes, ip)
+                return
+            if f == 0:
+                right = np.full(len(lanes), imm, dtype=np.int64)
+            elif f == 1:
+                right = self.load(lanes, imm)
+            elif f == 3:
+                right = self.load(lanes, crop_int_to_int32(self.ac[lanes] + imm))
+            else:
+                right = self.load(lanes, crop_int_to_int32(crop_int_to_int32(self.sp[lanes]) + imm))
+            if field in (AluOps.SHR, AluOps.SHL, AluOps.MOD):
+                bad = right == 0 if field == AluOps.MOD else right < 0
+                if bad.any():
+                    self.fallback(lanes[bad], ip)
+                    lanes, right = lanes[~bad], right[~bad]
+            self.alu(lanes, field, right)
+            self.ticks[lanes] += 1 if f == 0 else 4 if f == 7 else 3
+        elif inst == 6:  # INT
+            if field == 0:  # OUT
+                writers = self.writers
+                for lane, ac in zip(lanes.tolist(), self.ac[lanes].tolist()):
+                    writers[lane](chr(ac))
+                self.ticks[lanes] += 1
+            elif field == 1:  # IN
+                self.ticks[lanes] += 1
+                empty = []
+                for lane in lanes.tolist():
+                    try:
+                        self.ac[lane] = self.input_ports[lane].read()
+                    except EOFError:
+                        empty.append(lane)
+                if empty:
+                    self.ip[empty] = next_ip
+                    self.status[empty] = LANE_INPUT_EMPTY
+                    lanes = np.setdiff1d(lanes, empty)
+            elif field in (2, 3, 4, 5):  # MALLOC32, MALLOC16, MALLOC8, FREE
+                self.allocate(lanes, ip, field)
+                return
+        elif inst in (8, 10):  # CALL, JMP
+            taken = self.condition(lanes, field)
+            if taken is not None and taken.any():
+                if f not in (0, 4):
+                    self.fallback(lanes[taken], ip)
+                else:
+                    self.branch(lanes[taken], inst, f, imm, next_ip)
+                lanes = lanes[~taken]
+            self.ip[lanes] = next_ip
+            self.instr_counter[lanes] += 1
+            return
+        elif inst == 9:  # RET
+            sp = self.sp[lanes]
+            self.ip[lanes] = crop_int_to_int32(self.load(lanes, crop_int_to_int32(sp)))
+            self.sp[lanes] = sp - 1
+            self.ticks[lanes] += 4
+            self.instr_counter[lanes] += 1
+            return
+        elif inst == 11:  # PUSH
+            if f >= 4:
+                self.fallback(lanes, ip)
+                return
+            if f == 0:
+                value = imm
+            elif f == 1:
+                value = crop_int_to_int32(self.load(lanes, imm))
+            elif f == 2:
+                value = crop_int_to_int32(self.ac[lanes] + imm)
+            else:
+                value = crop_int_to_int32(self.load(lanes, crop_int_to_int32(self.ac[lanes] + imm)))
+            sp = self.sp[lanes] + 1
+            self.store(lanes, crop_int_to_int32(sp), value)
+            self.sp[lanes] = sp
+            self.ticks[lanes] += 3 if f in (0, 2) else 5
+        elif inst == 12:  # POP
+            sp = self.sp[lanes]
+            self.ac[lanes] = crop_int_to_int32(self.load(lanes, crop_int_to_int32(sp)))
+            self.sp[lanes] = sp - 1
+            self.ticks[lanes] += 4
+        elif inst == 13:  # SWAP
+            if f != 6:
+                self.fallback(lanes, ip)
+                return
+            address = crop_int_to_int32(crop_int_to_int32(self.sp[lanes]) + imm)
+            value = self.load(lanes, address)
+            self.store(lanes, address, crop_int_to_int32(self.ac[lanes]))
+            self.ac[lanes] = value
+            self.ticks[lanes] += 5
+        else:  # унарные операции АЛУ и зарезервированный код -- ошибки
+            self.fallback(lanes, ip)
+            return
+        self.ip[lanes] = next_ip
+        self.instr_counter[lanes] += 1
+
+    def alu(self, lanes, op, right):
+        """`DataPath.alu` с установкой флагов: AC := AC op right."""
+        left = self.ac[lanes]
+        z = s = None
+        if op in (AluOps.ADC, AluOps.SBC):
+            carry = self.c[lanes].astype(np.int64)
+            out = left + right + carry if op == AluOps.ADC else left - right - carry
+        elif op == AluOps.SHL:
+            # точный результат может не уместиться в 64 бита: флаги -- по знаку левого операнда
+            out = np.where(right < 32, (left & 0xFFFFFFFF) << np.minimum(right, 31), 0)
+            z, s = left == 0, left < 0
+        elif op == AluOps.SHR:
+            out = left >> np.minimum(right, 63)
+        elif op == AluOps.MUL:
+            out = left * right
+            z = (left == 0) | (right == 0)
+            s = ((left < 0) != (right < 0)) & ~z
+        else:
+            out = ALU_FUNCTIONS[op](left, right, 0)
+        self.z[lanes] = out == 0 if z is None else z
+        self.s[lanes] = out < 0 if s is None else s
+        if op in ALU_ARITHMETIC:
+            self.of[lanes] = crop_int_to_int32(out) != out
+            if op in (AluOps.ADD, AluOps.ADC):
+                carry = carry if op == AluOps.ADC else 0
+                self.c[lanes] = (left & 0xFFFFFFFF) + (right & 0xFFFFFFFF) + carry > 0xFFFFFFFF
+            else:
+                self.c[lanes] = False
+        if op != AluOps.CMP:
+            self.ac[lanes] = crop_int_to_int32(out)
+
+    def condition(self, lanes, cond):
+        """Маска машин, для которых выполняется условие перехода (None -- ни для одной)."""
+        if cond == 0:
+            return np.ones(len(lanes), dtype=bool)
+        if cond >= len(CONDITION_EXPRESSIONS):
+            return None
+        z = self.z[lanes]
+        less = self.s[lanes] ^ self.of[lanes]
+        return [None, z, ~z, ~(less | z), less, ~less, less | z][cond]
+
+    def branch(self, lanes, inst, f, imm, next_ip):
+        target = imm if f == 0 else crop_int_to_int32(next_ip + imm)
+        if inst == 8:  # CALL: MEM(++SP) = IP
+            sp = self.sp[lanes] + 1
+            self.store(lanes, crop_int_to_int32(sp), next_ip)
+            self.sp[lanes] = sp
+        self.ip[lanes] = target
+        self.ticks[lanes] += (4 if f == 0 else 5) if inst == 8 else (1 if f == 0 else 2)
+        self.instr_counter[lanes] += 1
+
+    def shared_control_unit(self):
+        if self.control_unit is None:
+            # один ControlUnit на все машины: перед шагом в него подставляется состояние машины
+            self.control_unit = ControlUnit(DataPath(MemoryManager(), []))
+        return self.control_unit
+
+    def step_lane(self, lane, mm, ip, execute):
+        """Исполняет `execute()` на общем `ControlUnit` с регистрами машины
+        `lane` и памятью `mm`, затем возвращает регистры, флаги и такты машине."""
+        control_unit = self.shared_control_unit()
+        data_path = control_unit.data_path
+        data_path.memory_manager = mm
+        data_path.input_port = self.input_ports[lane]
+        data_path.output_port = self.output_ports[lane]
+        data_path.output_buffer = data_path.output_port.buffer
+        data_path.rAC, data_path.rSP, data_path.rIP = int(self.ac[lane]), int(self.sp[lane]), ip
+        data_path.set_flags(bool(self.of[lane]), bool(self.c[lane]), bool(self.z[lane]), bool(self.s[lane]))
+        tick = control_unit.current_tick()
+        try:
+            execute()
+            self.instr_counter[lane] += 1
+        except EOFError:
+            self.status[lane] = LANE_INPUT_EMPTY
+        except TypeError:
+            self.status[lane] = LANE_STOPPED
+        except (AssertionError, IndexError, OverflowError) as error:  # simulation завершилась бы этой ошибкой
+            self.status[lane] = LANE_FAULT
+            self.errors[lane] = error
+        self.ac[lane], self.sp[lane], self.ip[lane] = data_path.rAC, data_path.rSP, data_path.rIP
+        flags = data_path.alu_flags
+        self.of[lane], self.c[lane], self.z[lane], self.s[lane] = flags["OF"], flags["C"], flags["Z"], flags["S"]
+        self.ticks[lane] += control_unit.current_tick() - tick
+
+    def fallback(self, lanes, ip):
+        """Исполняет инструкцию по адресу `ip` на каждой машине из `lanes`
+        пошаговым `ControlUnit` над копией памяти машины (размер памяти эти
+        инструкции не меняют)."""
+        control_unit = self.shared_control_unit()
+        for lane in lanes.tolist():
+            mm = MemoryManager()
+            mm.load_words(array.array("I", self.memory[lane, : self.length[lane]].tobytes()))
+            control_unit.decoded.clear()
+            self.step_lane(lane, mm, ip, control_unit.decode_and_execute_instruction)
+            self.memory[lane, : len(mm.memory)] = np.frombuffer(mm.memory, dtype=np.uint32)
+
+    def allocate(self, lanes, ip, int_code):
+        """Исполняет `MALLOC`/`FREE` (`int_code`) на каждой машине из `lanes`.
+
+        У каждой выделявшей память машины свой распределитель -- `MemoryManager`
+        с её кучей и длиной памяти; содержимое памяти машины в него не
+        копируется, выделенный блок обнуляется прямо в её строке.
+        """
+        control_unit = self.shared_control_unit()
+        interrupt = control_unit.interrupts[int_code]
+        for lane in lanes.tolist():
+            heap = self.heaps[lane]
+            if heap is None:
+                heap = self.heaps[lane] = MemoryManager()
+                heap.grow(int(self.length[lane]))
+            allocations = heap.heap_allocations
+            # IP уже указывает на следующую инструкцию, как после выборки
+            self.step_lane(lane, heap, crop_int_to_int32(ip + 1), interrupt)
+            length = len(heap.memory)
+            if length > self.memory.shape[1]:
+                self._widen(length)
+            self.length[lane] = length
+            if heap.heap_allocations != allocations:
+                address = control_unit.data_path.rDR
+                self.memory[lane, address : address + heap.heap_blocks[address]] = 0
+
+
+batch_image = None  # (слова, области, движок, лимит, снимок) образа рабочих процессов run_batch
+
+
+def batch_init(words, regions, engine, limit, start):
+    global batch_image
+    batch_image = (words, regions, engine, limit, start)
+    if engine == "translated":
+        compile_translation(words if start is None else start.memory)
+
+
+def batch_run(input_file):
+    words, regions, engine, limit, start = batch_image
+    mm = MemoryManager()
+    if start is None:
+        mm.load_words(words)
+        mm.regions = regions
+    with open(input_file, encoding="utf-8") as file:
+        return simulation(mm, InputPort(file), limit=limit, engine=engine, start=start)
+
+
+def run_batch(code_file, input_files, limit=1500, engine="step", workers=None, snapshot=False):
+    """Исполняет один образ на многих входных файлах.
+
+    Образ загружается (для `engine="translated"` -- и транслируется) один раз
+    и передаётся рабочим процессам; при запуске через fork они разделяют его
+    память с родителем. Результаты `(вывод, instr_counter, ticks)` выдаются
+    по мере готовности в порядке `input_files`. `workers` -- число процессов
+    (по умолчанию -- по числу ядер), при `workers=1` всё исполняется в
+    текущем процессе.
+
+    При `snapshot=True` общая для всех входов часть исполнения -- до первой
+    инструкции `INT IN` -- выполняется один раз, а каждый запуск начинается
+    со снимка этого состояния.
+
+    `engine="lockstep"` исполняет все входы в текущем процессе одним
+    `LockstepEngine` (нужен numpy); результаты выдаются после завершения всех
+    запусков.
+    """
+    mm = MemoryManager()
+    load_program(mm, code_file)
+    if engine == "lockstep":
+        assert not snapshot, "snapshot is not supported by engine='lockstep'"
+        inputs = []
+        for input_file in input_files:
+            with open(input_file, encoding="utf-8") as file:
+                inputs.append([ord(symbol) for symbol in file.read()] + [0])
+        engine = LockstepEngine(mm.memory, inputs)
+        for result, error in zip(engine.run(limit), engine.errors):
+            if error is not None:
+                raise error
+            yield result
+        return
+    start = snapshot_before_input(mm.copy(), limit) if snapshot else None
+    initargs = (mm.memory, mm.regions, engine, limit, start)
+    if workers == 1:
+        batch_init(*initargs)
+        yield from map(batch_run, input_files)
+        return
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    if engine == "translated":
+        # рабочие процессы получат оттранслированный код через fork
+        compile_translation(mm.memory if start is None else start.memory)
+    with concurrent.futures.ProcessPoolExecutor(workers, context, batch_init, initargs) as executor:
+        yield from executor.map(batch_run, input_files, chunksize=16)
+
+
+def main(code_file, input_file, debug_file=None, engine="step", flush="line", cache=None):
     mm = MemoryManager()
 
     def read_code(file_name):
@@ -1084,17 +2924,17 @@ def main(code_file, input_file, debug_file=None):
     if debug_file is not None:
         logging.basicConfig(filename=debug_file, filemode="w", level=logging.DEBUG, force=True)
     read_code(code_file)
-    input_token = []
+    # вывод программы печатается по ходу симуляции
+    output_port = OutputPort(sys.stdout, flush=flush)
     with open(input_file, encoding="utf-8") as file:
-        input_text = file.read()
-        for char in input_text:
-            input_token.append(ord(char))
-        input_token.append(0)
-
-    output, instr_counter, ticks = simulation(mm, input_tokens=input_token, limit=1500)
+        _, instr_counter, ticks = simulation(
+            mm, InputPort(file), limit=1500, engine=engine, output_port=output_port, cache=cache
+        )
 
-    print("".join(output))
+    print()
     print("instr_counter: ", instr_counter, "ticks:", ticks)
+    if cache is not None:
+        print("cache:", cache.report())
 
 
 if __name__ == "__main__":
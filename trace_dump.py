@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+"""Текст журнала симуляции по двоичной трассе `runner.TraceRecorder`.
+
+Без выборки и фильтров вывод совпадает с журналом `runner.main` (`out_dbg`
+golden-тестов): `trace_dump.py <trace_file> <code_file>`.
+"""
+
+import sys
+
+import runner
+
+
+def render(records, programm):
+    output = []
+    for kind, flags, tick, ip, ac, sp, ar in records:
+        if kind == runner.TRACE_OUTPUT:
+            output.append(chr(ac))
+        elif kind == runner.TRACE_STATE:
+            alu_flags = {"OF": bool(flags & 1), "C": bool(flags & 2), "Z": bool(flags & 4), "S": bool(flags & 8)}
+            yield "DEBUG:root:" + runner.STATE_FORMAT.format(tick, ac, sp, ar, ip, alu_flags, output, programm[ip])
+        else:
+            if ac & runner.TRACE_END_INPUT_EMPTY:
+                yield "WARNING:root:Input buffer is empty!"
+            if ac & runner.TRACE_END_LIMIT:
+                yield "WARNING:root:Limit exceeded!"
+            yield "INFO:root:output_buffer: {}".format(repr("".join(output)))
+
+
+def main(trace_file, code_file):
+    runner.load_program(runner.MemoryManager(), code_file)
+    for line in render(runner.read_trace(trace_file), runner.programm):
+        print(line)
+
+
+if __name__ == "__main__":
+    assert len(sys.argv) == 3, "Wrong arguments: trace_dump.py <trace_file> <code_file>"
+    _, trace_file, code_file = sys.argv
+    main(trace_file, code_file)